@@ -0,0 +1,51 @@
+"""
+Benchmark of the Azure event serializer: synthetic Activity Log EventData objects (built from the SDK
+models, with nested authorization, claims, HTTP request info and localizable strings) are serialized
+with the original json.dumps(event.__dict__, default=datetime_handler) and with encode_azure_event.
+Reports events/s for both (best of several rounds) and checks that every event serializes to
+byte-identical JSON.
+
+    python benchmarks/bench_azure_encoder.py --events 50000 --rounds 5
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from cloudtail_modules.azure_encoder import encode_azure_event
+from cloudtail_modules.database_utils import datetime_handler
+from synthetic_events import make_azure_events
+
+
+def timed(func, events):
+    started = time.perf_counter()
+    encoded = [func(event.__dict__) for event in events]
+    return time.perf_counter() - started, encoded
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--events', type=int, default=20000)
+    parser.add_argument('--rounds', type=int, default=5)
+    args = parser.parse_args()
+
+    events = make_azure_events(args.events)
+    baseline = fast = float('inf')
+    # Rounds alternate between the two so that both see the same machine load.
+    for _ in range(args.rounds):
+        elapsed, expected = timed(lambda event: json.dumps(event, default=datetime_handler), events)
+        baseline = min(baseline, elapsed)
+        elapsed, encoded = timed(encode_azure_event, events)
+        fast = min(fast, elapsed)
+    mismatches = sum(1 for a, b in zip(expected, encoded) if a != b)
+
+    print(f"datetime_handler   {args.events / baseline:9.0f} events/s")
+    print(f"encode_azure_event {args.events / fast:9.0f} events/s  ({baseline / fast:.1f}x)  byte-identical: {mismatches == 0}")
+    assert mismatches == 0, f"{mismatches} events serialized differently"
+
+
+if __name__ == '__main__':
+    main()
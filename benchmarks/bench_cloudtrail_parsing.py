@@ -0,0 +1,69 @@
+"""
+Benchmark of the per-event CloudTrail path for exact attribute rules: the eager path (json.loads every
+CloudTrailEvent, match, json.dumps the matches) against LazyCloudTrailEvent (match on the envelope,
+store the raw JSON with the envelope fields spliced in). Reports events/s for several match rates and
+checks that both paths store equivalent JSON.
+
+    python benchmarks/bench_cloudtrail_parsing.py --events 50000
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from cloudtail_modules.aws_processor import LazyCloudTrailEvent, build_aws_rule_indexes, parse_cloudtrail_event
+from cloudtail_modules.database_utils import datetime_handler
+from synthetic_events import EVENT_NAMES, make_lookup_events
+
+def make_rules(names):
+    return [{'server_filter': ('EventName', name), 'attribute_key': 'EventName', 'attribute_value': name, 'apply_fuzzy_matching': False} for name in names]
+
+
+def run_eager(envelopes, rules):
+    envelope_index, parsed_index = build_aws_rule_indexes(rules)
+    stored = []
+    for envelope in envelopes:
+        event_data = parse_cloudtrail_event(envelope)
+        if envelope_index.match(envelope) + parsed_index.match(event_data):
+            stored.append(json.dumps(event_data, default=datetime_handler))
+    return stored
+
+
+def run_lazy(envelopes, rules):
+    envelope_index, parsed_index = build_aws_rule_indexes(rules)
+    stored = []
+    for envelope in envelopes:
+        event = LazyCloudTrailEvent(envelope)
+        if envelope_index.match(event.envelope) + (parsed_index.match(event.data) if parsed_index.conditional else parsed_index.unconditional):
+            if event.is_valid():
+                stored.append(event.to_json())
+    return stored
+
+
+def timed(func, *args):
+    started = time.perf_counter()
+    result = func(*args)
+    return time.perf_counter() - started, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--events', type=int, default=20000)
+    args = parser.parse_args()
+
+    envelopes = make_lookup_events(args.events)
+    for matched_names in (EVENT_NAMES[:1], EVENT_NAMES[:4], EVENT_NAMES):
+        rules = make_rules(matched_names)
+        eager, expected = timed(run_eager, envelopes, rules)
+        lazy, stored = timed(run_lazy, envelopes, rules)
+        equivalent = len(expected) == len(stored) and all(json.loads(a) == json.loads(b) for a, b in zip(expected, stored))
+        print(f"{len(stored) / len(envelopes):4.0%} matched  eager {len(envelopes) / eager:9.0f} events/s  lazy {len(envelopes) / lazy:9.0f} events/s  "
+              f"({eager / lazy:.1f}x)  equivalent JSON: {equivalent}")
+        assert equivalent, "lazy and eager paths stored different events"
+
+
+if __name__ == '__main__':
+    main()
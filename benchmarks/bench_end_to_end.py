@@ -0,0 +1,294 @@
+"""
+End-to-end benchmark that needs no cloud accounts. Synthetic LookupEvents pages are served to
+process_aws_events through a botocore Stubber (which also validates every request and response against
+the service model). Synthetic Azure EventData objects reach process_azure_events through a stand-in
+MonitorManagementClient whose activity_logs.list returns an azure-core pager.
+
+Each stage is also timed on its own: fetch, parse, match, fuzzy_match, JMESPath filter, serialize,
+write_events and export via append_or_write_json. The script writes a JSON report with events/s per
+stage and the peak RSS after each stage (the process high-water mark), so runs of different versions
+can be compared.
+
+    python benchmarks/bench_end_to_end.py --aws-events 20000 --azure-events 10000 --output report.json
+"""
+import argparse
+import contextlib
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+REPO_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, REPO_DIR)
+
+import boto3
+import jmespath
+from azure.core.paging import ItemPaged
+from botocore.stub import Stubber
+
+from cloudtail_modules import aws_processor, azure_processor
+from cloudtail_modules.aws_processor import LazyCloudTrailEvent, build_aws_rules, build_aws_rule_indexes, get_cloudtrail_events, parse_cloudtrail_event, process_aws_events
+from cloudtail_modules.azure_processor import build_azure_rules, build_azure_rule_index, get_azure_events, process_azure_events
+from cloudtail_modules.database_utils import setup_database_connection_and_tables, add_execution_history, build_event_row, write_events
+from cloudtail_modules.export_results import fetch_events, append_or_write_json
+from cloudtail_modules.rule_engine import fuzzy_match
+from synthetic_events import make_lookup_events, make_lookup_pages, make_azure_events
+
+ACCOUNT_ID = '111122223333'
+PROFILE_NAME = 'bench'
+SUBSCRIPTION_ID = '00000000-1111-2222-3333-444444444444'
+AZURE_PAGE_SIZE = 200
+
+# An exact, a wildcard and a JMESPath-only rule: they share one unfiltered LookupEvents scan.
+AWS_RULES = [
+    {'RuleName': 'Bucket Writes', 'AttributeKey': 'EventName', 'AttributeValue': 'PutObject'},
+    {'RuleName': 'Describe Calls', 'AttributeKey': 'EventName', 'AttributeValue': 'Describe*'},
+    {'RuleName': 'Bucket 1 Reads', 'jmes_filter': "[?eventName == 'GetObject' && requestParameters.bucketName == 'bucket-1']"},
+]
+FUZZY_PATTERN = 'Describe*'
+
+AZURE_RULES = [
+    {'RuleName': 'Role Assignments', 'AttributeKey': 'operationName', 'AttributeValue': 'Microsoft.Authorization/roleAssignments/write'},
+    {'RuleName': 'Key Vault', 'AttributeKey': 'operationName', 'AttributeValue': 'Microsoft.KeyVault/*'},
+    {'RuleName': 'Administrative', 'AttributeKey': 'category', 'AttributeValue': 'Administrative'},
+]
+
+
+def peak_rss_mib():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (2**20 if sys.platform == 'darwin' else 2**10), 1)
+
+
+def get_git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_DIR, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class StageTimer:
+    """Collects {stage: {seconds, events, events_per_second, peak_rss_mib}}, silencing the pipeline's output unless verbose."""
+
+    def __init__(self, verbose=False):
+        self.verbose = verbose
+        self.stages = {}
+
+    @contextlib.contextmanager
+    def stage(self, name, events):
+        with contextlib.ExitStack() as stack:
+            if not self.verbose:
+                stack.enter_context(contextlib.redirect_stdout(stack.enter_context(open(os.devnull, 'w'))))
+            started = time.perf_counter()
+            yield
+            elapsed = time.perf_counter() - started
+        self.stages[name] = {
+            'seconds': round(elapsed, 4),
+            'events': events,
+            'events_per_second': round(events / elapsed) if elapsed else None,
+            'peak_rss_mib': peak_rss_mib(),
+        }
+
+
+def get_first_run_window():
+    # A fresh database starts 89 days back and catches up 30 days per run; keep every event inside that.
+    return datetime.now(timezone.utc) - timedelta(days=60), timedelta(days=28)
+
+
+def make_stubbed_cloudtrail_client(pages):
+    client = boto3.client('cloudtrail', region_name='us-east-1', aws_access_key_id='bench', aws_secret_access_key='bench')
+    stubber = Stubber(client)
+    for page in pages:
+        stubber.add_response('lookup_events', page)
+    stubber.activate()
+    return client, stubber
+
+
+class FakeActivityLogs:
+    """Stands in for MonitorManagementClient.activity_logs: list() returns an azure-core pager over the events."""
+
+    def __init__(self, events):
+        self.events = events
+        self.calls = []
+
+    def list(self, filter, select=None):
+        self.calls.append((filter, select))
+
+        def get_next(continuation_token=None):
+            return int(continuation_token or 0)
+
+        def extract_data(start):
+            end = start + AZURE_PAGE_SIZE
+            return (str(end) if end < len(self.events) else None), iter(self.events[start:end])
+
+        return ItemPaged(get_next, extract_data)
+
+
+class FakeMonitorClient:
+    def __init__(self, events):
+        self.activity_logs = FakeActivityLogs(events)
+
+
+def open_database(workdir, name, table_name, event_type):
+    con, cursor = setup_database_connection_and_tables(os.path.join(workdir, f'{name}.db'), table_name, event_type)
+    return con, cursor
+
+
+def count_rows(cursor, table_name):
+    return {
+        'stored_events': cursor.execute(f"SELECT COUNT(*) FROM {table_name}").fetchone()[0],
+        'rule_matches': cursor.execute("SELECT COUNT(*) FROM rule_matches").fetchone()[0],
+    }
+
+
+def run_aws_end_to_end(timer, workdir, envelopes):
+    con, cursor = open_database(workdir, 'aws_end_to_end', 'cloudtrail_events', 'aws')
+    client, stubber = make_stubbed_cloudtrail_client(make_lookup_pages(envelopes))
+    # Jobs reuse cached CloudTrail clients, so the stubbed one is picked up without an STS call.
+    aws_processor._cloudtrail_clients[(PROFILE_NAME, ACCOUNT_ID, None)] = (ACCOUNT_ID, client)
+    config = {'max_workers': 1, 'dataSources': [{
+        'source': 'AWS CloudTrail', 'requests_per_second': 10**6,
+        'account_profile_pairs': [{'account_id': ACCOUNT_ID, 'profile_name': PROFILE_NAME}],
+        'lookup_Attributes': AWS_RULES,
+    }]}
+
+    with timer.stage('aws.end_to_end', len(envelopes)):
+        process_aws_events(config, cursor, con)
+    stubber.assert_no_pending_responses()
+    timer.stages['aws.end_to_end'].update(count_rows(cursor, 'cloudtrail_events'))
+    con.close()
+
+
+def run_azure_end_to_end(timer, workdir, events):
+    con, cursor = open_database(workdir, 'azure_end_to_end', 'azure_events', 'azure')
+    monitor_client = FakeMonitorClient(events)
+    azure_processor.MonitorManagementClient = lambda credential, subscription_id: monitor_client
+    config = {'max_workers': 1, 'dataSources': [{
+        'source': 'Azure Activity Log', 'subscription_ids': [SUBSCRIPTION_ID], 'lookup_Attributes': AZURE_RULES,
+    }]}
+
+    with timer.stage('azure.end_to_end', len(events)):
+        process_azure_events(config, cursor, con)
+    timer.stages['azure.end_to_end'].update(count_rows(cursor, 'azure_events'))
+    timer.stages['azure.end_to_end']['activity_log_calls'] = len(monitor_client.activity_logs.calls)
+    con.close()
+
+
+def run_aws_stages(timer, workdir, envelopes):
+    count = len(envelopes)
+    con, cursor = open_database(workdir, 'aws_stages', 'cloudtrail_events', 'aws')
+    rules = build_aws_rules(cursor, con, AWS_RULES, 'bench')
+    startTime, endTime = rules[0]['startTime'], rules[0]['endTime']
+
+    client, _ = make_stubbed_cloudtrail_client(make_lookup_pages(envelopes))
+    with timer.stage('aws.fetch', count):
+        fetched = list(get_cloudtrail_events(client, [], startTime, endTime))
+
+    with timer.stage('aws.parse', count):
+        parsed = [parse_cloudtrail_event(event) for event in fetched]
+
+    with timer.stage('aws.match', count):
+        envelope_index, parsed_index = build_aws_rule_indexes(rules)
+        matches = 0
+        for event in map(LazyCloudTrailEvent, fetched):
+            matched = envelope_index.match(event.envelope)
+            matched += parsed_index.match(event.data) if parsed_index.conditional else parsed_index.unconditional
+            matches += len(matched)
+
+    with timer.stage('aws.fuzzy_match', count):
+        [fuzzy_match(event['EventName'], FUZZY_PATTERN) for event in fetched]
+
+    expression = jmespath.compile(AWS_RULES[-1]['jmes_filter'])
+    with timer.stage('aws.jmespath_filter', count):
+        expression.search(parsed)
+
+    events = [LazyCloudTrailEvent(event) for event in fetched]
+    account_info = {'account_id': ACCOUNT_ID, 'profile_name': PROFILE_NAME, 'region': 'us-east-1'}
+    with timer.stage('aws.serialize', count):
+        [build_event_row(event, 1, 'cloudtrail_events', account_info) for event in events if event.is_valid()]
+
+    now = datetime.now()
+    execution_id = add_execution_history(cursor, con, 'EventName', 'PutObject', startTime, endTime, now, now, 0, True, 'Bench Rule')
+    with timer.stage('aws.write_events', count):
+        write_events(cursor, con, events, execution_id, 'cloudtrail_events', 'EventID', account_info)
+
+    with timer.stage('aws.export', count):
+        append_or_write_json(os.path.join(workdir, 'AWS_CloudTrail.json'), fetch_events(cursor, 'cloudtrail_events'))
+    con.close()
+
+
+def run_azure_stages(timer, workdir, azure_events):
+    count = len(azure_events)
+    con, cursor = open_database(workdir, 'azure_stages', 'azure_events', 'azure')
+    rules = build_azure_rules(cursor, con, AZURE_RULES, SUBSCRIPTION_ID)
+    startTime, endTime = rules[0]['startTime'], rules[0]['endTime']
+
+    monitor_client = FakeMonitorClient(azure_events)
+    with timer.stage('azure.fetch', count):
+        fetched = list(get_azure_events(monitor_client, startTime, endTime))
+
+    with timer.stage('azure.match', count):
+        rule_index = build_azure_rule_index(rules)
+        for event in fetched:
+            rule_index.match(event)
+
+    account_info = {'subscription_id': SUBSCRIPTION_ID}
+    with timer.stage('azure.serialize', count):
+        [build_event_row(event, 1, 'azure_events', account_info) for event in fetched]
+
+    now = datetime.now()
+    execution_id = add_execution_history(cursor, con, 'category', 'Administrative', startTime, endTime, now, now, 0, True, 'Bench Rule')
+    with timer.stage('azure.write_events', count):
+        write_events(cursor, con, fetched, execution_id, 'azure_events', 'eventDataId', account_info)
+
+    with timer.stage('azure.export', count):
+        append_or_write_json(os.path.join(workdir, 'Azure_Activity_Log.json'), fetch_events(cursor, 'azure_events'))
+    con.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--aws-events', type=int, default=20000)
+    parser.add_argument('--azure-events', type=int, default=10000)
+    parser.add_argument('--output', help="Write the JSON report to this file instead of stdout")
+    parser.add_argument('--verbose', action='store_true', help="Show the pipeline's own output")
+    args = parser.parse_args()
+
+    end, span = get_first_run_window()
+    envelopes = make_lookup_events(args.aws_events, end=end, span=span)
+    azure_events = make_azure_events(args.azure_events, end=end, span=span)
+
+    timer = StageTimer(args.verbose)
+    with tempfile.TemporaryDirectory() as workdir:
+        run_aws_end_to_end(timer, workdir, envelopes)
+        run_azure_end_to_end(timer, workdir, azure_events)
+        run_aws_stages(timer, workdir, envelopes)
+        run_azure_stages(timer, workdir, azure_events)
+
+    report = {
+        'benchmark': 'end_to_end',
+        'timestamp': datetime.now(timezone.utc).isoformat(),
+        'git_commit': get_git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'parameters': {'aws_events': args.aws_events, 'azure_events': args.azure_events},
+        'stages': timer.stages,
+        'peak_rss_mib': peak_rss_mib(),
+    }
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        for name, stage in timer.stages.items():
+            print(f"{name:<24} {stage['seconds']:9.3f}s  {stage['events_per_second'] or 0:10} events/s  peak RSS {stage['peak_rss_mib']:7.1f} MiB")
+        print(f"Report written to {args.output}")
+    else:
+        print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
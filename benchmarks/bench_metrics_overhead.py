@@ -0,0 +1,67 @@
+"""
+Overhead of the run metrics layer: the same synthetic CloudTrail ingest (stubbed LookupEvents pages, as
+in bench_end_to_end.py) runs with metrics disabled (NULL_METRICS, the default) and enabled (RunMetrics),
+alternating so both see the same machine state. Reports the best events/s of each and the stage times
+the enabled runs recorded.
+
+    python benchmarks/bench_metrics_overhead.py --events 20000 --repeat 3
+"""
+import argparse
+import contextlib
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from cloudtail_modules import aws_processor
+from cloudtail_modules.aws_processor import process_aws_account
+from cloudtail_modules.database_utils import SerializedWriter, setup_database_connection_and_tables
+from cloudtail_modules.run_metrics import NULL_METRICS, RunMetrics
+from bench_end_to_end import ACCOUNT_ID, AWS_RULES, PROFILE_NAME, get_first_run_window, make_stubbed_cloudtrail_client
+from synthetic_events import make_lookup_events, make_lookup_pages
+
+
+def run_ingest(workdir, name, pages, metrics):
+    con, cursor = setup_database_connection_and_tables(os.path.join(workdir, f'{name}.db'), 'cloudtrail_events', 'aws')
+    client, stubber = make_stubbed_cloudtrail_client(pages)
+    aws_processor._cloudtrail_clients[(PROFILE_NAME, ACCOUNT_ID, None)] = (ACCOUNT_ID, client)
+    db = SerializedWriter(con, cursor)
+    db.metrics = metrics
+    source = {'source': 'AWS CloudTrail', 'requests_per_second': 10**6, 'lookup_Attributes': AWS_RULES}
+
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        started = time.perf_counter()
+        process_aws_account(source, {'account_id': ACCOUNT_ID, 'profile_name': PROFILE_NAME}, db)
+        elapsed = time.perf_counter() - started
+    stubber.assert_no_pending_responses()
+    con.close()
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--events', type=int, default=20000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    end, span = get_first_run_window()
+    pages = make_lookup_pages(make_lookup_events(args.events, end=end, span=span))
+
+    timings = {'disabled': [], 'enabled': []}
+    metrics = None
+    with tempfile.TemporaryDirectory() as workdir:
+        for run in range(args.repeat):
+            timings['disabled'].append(run_ingest(workdir, f'disabled_{run}', pages, NULL_METRICS))
+            metrics = RunMetrics()
+            timings['enabled'].append(run_ingest(workdir, f'enabled_{run}', pages, metrics))
+
+    disabled, enabled = min(timings['disabled']), min(timings['enabled'])
+    print(f"metrics disabled {args.events / disabled:9.0f} events/s")
+    print(f"metrics enabled  {args.events / enabled:9.0f} events/s  ({(enabled - disabled) / disabled:+.1%})")
+    print(f"stage times of the last enabled run: {metrics.summary()}")
+
+
+if __name__ == '__main__':
+    main()
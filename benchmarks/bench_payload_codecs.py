@@ -0,0 +1,121 @@
+"""
+Benchmark of the EventData payload codecs: a database of synthetic CloudTrail events is ingested as
+plain TEXT, compacted with each codec (training a dictionary), and then exported to NDJSON. Reports
+database size, compaction time and full-table export throughput, and checks that every export is
+byte-identical to the uncompressed one. The zstd codec needs the optional zstandard package.
+
+    python benchmarks/bench_payload_codecs.py --events 50000
+"""
+import argparse
+import filecmp
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from cloudtail_modules.database_utils import setup_database_connection_and_tables, add_execution_history, write_events, compact_event_data, get_database_size
+from cloudtail_modules.export_results import export_events_to_ndjson
+from cloudtail_modules.payload_codec import PAYLOAD_CODECS
+
+TABLE_NAME = 'cloudtrail_events'
+EVENT_NAMES = ['GetObject', 'PutObject', 'AssumeRole', 'DescribeInstances', 'CreateUser', 'ConsoleLogin']
+
+
+def make_events(count, seed=7):
+    rnd = random.Random(seed)
+    now = datetime.now()
+    events = []
+    for i in range(count):
+        role = f'role-{rnd.randrange(20)}'
+        events.append({
+            'eventVersion': '1.09',
+            'userIdentity': {
+                'type': 'AssumedRole',
+                'principalId': f'AROA{rnd.randrange(10**8):08d}:session-{rnd.randrange(500)}',
+                'arn': f'arn:aws:sts::111122223333:assumed-role/{role}/session-{rnd.randrange(500)}',
+                'accountId': '111122223333',
+                'accessKeyId': f'ASIA{rnd.randrange(10**12):012d}',
+                'sessionContext': {
+                    'sessionIssuer': {'type': 'Role', 'principalId': 'AROAEXAMPLE', 'arn': f'arn:aws:iam::111122223333:role/{role}', 'accountId': '111122223333', 'userName': role},
+                    'attributes': {'creationDate': (now - timedelta(minutes=rnd.randrange(600))).isoformat(), 'mfaAuthenticated': 'false'},
+                },
+            },
+            'eventTime': (now - timedelta(seconds=i)).isoformat(),
+            'eventSource': 's3.amazonaws.com',
+            'awsRegion': rnd.choice(['us-east-1', 'eu-west-1']),
+            'sourceIPAddress': f'10.{rnd.randrange(256)}.{rnd.randrange(256)}.{rnd.randrange(256)}',
+            'userAgent': '[aws-sdk-go-v2/1.30.3 os/linux lang/go#1.22.5 md/GOOS#linux md/GOARCH#amd64 api/s3#1.58.2]',
+            'requestParameters': {'bucketName': f'bucket-{rnd.randrange(10)}', 'Host': f'bucket-{rnd.randrange(10)}.s3.amazonaws.com', 'key': f'data/{rnd.randrange(10**6)}.parquet'},
+            'responseElements': None,
+            'additionalEventData': {'SignatureVersion': 'SigV4', 'CipherSuite': 'TLS_AES_128_GCM_SHA256', 'bytesTransferredIn': 0, 'AuthenticationMethod': 'AuthHeader', 'x-amz-id-2': f'{rnd.getrandbits(128):032x}', 'bytesTransferredOut': rnd.randrange(10**6)},
+            'requestID': f'{rnd.getrandbits(64):016X}',
+            'eventID': f'{rnd.getrandbits(128):032x}',
+            'readOnly': True,
+            'resources': [{'type': 'AWS::S3::Object', 'ARN': f'arn:aws:s3:::bucket-{rnd.randrange(10)}/data/{rnd.randrange(10**6)}.parquet'}, {'accountId': '111122223333', 'type': 'AWS::S3::Bucket', 'ARN': f'arn:aws:s3:::bucket-{rnd.randrange(10)}'}],
+            'eventType': 'AwsApiCall',
+            'managementEvent': False,
+            'recipientAccountId': '111122223333',
+            'eventCategory': 'Data',
+            'EventId': f'bench-{i:08d}',
+            'EventName': rnd.choice(EVENT_NAMES),
+            'EventTime': now - timedelta(seconds=i),
+            'EventSource': 's3.amazonaws.com',
+        })
+    return events
+
+
+def export(db_path, output_dir):
+    os.makedirs(output_dir)
+    started = time.perf_counter()
+    export_events_to_ndjson(db_path, TABLE_NAME, 'AWS_CloudTrail', output_dir)
+    return time.perf_counter() - started, os.path.join(output_dir, 'AWS_CloudTrail.ndjson')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--events', type=int, default=20000)
+    args = parser.parse_args()
+
+    try:
+        import zstandard  # noqa: F401
+        codecs = PAYLOAD_CODECS
+    except ImportError:
+        codecs = [codec for codec in PAYLOAD_CODECS if codec != 'zstd']
+
+    with tempfile.TemporaryDirectory() as workdir:
+        source_path = os.path.join(workdir, 'source.db')
+        con, cursor = setup_database_connection_and_tables(source_path, TABLE_NAME, 'aws')
+        now = datetime.now()
+        execution_id = add_execution_history(cursor, con, 'EventName', 'GetObject', now, now, now, now, 0, True, 'Bench Rule')
+        write_events(cursor, con, make_events(args.events), execution_id, TABLE_NAME, 'EventID', {'account_id': '111122223333', 'profile_name': 'bench', 'region': 'us-east-1'})
+        con.close()
+
+        reference = None
+        baseline_size = None
+        for codec in codecs:
+            db_path = os.path.join(workdir, f'{codec}.db')
+            shutil.copy(source_path, db_path)
+            con, cursor = setup_database_connection_and_tables(db_path, TABLE_NAME, 'aws')
+            started = time.perf_counter()
+            compact_event_data(cursor, con, TABLE_NAME, codec)
+            compaction = time.perf_counter() - started
+            size = get_database_size(cursor)
+            con.close()
+
+            elapsed, export_path = export(db_path, os.path.join(workdir, f'{codec}-export'))
+            if reference is None:
+                reference, baseline_size = export_path, size
+            identical = filecmp.cmp(reference, export_path, shallow=False)
+
+            print(f"{codec:<5} db {size / 2**20:8.1f} MiB ({baseline_size / size:4.1f}x smaller)  compaction {compaction:6.2f}s  "
+                  f"export {args.events / elapsed:9.0f} events/s  export identical: {identical}")
+            assert identical, f"{codec} export differs from the plain TEXT export"
+
+
+if __name__ == '__main__':
+    main()
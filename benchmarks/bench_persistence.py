@@ -0,0 +1,100 @@
+"""
+Micro-benchmark: per-row persistence (one execute per event, one commit per mapping and rule match)
+against the batched executemany path that commits a whole rule execution in one transaction.
+
+    python benchmarks/bench_persistence.py --events 5000
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from cloudtail_modules.database_utils import (
+    setup_database_connection_and_tables, add_execution_history, add_lookup_attribute, add_event_lookup_mapping,
+    add_rule_match, add_event_lookup_mappings, add_rule_matches, write_events, datetime_handler,
+)
+
+TABLE_NAME = 'cloudtrail_events'
+
+
+def make_events(count):
+    now = datetime.now()
+    return [{
+        'eventVersion': '1.08',
+        'userIdentity': {'type': 'IAMUser', 'userName': f'user-{i % 50}', 'arn': f'arn:aws:iam::111122223333:user/user-{i % 50}'},
+        'eventSource': 'iam.amazonaws.com',
+        'requestParameters': {'userName': f'new-user-{i}'},
+        'EventId': f'bench-{i:08d}',
+        'EventName': 'CreateUser',
+        'EventTime': now - timedelta(seconds=i),
+        'EventSource': 'iam.amazonaws.com',
+    } for i in range(count)]
+
+
+def per_row_write(cursor, con, events, execution_id, account_info):
+    """The pre-batching write path: one execute per event, then a commit per mapping and rule match."""
+    eventCount = 0
+    for event in events:
+        cursor.execute(f"""
+            INSERT OR IGNORE INTO {TABLE_NAME} (
+                EventID, AccountID, ProfileName, EventName, EventTime, EventData, ExecutionID)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        """, (event['EventId'], account_info['account_id'], account_info['profile_name'], event['EventName'],
+              event['EventTime'], json.dumps(event, default=datetime_handler), execution_id))
+        if cursor.rowcount > 0:
+            eventCount += 1
+    con.commit()
+
+    attribute_id = add_lookup_attribute(cursor, con, 'EventName', 'CreateUser')
+    for event in events:
+        add_event_lookup_mapping(cursor, con, event['EventId'], attribute_id, TABLE_NAME)
+        add_rule_match(cursor, con, 'Bench Rule', event['EventId'], execution_id, TABLE_NAME)
+    return eventCount
+
+
+def batched_write(cursor, con, events, execution_id, account_info):
+    eventCount = write_events(cursor, con, events, execution_id, TABLE_NAME, 'EventID', account_info, commit=False)
+    event_ids = [event['EventId'] for event in events]
+    attribute_id = add_lookup_attribute(cursor, con, 'EventName', 'CreateUser')
+    add_event_lookup_mappings(cursor, con, event_ids, attribute_id, TABLE_NAME, commit=False)
+    add_rule_matches(cursor, con, 'Bench Rule', event_ids, execution_id, TABLE_NAME, commit=False)
+    con.commit()
+    return eventCount
+
+
+def run(name, write_func, events, workdir):
+    con, cursor = setup_database_connection_and_tables(os.path.join(workdir, f'{name}.db'), TABLE_NAME, 'aws')
+    now = datetime.now()
+    execution_id = add_execution_history(cursor, con, 'EventName', 'CreateUser', now, now, now, now, len(events), True, 'Bench Rule')
+    account_info = {'account_id': '111122223333', 'profile_name': 'bench'}
+
+    started = time.perf_counter()
+    inserted = write_func(cursor, con, events, execution_id, account_info)
+    elapsed = time.perf_counter() - started
+
+    reinserted = write_func(cursor, con, events, execution_id, account_info)
+    con.close()
+
+    print(f"{name:<10} {len(events):>8} events  {elapsed:8.3f}s  {len(events) / elapsed:12.0f} events/s  inserted={inserted} re-run inserted={reinserted}")
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--events', type=int, default=2000)
+    args = parser.parse_args()
+
+    events = make_events(args.events)
+    with tempfile.TemporaryDirectory() as workdir:
+        per_row = run('per-row', per_row_write, events, workdir)
+        batched = run('batched', batched_write, events, workdir)
+    print(f"speed-up: {per_row / batched:.1f}x")
+
+
+if __name__ == '__main__':
+    main()
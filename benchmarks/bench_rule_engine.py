@@ -0,0 +1,115 @@
+"""
+Micro-benchmark: per-event, per-rule fuzzy_match (the pre-compilation matcher) against the compiled
+RuleIndex, for 1, 50 and 500 lookup rules.
+
+    python benchmarks/bench_rule_engine.py --events 20000
+"""
+import argparse
+import fnmatch
+import os
+import random
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from cloudtail_modules.rule_engine import RuleIndex, compile_key_path
+
+EVENT_NAMES = [f'{verb}{noun}' for verb in ('Create', 'Delete', 'Update', 'Get', 'List', 'Put', 'Attach', 'Detach')
+               for noun in ('User', 'Role', 'Group', 'Policy', 'AccessKey', 'Bucket', 'Instance', 'Trail', 'SecurityGroup', 'Object')]
+
+
+def legacy_fuzzy_match(value, pattern):
+    if '*' not in pattern and not re.search(r'[.^$+?{}[\]|()]', pattern):
+        return value == pattern
+
+    if '*' in pattern:
+        return fnmatch.fnmatch(value, pattern)
+
+    try:
+        return re.match(pattern, value) is not None
+    except re.error:
+        return False
+
+
+def legacy_get_nested_event_value(event, attribute_key):
+    value = event
+    for key in attribute_key.split("."):
+        if isinstance(value, dict):
+            value = value.get(key, "")
+        else:
+            return ""
+    return value
+
+
+def make_events(count, rnd):
+    return [{
+        'EventId': f'bench-{i}',
+        'EventName': rnd.choice(EVENT_NAMES),
+        'EventSource': rnd.choice(['iam.amazonaws.com', 's3.amazonaws.com', 'ec2.amazonaws.com']),
+        'userIdentity': {'type': 'IAMUser', 'userName': f'user-{rnd.randrange(200)}'},
+        'sourceIPAddress': f'10.0.{rnd.randrange(256)}.{rnd.randrange(256)}',
+    } for i in range(count)]
+
+
+def make_rules(count, rnd):
+    """Roughly 70% exact EventName rules, 20% globs and 10% regexes on nested keys."""
+    rules = []
+    for i in range(count):
+        roll = rnd.random()
+        if roll < 0.7:
+            rules.append({'AttributeKey': 'EventName', 'AttributeValue': EVENT_NAMES[i % len(EVENT_NAMES)] if i < len(EVENT_NAMES) else f'Custom{i}'})
+        elif roll < 0.9:
+            rules.append({'AttributeKey': 'EventSource', 'AttributeValue': f'{rnd.choice(["iam", "s3", "ec2", "kms"])}*{i}*'})
+        else:
+            rules.append({'AttributeKey': 'userIdentity.userName', 'AttributeValue': f'user-{i % 200}$'})
+    return rules
+
+
+def run_legacy(events, rules):
+    hits = 0
+    for event in events:
+        for rule in rules:
+            if legacy_fuzzy_match(legacy_get_nested_event_value(event, rule['AttributeKey']), rule['AttributeValue']):
+                hits += 1
+    return hits
+
+
+def run_compiled(events, rules):
+    rule_index = RuleIndex()
+    for rule in rules:
+        rule_index.add(rule, compile_key_path(rule['AttributeKey']), rule['AttributeValue'])
+
+    hits = 0
+    for event in events:
+        hits += len(rule_index.match(event))
+    return hits
+
+
+def measure(func, events, rules):
+    started = time.perf_counter()
+    hits = func(events, rules)
+    return hits, len(events) / (time.perf_counter() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--events', type=int, default=20000)
+    parser.add_argument('--rules', type=int, nargs='+', default=[1, 50, 500])
+    args = parser.parse_args()
+
+    rnd = random.Random(42)
+    events = make_events(args.events, rnd)
+
+    print(f"{'rules':>6} {'legacy events/s':>16} {'compiled events/s':>18} {'speed-up':>9}")
+    for rule_count in args.rules:
+        rules = make_rules(rule_count, random.Random(rule_count))
+        legacy_hits, legacy_rate = measure(run_legacy, events, rules)
+        compiled_hits, compiled_rate = measure(run_compiled, events, rules)
+        assert legacy_hits == compiled_hits, (legacy_hits, compiled_hits)
+        print(f"{rule_count:>6} {legacy_rate:>16,.0f} {compiled_rate:>18,.0f} {compiled_rate / legacy_rate:>8.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+"""
+Benchmark of the FTS5 search index against the LIKE '%...%' scan it replaces. Synthetic CloudTrail
+events are written through write_events with and without the index (to measure the cost of keeping
+it in sync), then an IP, a principal ID and an ARN fragment taken from the data are searched both
+ways. The script reports the query times, the index's share of the database size, and checks that
+every indexed hit is also a LIKE hit. LIKE also matches inside longer tokens, e.g. 10.1.2.3 in 10.1.2.34.
+
+    python benchmarks/bench_search_index.py --events 100000 --codec zlib
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from cloudtail_modules.database_utils import (
+    DEFAULT_CHUNK_SIZE, configure_storage, setup_database_connection_and_tables, add_execution_history,
+    get_database_size, rebuild_search_index, set_up_search_index, write_events,
+)
+from cloudtail_modules.event_search import search_events
+from cloudtail_modules.payload_codec import PAYLOAD_CODECS
+from synthetic_events import make_lookup_events
+
+ACCOUNT_INFO = {'account_id': '111122223333', 'profile_name': 'bench', 'region': 'us-east-1'}
+
+
+def load_events(path, envelopes, indexed):
+    con, cursor = setup_database_connection_and_tables(path, 'cloudtrail_events', 'aws')
+    if indexed:
+        set_up_search_index(cursor, con, 'cloudtrail_events')
+    now = datetime.now()
+    execution_id = add_execution_history(cursor, con, 'EventName', 'Bench', now, now, now, now, len(envelopes), True, 'Bench Rule')
+
+    started = time.perf_counter()
+    for i in range(0, len(envelopes), DEFAULT_CHUNK_SIZE):
+        write_events(cursor, con, envelopes[i:i + DEFAULT_CHUNK_SIZE], execution_id, 'cloudtrail_events', 'EventID', ACCOUNT_INFO)
+    return con, cursor, time.perf_counter() - started
+
+
+def get_needles(envelopes):
+    payload = json.loads(envelopes[len(envelopes) // 2]['CloudTrailEvent'])
+    identity = payload['userIdentity']
+    return {
+        'source IP': payload['sourceIPAddress'],
+        'principal ID': identity['principalId'].split(':')[0],
+        'ARN fragment': identity['arn'].split('/', 1)[1],
+    }
+
+
+def timed(func):
+    started = time.perf_counter()
+    result = func()
+    return time.perf_counter() - started, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--events', type=int, default=50000)
+    parser.add_argument('--codec', choices=PAYLOAD_CODECS, default='none')
+    args = parser.parse_args()
+
+    configure_storage({'payload_codec': args.codec})
+    envelopes = make_lookup_events(args.events)
+
+    with tempfile.TemporaryDirectory() as workdir:
+        plain_con, plain_cursor, plain_seconds = load_events(os.path.join(workdir, 'plain.db'), envelopes, indexed=False)
+        plain_size = get_database_size(plain_cursor)
+        plain_con.close()
+
+        con, cursor, indexed_seconds = load_events(os.path.join(workdir, 'indexed.db'), envelopes, indexed=True)
+        print(f"write_events without index {args.events / plain_seconds:9.0f} events/s  with index {args.events / indexed_seconds:9.0f} events/s")
+
+        rebuild_seconds, _ = timed(lambda: rebuild_search_index(cursor, con, 'cloudtrail_events'))
+        cursor.execute("VACUUM")
+        indexed_size = get_database_size(cursor)
+        print(f"rebuild {rebuild_seconds:.2f}s  database {plain_size / 2**20:.1f} MiB -> {indexed_size / 2**20:.1f} MiB with index (+{(indexed_size - plain_size) / plain_size:.0%})")
+
+        for label, needle in get_needles(envelopes).items():
+            scan_seconds, scan_ids = timed(lambda: {row[0] for row in cursor.execute(
+                "SELECT EventID FROM cloudtrail_events WHERE event_data(EventData) LIKE ?", (f'%{needle}%',))})
+            search_seconds, batches = timed(lambda: list(search_events(cursor, 'cloudtrail_events', needle, limit=args.events)))
+            search_ids = {row[1] for batch in batches for row in batch}
+            print(f"{label:<13} {needle!r:<28} LIKE {scan_seconds * 1000:8.1f} ms ({len(scan_ids)} hits)  "
+                  f"FTS5 {search_seconds * 1000:7.1f} ms ({len(search_ids)} hits)  {scan_seconds / search_seconds:6.0f}x")
+            assert search_ids and search_ids <= scan_ids, f"search for {needle!r} returned events the scan did not"
+        con.close()
+
+
+if __name__ == '__main__':
+    main()
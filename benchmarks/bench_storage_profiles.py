@@ -0,0 +1,104 @@
+"""
+Benchmark of the SQLite storage profiles: ingest throughput (one transaction per rule chunk, as a run
+writes them), NDJSON export throughput, and how often a second connection could read while the
+ingest was writing (the rollback journal locks readers out during commits, WAL does not).
+
+    python benchmarks/bench_storage_profiles.py --events 50000 --chunk-size 500
+"""
+import argparse
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from cloudtail_modules.database_utils import (
+    STORAGE_PROFILES, SerializedWriter, configure_storage, get_storage_settings, setup_database_connection_and_tables,
+    add_execution_history, write_rule_chunk, finish_storage,
+)
+from cloudtail_modules.export_results import export_events_to_ndjson
+
+TABLE_NAME = 'cloudtrail_events'
+
+
+def make_events(count):
+    now = datetime.now()
+    return [{
+        'eventVersion': '1.08',
+        'userIdentity': {'type': 'IAMUser', 'userName': f'user-{i % 50}', 'arn': f'arn:aws:iam::111122223333:user/user-{i % 50}'},
+        'requestParameters': {'bucketName': f'bucket-{i % 7}', 'key': f'objects/{i}.json'},
+        'EventId': f'bench-{i:08d}',
+        'EventName': 'GetObject',
+        'EventTime': now - timedelta(seconds=i),
+        'EventSource': 's3.amazonaws.com',
+    } for i in range(count)]
+
+
+def read_while_ingesting(db_path, stop, stats):
+    """Count rows from a separate connection in a loop, the way an export or ad-hoc query would."""
+    con = sqlite3.connect(db_path, timeout=0.05)
+    while not stop.is_set():
+        started = time.perf_counter()
+        try:
+            con.execute(f"SELECT COUNT(*) FROM {TABLE_NAME}").fetchone()
+            stats['reads'] += 1
+        except sqlite3.OperationalError:
+            stats['blocked'] += 1
+        stats['worst'] = max(stats['worst'], time.perf_counter() - started)
+    con.close()
+
+
+def run(profile, events, chunk_size, workdir):
+    configure_storage({'profile': profile})
+    db_path = os.path.join(workdir, f'{profile}.db')
+    con, cursor = setup_database_connection_and_tables(db_path, TABLE_NAME, 'aws')
+    db = SerializedWriter(con, cursor, get_storage_settings()['wal_checkpoint_interval'])
+    now = datetime.now()
+    execution_id = add_execution_history(cursor, con, 'EventName', 'GetObject', now, now, now, now, 0, True, 'Bench Rule')
+    account_info = {'account_id': '111122223333', 'profile_name': 'bench', 'region': 'us-east-1'}
+
+    stop = threading.Event()
+    stats = {'reads': 0, 'blocked': 0, 'worst': 0.0}
+    reader = threading.Thread(target=read_while_ingesting, args=(db_path, stop, stats))
+    reader.start()
+
+    started = time.perf_counter()
+    for i in range(0, len(events), chunk_size):
+        chunk = events[i:i + chunk_size]
+        db.run(write_rule_chunk, 'Bench Rule', 'EventName', 'GetObject', execution_id, chunk, [event['EventId'] for event in chunk], TABLE_NAME, account_info)
+    ingest = time.perf_counter() - started
+
+    stop.set()
+    reader.join()
+    db.run(finish_storage)
+    con.close()
+
+    output_dir = os.path.join(workdir, f'{profile}-export')
+    os.makedirs(output_dir)
+    started = time.perf_counter()
+    export_events_to_ndjson(db_path, TABLE_NAME, 'AWS_CloudTrail', output_dir)
+    export = time.perf_counter() - started
+
+    total_reads = stats['reads'] + stats['blocked']
+    print(f"{profile:<7} ingest {len(events) / ingest:9.0f} events/s  export {len(events) / export:9.0f} events/s  "
+          f"concurrent reads ok {stats['reads']}/{total_reads} (worst {stats['worst'] * 1000:.1f} ms)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--events', type=int, default=20000)
+    parser.add_argument('--chunk-size', type=int, default=500)
+    args = parser.parse_args()
+
+    events = make_events(args.events)
+    with tempfile.TemporaryDirectory() as workdir:
+        for profile in STORAGE_PROFILES:
+            run(profile, events, args.chunk_size, workdir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+"""
+Startup regression check for export-only invocations: imports cloudtail.py under `python -X importtime`
+(the same modules `--export` and `--compact` load) and fails if the cumulative import time of the best
+run exceeds the budget, or if any cloud SDK or the banner's colorama is imported. Those must only be
+loaded once a provider actually runs.
+
+    python benchmarks/check_import_time.py --budget-ms 150 --runs 5
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+REPO_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+# Top-level packages that an export must not import.
+DEFERRED_PACKAGES = ('boto3', 'botocore', 'jmespath', 'azure', 'colorama')
+
+
+def import_times(module):
+    """{module: cumulative microseconds} for one `python -X importtime -c "import <module>"` run."""
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'], cwd=REPO_DIR,
+                            capture_output=True, text=True, check=True)
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        times[name.strip()] = int(cumulative)
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--budget-ms', type=float, default=150)
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args()
+
+    runs = [import_times('cloudtail') for _ in range(args.runs)]
+    best = min(runs, key=lambda times: times['cloudtail'])
+    elapsed = best['cloudtail'] / 1000
+    deferred = sorted({name.split('.')[0] for name in best} & set(DEFERRED_PACKAGES))
+
+    slowest = sorted((name for name in best if name.startswith('cloudtail_modules.')), key=best.get, reverse=True)
+    print(f"import cloudtail: {elapsed:.1f} ms (best of {args.runs}, budget {args.budget_ms:.0f} ms)")
+    for name in slowest[:5]:
+        print(f"    {name:<40} {best[name] / 1000:8.1f} ms")
+
+    ok = True
+    if elapsed > args.budget_ms:
+        print(f"FAIL: import time is over budget by {elapsed - args.budget_ms:.1f} ms")
+        ok = False
+    if deferred:
+        print(f"FAIL: export startup imports {', '.join(deferred)}")
+        ok = False
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
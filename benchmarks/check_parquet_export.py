@@ -0,0 +1,88 @@
+"""
+Local check of the Parquet export (needs pyarrow, no cloud access): fills a scratch database with
+synthetic CloudTrail events spread over several days, exports it, exports again after adding events,
+and verifies the dataset read back with pyarrow (row counts, partitions, typed columns, payloads).
+
+    python benchmarks/check_parquet_export.py --events 20000 --days 30
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+import resource
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from cloudtail_modules.database_utils import setup_database_connection_and_tables, add_execution_history, write_events
+from cloudtail_modules.export_results import export_events_to_parquet
+
+TABLE_NAME = 'cloudtrail_events'
+
+
+def make_events(start, count, days):
+    now = datetime.now()
+    step = timedelta(days=days) / max(count, 1)
+    return [{
+        'eventVersion': '1.08',
+        'userIdentity': {'type': 'IAMUser', 'userName': f'user-{i % 50}'},
+        'requestParameters': {'bucketName': f'bucket-{i % 7}'},
+        'EventId': f'check-{i:08d}',
+        'EventName': 'GetObject' if i % 3 else 'PutObject',
+        'EventTime': now - step * (i - start),
+        'EventSource': 's3.amazonaws.com',
+    } for i in range(start, start + count)]
+
+
+def timed_export(db_path, output_dir):
+    started = time.perf_counter()
+    export_events_to_parquet(db_path, TABLE_NAME, 'AWS_CloudTrail', output_dir)
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--events', type=int, default=5000)
+    parser.add_argument('--days', type=int, default=10)
+    args = parser.parse_args()
+
+    import pyarrow.dataset as ds
+
+    with tempfile.TemporaryDirectory() as workdir:
+        db_path = os.path.join(workdir, 'events.db')
+        output_dir = os.path.join(workdir, 'export')
+        con, cursor = setup_database_connection_and_tables(db_path, TABLE_NAME, 'aws')
+        now = datetime.now()
+        execution_id = add_execution_history(cursor, con, 'EventName', 'GetObject', now, now, now, now, 0, True, 'Check Rule')
+        account_info = {'account_id': '111122223333', 'profile_name': 'check', 'region': 'us-east-1'}
+
+        write_events(cursor, con, make_events(0, args.events, args.days), execution_id, TABLE_NAME, 'EventID', account_info)
+        elapsed = timed_export(db_path, output_dir)
+        peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        print(f"initial export   {args.events:>8} events  {elapsed:8.3f}s  {args.events / elapsed:10.0f} events/s  peak RSS {peak_rss:7.1f} MiB")
+
+        elapsed = timed_export(db_path, output_dir)
+        print(f"unchanged export {0:>8} events  {elapsed:8.3f}s")
+
+        added = max(args.events // 10, 1)
+        write_events(cursor, con, make_events(args.events, added, args.days), execution_id, TABLE_NAME, 'EventID', account_info)
+        elapsed = timed_export(db_path, output_dir)
+        print(f"append export    {added:>8} events  {elapsed:8.3f}s")
+
+        dataset = ds.dataset(output_dir, format='parquet', partitioning='hive')
+        table = dataset.to_table()
+        dates = set(table.column('date').to_pylist())
+        event_ids = table.column('EventID').to_pylist()
+
+        assert table.num_rows == args.events + added, table.num_rows
+        assert len(set(event_ids)) == len(event_ids), "duplicate events in the export"
+        assert set(table.column('source').to_pylist()) == {'AWS_CloudTrail'}
+        assert str(table.schema.field('EventTime').type) == 'timestamp[us]'
+        assert all(json.loads(payload)['EventId'] == event_id for payload, event_id in zip(table.column('EventData').to_pylist(), event_ids))
+        print(f"verified {table.num_rows} rows across {len(dates)} date partitions")
+
+
+if __name__ == '__main__':
+    main()
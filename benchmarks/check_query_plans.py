@@ -0,0 +1,120 @@
+"""
+EXPLAIN QUERY PLAN checks for the hot SQLite queries. Each query is captured from the function that
+really issues it (via the connection's trace callback) and must be answered through an index rather
+than a full table scan. Also migrates a database in the pre-versioning schema and checks that
+duplicate lookup mappings are cleaned up.
+
+    python benchmarks/check_query_plans.py
+"""
+import argparse
+import os
+import sqlite3
+import sys
+import tempfile
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from cloudtail_modules.database_utils import (
+    SCHEMA_MIGRATIONS, setup_database_connection_and_tables, get_last_successful_execution_history,
+    start_execution_history, write_events,
+)
+from cloudtail_modules.export_results import fetch_events, iter_event_batches
+
+INDEXED_TABLES = ('execution_history', 'cloudtrail_events', 'azure_events', 'event_lookup_attributes', 'rule_matches')
+
+
+def capture_selects(con, func):
+    statements = []
+    con.set_trace_callback(statements.append)
+    try:
+        func()
+    finally:
+        con.set_trace_callback(None)
+    return [statement for statement in statements if statement.lstrip().upper().startswith('SELECT')]
+
+
+def check_plan(cursor, label, sql):
+    plan = [row[3] for row in cursor.execute(f"EXPLAIN QUERY PLAN {sql}")]
+    scans = [detail for detail in plan if detail.startswith('SCAN') and detail.split()[1] in INDEXED_TABLES and 'INDEX' not in detail]
+    status = 'FAIL' if scans else 'ok'
+    print(f"[{status}] {label}")
+    for detail in plan:
+        print(f"         {detail}")
+    return not scans
+
+
+def check_aws_queries(workdir):
+    con, cursor = setup_database_connection_and_tables(os.path.join(workdir, 'aws.db'), 'cloudtrail_events', 'aws')
+    now = datetime.now()
+    execution_id = start_execution_history(cursor, con, 'EventName', 'CreateUser', now - timedelta(days=1), now, now, 'Check Rule', '111122223333')
+    events = [{'EventId': f'check-{i}', 'EventName': 'CreateUser', 'EventTime': now - timedelta(minutes=i)} for i in range(100)]
+    write_events(cursor, con, events, execution_id, 'cloudtrail_events', 'EventID', {'account_id': '111122223333', 'profile_name': 'check'})
+
+    hot_queries = [
+        ('resume point (get_last_successful_execution_history)', lambda: get_last_successful_execution_history(cursor, 'EventName', 'CreateUser', now, '111122223333')),
+        ('execution row reuse (start_execution_history)', lambda: start_execution_history(cursor, con, 'EventName', 'CreateUser', now - timedelta(days=1), now, now, 'Check Rule', '111122223333')),
+        ('time range export (fetch_events)', lambda: fetch_events(cursor, 'cloudtrail_events', now - timedelta(days=1), now)),
+        ('incremental export (iter_event_batches)', lambda: next(iter_event_batches(con.cursor(), 'cloudtrail_events', 50), None)),
+    ]
+    ok = True
+    for label, func in hot_queries:
+        for sql in capture_selects(con, func):
+            ok = check_plan(cursor, label, sql) and ok
+
+    ad_hoc_queries = [
+        ('events by time', "SELECT * FROM cloudtrail_events WHERE EventTime >= '2024-01-01' AND EventTime < '2024-02-01'"),
+        ('events by name and time', "SELECT EventID FROM cloudtrail_events WHERE EventName = 'CreateUser' AND EventTime >= '2024-01-01'"),
+        ('events by account and time', "SELECT EventID FROM cloudtrail_events WHERE AccountID = '111122223333' AND EventTime >= '2024-01-01'"),
+        ('events of a run', f"SELECT EventID FROM cloudtrail_events WHERE ExecutionID = {execution_id}"),
+        ('mappings of an event', "SELECT AttributeID FROM event_lookup_attributes WHERE EventID = 'check-1'"),
+        ('matches of a run', f"SELECT EventID FROM rule_matches WHERE ExecutionID = {execution_id}"),
+    ]
+    for label, sql in ad_hoc_queries:
+        ok = check_plan(cursor, label, sql) and ok
+
+    con.close()
+    return ok
+
+
+def check_legacy_migration(workdir):
+    """A database in the original schema: no Scope, no Region, no indexes, duplicated mappings."""
+    db_path = os.path.join(workdir, 'legacy.db')
+    con = sqlite3.connect(db_path)
+    con.executescript("""
+        CREATE TABLE execution_history(ExecutionID INTEGER PRIMARY KEY AUTOINCREMENT, RuleName TEXT, AttributeKey TEXT, AttributeValue TEXT,
+            startTime TIMESTAMP, endTime TIMESTAMP, execStartTime TIMESTAMP, execEndTime TIMESTAMP, resultCount INTEGER, isSuccessful BOOLEAN,
+            UNIQUE(RuleName, AttributeKey, AttributeValue, startTime));
+        CREATE TABLE cloudtrail_events(EventID TEXT PRIMARY KEY, AccountID TEXT, ProfileName TEXT, EventName TEXT, EventTime TIMESTAMP, EventData TEXT, ExecutionID INTEGER);
+        CREATE TABLE lookup_attributes(AttributeID INTEGER PRIMARY KEY AUTOINCREMENT, AttributeKey TEXT, AttributeValue TEXT, UNIQUE(AttributeKey, AttributeValue));
+        CREATE TABLE event_lookup_attributes(EventID TEXT, AttributeID INTEGER);
+        CREATE TABLE rule_matches(RuleMatchID INTEGER PRIMARY KEY AUTOINCREMENT, RuleName TEXT, EventID TEXT, ExecutionID INTEGER, UNIQUE(RuleName, EventID));
+        INSERT INTO event_lookup_attributes VALUES ('e1', 1), ('e1', 1), ('e1', 1), ('e2', 1), ('e1', 2);
+    """)
+    con.close()
+
+    con, cursor = setup_database_connection_and_tables(db_path, 'cloudtrail_events', 'aws')
+    version = cursor.execute("PRAGMA user_version").fetchone()[0]
+    mappings = cursor.execute("SELECT COUNT(*) FROM event_lookup_attributes").fetchone()[0]
+    columns = [row[1] for row in cursor.execute("PRAGMA table_info(cloudtrail_events)")]
+    cursor.execute("INSERT OR IGNORE INTO event_lookup_attributes VALUES ('e1', 1)")
+    ignored = cursor.rowcount == 0
+    con.close()
+
+    ok = version == len(SCHEMA_MIGRATIONS) and mappings == 3 and 'Region' in columns and ignored
+    print(f"[{'ok' if ok else 'FAIL'}] legacy migration: user_version={version}, mappings left={mappings}, Region column={'Region' in columns}, duplicate mapping ignored={ignored}")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        ok = check_aws_queries(workdir)
+        ok = check_legacy_migration(workdir) and ok
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
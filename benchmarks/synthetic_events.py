@@ -0,0 +1,116 @@
+"""
+Synthetic event generators shared by the benchmarks: CloudTrail LookupEvents results (and the pages
+LookupEvents returns them in) and Azure Activity Log EventData objects built from the SDK models.
+Timestamps are spread evenly over `span` ending at `end` (by default one second apart, ending now).
+"""
+import json
+import random
+from datetime import datetime, timedelta, timezone
+
+EVENT_NAMES = ['GetObject', 'PutObject', 'AssumeRole', 'DescribeInstances', 'CreateUser', 'ConsoleLogin', 'ListBuckets', 'Decrypt']
+
+AZURE_OPERATIONS = ['Microsoft.Compute/virtualMachines/write', 'Microsoft.Storage/storageAccounts/listKeys/action',
+                    'Microsoft.Authorization/roleAssignments/write', 'Microsoft.KeyVault/vaults/secrets/read']
+
+LOOKUP_EVENTS_PAGE_SIZE = 50
+
+
+def get_timestamps(count, end=None, span=None):
+    end = end or datetime.now(timezone.utc)
+    step = span / count if span else timedelta(seconds=1)
+    return [end - step * i for i in range(count)]
+
+
+def make_lookup_events(count, seed=5, end=None, span=None):
+    """LookupEvents results; CloudTrailEvent is compact JSON, as the API returns it."""
+    rnd = random.Random(seed)
+    envelopes = []
+    for event_time in get_timestamps(count, end, span):
+        name = rnd.choice(EVENT_NAMES)
+        payload = {
+            'eventVersion': '1.09',
+            'userIdentity': {'type': 'AssumedRole', 'principalId': f'AROA{rnd.randrange(10**8):08d}:session', 'arn': f'arn:aws:sts::111122223333:assumed-role/role-{rnd.randrange(20)}/session',
+                             'accountId': '111122223333', 'sessionContext': {'attributes': {'creationDate': event_time.isoformat(), 'mfaAuthenticated': 'false'}}},
+            'eventTime': event_time.strftime('%Y-%m-%dT%H:%M:%SZ'),
+            'eventSource': 's3.amazonaws.com',
+            'eventName': name,
+            'awsRegion': 'us-east-1',
+            'sourceIPAddress': f'10.{rnd.randrange(256)}.{rnd.randrange(256)}.{rnd.randrange(256)}',
+            'userAgent': '[aws-sdk-go-v2/1.30.3 os/linux lang/go#1.22.5 md/GOOS#linux md/GOARCH#amd64 api/s3#1.58.2]',
+            'requestParameters': {'bucketName': f'bucket-{rnd.randrange(10)}', 'key': f'data/{rnd.randrange(10**6)}.parquet'},
+            'responseElements': None,
+            'requestID': f'{rnd.getrandbits(64):016X}',
+            'eventID': f'{rnd.getrandbits(128):032x}',
+            'readOnly': True,
+            'eventType': 'AwsApiCall',
+            'managementEvent': False,
+            'recipientAccountId': '111122223333',
+        }
+        envelopes.append({
+            'EventId': payload['eventID'], 'EventName': name, 'ReadOnly': 'true', 'EventTime': event_time, 'EventSource': 's3.amazonaws.com',
+            'Username': 'session', 'Resources': [], 'CloudTrailEvent': json.dumps(payload, separators=(',', ':')),
+        })
+    return envelopes
+
+
+def make_lookup_pages(envelopes, page_size=LOOKUP_EVENTS_PAGE_SIZE):
+    """Split LookupEvents results into response pages chained by NextToken."""
+    pages = []
+    for start in range(0, len(envelopes), page_size):
+        page = {'Events': envelopes[start:start + page_size]}
+        if start + page_size < len(envelopes):
+            page['NextToken'] = f'page-{start + page_size}'
+        pages.append(page)
+    return pages or [{'Events': []}]
+
+
+def make_azure_events(count, seed=11, end=None, span=None):
+    """Activity Log EventData objects with nested authorization, claims, HTTP request info and localizable strings."""
+    from azure.mgmt.monitor.v2015_04_01.models import EventData, LocalizableString, SenderAuthorization, HttpRequestInfo, EventLevel
+
+    def localizable(value):
+        return LocalizableString(value=value, localized_value=value.replace('/', ' ').title())
+
+    rnd = random.Random(seed)
+    subscription_id = '00000000-1111-2222-3333-444444444444'
+    events = []
+    for i, timestamp in enumerate(get_timestamps(count, end, span)):
+        operation = rnd.choice(AZURE_OPERATIONS)
+        resource_group = f'rg-{rnd.randrange(30)}'
+        resource_id = f'/subscriptions/{subscription_id}/resourceGroups/{resource_group}/providers/{operation.rsplit("/", 1)[0]}/res-{rnd.randrange(1000)}'
+        event = EventData()
+        # The service populates these read-only attributes when deserializing a response.
+        event.__dict__.update({
+            'authorization': SenderAuthorization(action=operation, role='Contributor', scope=resource_id),
+            'claims': {
+                'aud': 'https://management.core.windows.net/',
+                'iss': 'https://sts.windows.net/tenant/',
+                'iat': str(rnd.randrange(10**9)),
+                'appid': f'{rnd.getrandbits(128):032x}',
+                'http://schemas.microsoft.com/identity/claims/objectidentifier': f'{rnd.getrandbits(128):032x}',
+            },
+            'caller': f'user{rnd.randrange(50)}@example.com',
+            'description': '',
+            'id': f'{resource_id}/events/{rnd.getrandbits(64):016x}/ticks/{i}',
+            'event_data_id': f'{rnd.getrandbits(128):032x}',
+            'correlation_id': f'{rnd.getrandbits(128):032x}',
+            'event_name': localizable('EndRequest'),
+            'category': localizable('Administrative'),
+            'http_request': HttpRequestInfo(client_request_id=f'{rnd.getrandbits(64):016x}', client_ip_address=f'10.0.{rnd.randrange(256)}.{rnd.randrange(256)}', method='PUT', uri=resource_id),
+            'level': EventLevel.INFORMATIONAL,
+            'resource_group_name': resource_group,
+            'resource_provider_name': localizable(operation.split('/')[0]),
+            'resource_id': resource_id,
+            'resource_type': localizable(operation.rsplit('/', 1)[0]),
+            'operation_id': f'{rnd.getrandbits(128):032x}',
+            'operation_name': localizable(operation),
+            'properties': {'statusCode': 'Created', 'serviceRequestId': f'{rnd.getrandbits(64):016x}', 'eventCategory': 'Administrative'},
+            'status': localizable('Succeeded'),
+            'sub_status': localizable('Created'),
+            'event_timestamp': timestamp,
+            'submission_timestamp': timestamp + timedelta(seconds=rnd.randrange(30)),
+            'subscription_id': subscription_id,
+            'tenant_id': 'tenant',
+        })
+        events.append(event)
+    return events
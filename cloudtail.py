@@ -2,15 +2,27 @@ import sys
 import os
 import argparse
 from cloudtail_modules.config_handler import read_config, validate_basic_config
-from cloudtail_modules.event_pipeline import process_all_events
-from cloudtail_modules.database_utils import setup_database_connection_and_tables
+from cloudtail_modules.database_utils import setup_database_connection_and_tables, configure_storage, compact_event_data, has_search_index, rebuild_search_index
+from cloudtail_modules.payload_codec import PAYLOAD_CODECS
+from cloudtail_modules.event_search import SEARCH_PAGE_SIZE, search_events
+from cloudtail_modules.export_results import encode_ndjson_line
 from cloudtail_modules.export_results import export_all_events, export_events_by_time_range
-from datetime import datetime
-from colorama import init, Fore, Style
+from datetime import datetime, timedelta
 
-init(autoreset=True)
+# (database file, events table, event type) of each source, next to this script.
+DATABASES = {
+    'aws': ("./aws_events.db", 'cloudtrail_events', 'aws'),
+    'azure': ("./azure_events.db", 'azure_events', 'azure'),
+}
 
-ascii_art = f"""
+
+def print_banner():
+    # colorama is only needed for the banner, so --quiet runs do not import it.
+    from colorama import init, Fore
+
+    init(autoreset=True)
+
+    ascii_art = f"""
 {Fore.BLUE}                                                    kkkkkkkkkkkkkk                                  
                                                  (kk~kkkkkkkkkkkkkkk)                              
                                        kkkkkkk  kkmmkkkk      kkkkkkkkk                              
@@ -33,27 +45,44 @@ ascii_art = f"""
                                                                                                    
 """
 
-from_permiso = Fore.RED + r"""
+    from_permiso = Fore.RED + r"""
                                  __  ___ __     . __   __     __  __             __  __
                                 |__)|__ |__)|\/||/__` /  \   |__)/ /\   |    /\ |__)/__`
                           FROM: |   |___|  \|  ||.__/ \__/   |   \/_/   |___/~~\|__).__/
                              """
 
-print(
-    ascii_art +
-    "" +
-    from_permiso +
-    "\n\n\n"
-)
+    print(
+        ascii_art +
+        "" +
+        from_permiso +
+        "\n\n\n"
+    )
+
 
 def main():
     parser = argparse.ArgumentParser(description="CloudTail Tool for processing and exporting events.")
     parser.add_argument('config_file', nargs='?', default=None, help="Path to the configuration file (required for processing events)")
     parser.add_argument('--export', action='store_true', help="Export all processed events to JSON")
     parser.add_argument('--export-time-range', nargs=2, help="Export events from a specific time range. Provide start and end date in 'YYYY-MM-DD' format")
+    parser.add_argument('--compact', choices=PAYLOAD_CODECS, help="Rewrite the EventData already stored with this codec (training a compression dictionary) and vacuum the databases")
+    parser.add_argument('--rebuild-search-index', action='store_true', help="Create the full-text search index over stored EventData, or rebuild it from scratch")
+    parser.add_argument('--search', metavar='TEXT', help="Print the stored events whose EventData contains every term of TEXT (e.g. an access key ID, IP or ARN) as NDJSON, newest first; a trailing * matches a prefix")
+    parser.add_argument('--search-source', choices=DATABASES, default='aws', help="Database to search (default: aws)")
+    parser.add_argument('--search-time-range', nargs=2, metavar=('START', 'END'), help="Only events whose time is between these 'YYYY-MM-DD' dates, both included")
+    parser.add_argument('--search-account', help="Only events of this AWS account ID or Azure subscription ID")
+    parser.add_argument('--search-rule', help="Only events matched by this rule name")
+    parser.add_argument('--search-limit', type=int, default=SEARCH_PAGE_SIZE, help=f"Events per page (default: {SEARCH_PAGE_SIZE})")
+    parser.add_argument('--search-before', type=int, metavar='ROWID', help="Continue a search with the page after this row, as printed at the end of the previous page")
+    parser.add_argument('--quiet', action='store_true', help="Do not print the banner")
+    parser.add_argument('--watch', action='store_true', help="Keep running and poll every source on its poll_interval until SIGTERM or Ctrl+C")
     parser.add_argument('--output-dir', default="./", help="Directory to save the JSON files")
+    parser.add_argument('--format', choices=['json', 'ndjson', 'parquet'], default='json', help="Export format: a JSON array per source and day, NDJSON appending only events not exported yet, or a Parquet dataset partitioned by source and date (requires pyarrow)")
 
     args = parser.parse_args()
+    # Search results go to stdout as NDJSON, so the banner is left out.
+    if not args.quiet and not args.search:
+        print_banner()
+
     output_dir = args.output_dir
 
     if not os.path.exists(output_dir):
@@ -61,6 +90,9 @@ def main():
         os.makedirs(output_dir)
 
     if args.export or args.export_time_range:
+        if args.config_file:
+            configure_storage(read_config(args.config_file).get('storage'))
+
         try:
             aws_db_path = os.path.join(os.path.abspath(os.path.dirname(__file__)), "../aws_events.db")
             azure_db_path = os.path.join(os.path.abspath(os.path.dirname(__file__)), "../azure_events.db")
@@ -71,22 +103,97 @@ def main():
             }
 
             if args.export:
-                export_all_events(db_paths, output_dir)
+                export_all_events(db_paths, output_dir, args.format)
             elif args.export_time_range:
                 execStartTime = datetime.strptime(args.export_time_range[0], '%Y-%m-%d')
                 execEndTime = datetime.strptime(args.export_time_range[1], '%Y-%m-%d')
-                export_events_by_time_range(db_paths, output_dir, execStartTime, execEndTime)
+                export_events_by_time_range(db_paths, output_dir, execStartTime, execEndTime, args.format)
         except Exception as e:
             print(f"\033[91m[!] An error occurred during export: {e}\033[0m")
             sys.exit(1)
 
+    elif args.search:
+        if args.config_file:
+            configure_storage(read_config(args.config_file).get('storage'))
+
+        db_name, event_table_name, event_type = DATABASES[args.search_source]
+        db_path = os.path.join(os.path.abspath(os.path.dirname(__file__)), db_name)
+        startTime = endTime = None
+        if args.search_time_range:
+            startTime = datetime.strptime(args.search_time_range[0], '%Y-%m-%d')
+            endTime = datetime.strptime(args.search_time_range[1], '%Y-%m-%d') + timedelta(days=1)
+
+        try:
+            if not os.path.exists(db_path):
+                print(f"\033[91m[!] Database {db_path} does not exist.\033[0m", file=sys.stderr)
+                sys.exit(1)
+            con, cursor = setup_database_connection_and_tables(db_path, event_table_name, event_type)
+            if not has_search_index(cursor, event_table_name):
+                print(f"\033[91m[!] {db_path} has no search index. Build it with --rebuild-search-index.\033[0m", file=sys.stderr)
+                sys.exit(1)
+
+            found = 0
+            last_rowid = None
+            for rows in search_events(cursor, event_table_name, args.search, startTime, endTime, args.search_account, args.search_rule, args.search_before, args.search_limit):
+                columns = [column[0] for column in cursor.description[1:]]
+                sys.stdout.writelines(encode_ndjson_line(columns, row[1:]) for row in rows)
+                found += len(rows)
+                last_rowid = rows[-1][0]
+            con.close()
+        except Exception as e:
+            print(f"\033[91m[!] An error occurred during search: {e}\033[0m", file=sys.stderr)
+            sys.exit(1)
+
+        print(f"\033[96m[*] {found} {'event' if found == 1 else 'events'} found.\033[0m", file=sys.stderr)
+        if found == args.search_limit:
+            print(f"\033[96m[*] Next page: --search-before {last_rowid}\033[0m", file=sys.stderr)
+
+    elif args.rebuild_search_index:
+        if args.config_file:
+            configure_storage(read_config(args.config_file).get('storage'))
+
+        try:
+            for db_name, event_table_name, event_type in DATABASES.values():
+                db_path = os.path.join(os.path.abspath(os.path.dirname(__file__)), db_name)
+                if not os.path.exists(db_path):
+                    continue
+
+                con, cursor = setup_database_connection_and_tables(db_path, event_table_name, event_type)
+                indexed = rebuild_search_index(cursor, con, event_table_name)
+                con.close()
+                print(f"\033[92m[+]\033[96m Indexed \033[92m{indexed}\033[96m events in \033[93m{db_path}\033[96m for full-text search\033[0m")
+        except Exception as e:
+            print(f"\033[91m[!] An error occurred while building the search index: {e}\033[0m")
+            sys.exit(1)
+
+    elif args.compact:
+        if args.config_file:
+            configure_storage(read_config(args.config_file).get('storage'))
+
+        try:
+            for db_name, event_table_name, event_type in DATABASES.values():
+                db_path = os.path.join(os.path.abspath(os.path.dirname(__file__)), db_name)
+                if not os.path.exists(db_path):
+                    continue
+
+                con, cursor = setup_database_connection_and_tables(db_path, event_table_name, event_type)
+                rewritten, sizeBefore, sizeAfter = compact_event_data(cursor, con, event_table_name, args.compact)
+                con.close()
+                print(f"\033[92m[+]\033[96m Rewrote \033[92m{rewritten}\033[96m payloads in \033[93m{db_path}\033[96m with codec \033[94m{args.compact}\033[96m: \033[93m{sizeBefore / 2**20:.1f} MiB\033[96m -> \033[92m{sizeAfter / 2**20:.1f} MiB\033[0m")
+        except Exception as e:
+            print(f"\033[91m[!] An error occurred during compaction: {e}\033[0m")
+            sys.exit(1)
+
     elif args.config_file:
         config_file_path = args.config_file
 
         from cloudtail_modules.config_handler import read_config, validate_basic_config
+        # Imported here so exports and compaction do not load the cloud SDKs.
+        from cloudtail_modules.event_pipeline import process_all_events, watch_all_events
 
         config = read_config(config_file_path)
         validate_basic_config(config)
+        configure_storage(config.get('storage'))
 
         try:
             aws_db_path = os.path.join(os.path.abspath(os.path.dirname(__file__)), "./aws_events.db")
@@ -95,7 +202,10 @@ def main():
             aws_con, aws_cur = setup_database_connection_and_tables(aws_db_path, 'cloudtrail_events', 'aws')
             azure_con, azure_cur = setup_database_connection_and_tables(azure_db_path, 'azure_events', 'azure')
 
-            process_all_events(config, aws_cur, aws_con, azure_cur, azure_con)
+            if args.watch:
+                watch_all_events(config, aws_cur, aws_con, azure_cur, azure_con)
+            else:
+                process_all_events(config, aws_cur, aws_con, azure_cur, azure_con)
 
         except Exception as e:
             print(f"\033[91m[!] An error occurred during processing: {e}\033[0m")
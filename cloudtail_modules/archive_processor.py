@@ -0,0 +1,261 @@
+import gzip
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta, timezone
+from functools import partial
+from cloudtail_modules.aws_processor import ENVELOPE_FIELDS, LazyCloudTrailEvent, build_aws_rules, build_aws_rule_indexes, flush_aws_rule
+from cloudtail_modules.database_utils import DEFAULT_CHUNK_SIZE, set_up_aws_tables, set_up_archive_tables, get_archive_manifest, save_archive_manifest, start_execution_history, finish_execution_history
+from cloudtail_modules.query_planner import to_local_naive
+from cloudtail_modules.run_metrics import record_rule_metrics
+from cloudtail_modules.scheduler import get_poll_interval, shutdown
+
+# Files handed to each worker process per batch. Buffers are flushed and the manifest is updated after
+# every batch, so an interrupted run re-reads at most one batch.
+FILES_PER_PROCESS_BATCH = 16
+
+# Siblings of CloudTrail/ in the S3 layout that hold digests or Insights events, not management/data events.
+SKIPPED_DIRECTORIES = ('CloudTrail-Digest', 'CloudTrail-Insight')
+
+
+def find_archive_files(root):
+    """
+    Yield (path, account_id, region, day) for every log file under an
+    AWSLogs/[<org-id>/]<account>/CloudTrail/<region>/YYYY/MM/DD/ layout, in a stable order that keeps
+    each account and region together.
+    """
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = sorted(name for name in dirnames if name not in SKIPPED_DIRECTORIES)
+
+        parts = os.path.normpath(dirpath).split(os.sep)
+        if len(parts) < 6 or parts[-5] != 'CloudTrail':
+            continue
+        try:
+            day = datetime(int(parts[-3]), int(parts[-2]), int(parts[-1]), tzinfo=timezone.utc)
+        except ValueError:
+            continue
+
+        for filename in sorted(filenames):
+            if filename.endswith(('.json.gz', '.json')):
+                yield os.path.join(dirpath, filename), parts[-6], parts[-4], day
+
+
+def parse_event_time(value):
+    """Parse a record's UTC eventTime into local time, as botocore does for LookupEvents, so both share one clock."""
+    return datetime.fromisoformat(value.replace('Z', '+00:00')).astimezone() if value else None
+
+
+def build_envelope(record):
+    """
+    Shape a log file record like a LookupEvents result, so the same rules match it and it is stored in
+    the same format. Username and resource names follow LookupEvents as closely as the record allows.
+    """
+    identity = record.get('userIdentity') or {}
+    arn = identity.get('arn') or ''
+    return {
+        'EventId': record.get('eventID'),
+        'EventName': record.get('eventName'),
+        'ReadOnly': str(record['readOnly']).lower() if 'readOnly' in record else None,
+        'AccessKeyId': identity.get('accessKeyId'),
+        'EventTime': parse_event_time(record.get('eventTime')),
+        'EventSource': record.get('eventSource'),
+        'Username': identity.get('userName') or arn.rsplit('/', 1)[-1].rsplit(':', 1)[-1] or None,
+        'Resources': [{'ResourceType': resource.get('type'), 'ResourceName': resource.get('ARN')} for resource in record.get('resources') or []],
+        'CloudTrailEvent': json.dumps(record, separators=(',', ':')),
+    }
+
+
+# (envelope index, parsed index) of a worker process, built once by init_archive_worker.
+_worker_indexes = None
+
+
+def init_archive_worker(rule_specs):
+    global _worker_indexes
+    _worker_indexes = build_aws_rule_indexes(rule_specs)
+
+
+def read_archive_file(path):
+    """
+    Decompress, parse and match one log file in a worker process. Returns (record count, matched, error,
+    (parse seconds, match seconds)), where matched lists (envelope, rule positions) for the records at
+    least one rule matched; records nothing matched never leave the worker.
+    """
+    envelope_index, parsed_index = _worker_indexes
+    readStartTime = time.perf_counter()
+    try:
+        opener = gzip.open if path.endswith('.gz') else open
+        with opener(path, 'rb') as file:
+            records = json.load(file).get('Records') or []
+    except (OSError, EOFError, ValueError, AttributeError) as e:
+        return 0, [], str(e), (time.perf_counter() - readStartTime, 0.0)
+    matchStartTime = time.perf_counter()
+
+    matched = []
+    for record in records:
+        if not isinstance(record, dict) or not record.get('eventID'):
+            continue
+        envelope = build_envelope(record)
+        rules = envelope_index.match(envelope)
+        if parsed_index.conditional:
+            rules += parsed_index.match({**record, **{field: envelope[field] for field in ENVELOPE_FIELDS}})
+        else:
+            rules += parsed_index.unconditional
+        if rules:
+            matched.append((envelope, [rule['position'] for rule in rules]))
+    return len(records), matched, None, (matchStartTime - readStartTime, time.perf_counter() - matchStartTime)
+
+
+def get_new_archive_files(db, root):
+    """List the files whose path, size and mtime are not in the manifest yet."""
+    manifest = db.run(get_archive_manifest)
+    files = []
+    for path, account_id, region, day in find_archive_files(root):
+        stat = os.stat(path)
+        if manifest.get(path) != (stat.st_size, stat.st_mtime):
+            files.append((path, stat.st_size, stat.st_mtime, account_id, region, day))
+    return files
+
+
+def process_archive_source(source, db):
+    root = os.path.abspath(source['path'])
+    table_name = "cloudtrail_events"
+    db.run(set_up_aws_tables, table_name)
+    db.run(set_up_archive_tables)
+
+    if not os.path.isdir(root):
+        print(f"\033[91m[!] CloudTrail archive directory {root} does not exist. Skipping this data source.\033[0m")
+        return
+
+    lookup_attributes_list = source.get('lookup_Attributes', [])
+    if not lookup_attributes_list:
+        print(f"\033[93m[!] No lookup attributes defined for CloudTrail archive {root}. Skipping...\033[0m")
+        return
+
+    files = get_new_archive_files(db, root)
+    if not files:
+        print(f"\033[96m[*] No new files in CloudTrail archive \033[94m{root}\033[0m")
+        return
+
+    # Archive runs keep their own execution history, so they never move the LookupEvents resume points.
+    scope = f"archive:{root}"
+    rules = db.run(build_aws_rules, lookup_attributes_list, scope)
+    if not rules:
+        return
+
+    startTime = to_local_naive(min(file[5] for file in files))
+    endTime = to_local_naive(max(file[5] for file in files) + timedelta(days=1))
+    execStartTime = datetime.now()
+    for position, rule in enumerate(rules):
+        # Later runs over files of the same days add to this row's resultCount instead of resetting it.
+        rule['execution_id'] = db.run(start_execution_history, rule['attribute_key'], rule['attribute_value'], startTime, endTime, execStartTime, rule['rule_name'], scope, True)
+        rule['buffer'] = []
+        rule['resultCount'] = 0
+        rule['eventCount'] = 0
+        rule['position'] = position
+
+    rule_specs = [{key: rule[key] for key in ('server_filter', 'attribute_key', 'attribute_value', 'apply_fuzzy_matching', 'position')} for rule in rules]
+    processes = source.get('processes') or os.cpu_count() or 1
+    chunk_size = source.get('chunk_size', DEFAULT_CHUNK_SIZE)
+    batch_size = processes * FILES_PER_PROCESS_BATCH
+
+    print(f"\n\033[96m[*] Ingesting \033[94m{len(files)}\033[96m new {'file' if len(files) == 1 else 'files'} from CloudTrail archive \033[94m{root}\033[96m with \033[94m{processes}\033[96m {'process' if processes == 1 else 'processes'}\033[0m")
+    print(f"\033[96m[*] Start Time :: \033[93m{startTime.isoformat()}\033[0m")
+    print(f"\033[96m[*] End Time   :: \033[93m{endTime.isoformat()}\033[0m")
+
+    def flush_rules():
+        for rule in rules:
+            flush_aws_rule(db, rule, account_info, table_name)
+
+    # Parse and match run in the workers, so their times add up across processes; fetch is the time this
+    # thread waits for them and write the time spent flushing matches.
+    labels = {'source': 'archive'}
+    clock = db.metrics.clock(**labels)
+    account_info = None
+    recordCount = 0
+    failedFiles = 0
+    isSuccessful = False
+    try:
+        # Workers are spawned rather than forked: this runs on a job thread next to other jobs and the database writer.
+        with ProcessPoolExecutor(max_workers=processes, mp_context=multiprocessing.get_context('spawn'),
+                                 initializer=init_archive_worker, initargs=(rule_specs,)) as executor:
+            for batch_start in range(0, len(files), batch_size):
+                if shutdown.is_set():
+                    raise InterruptedError("shutdown requested")
+
+                batch = files[batch_start:batch_start + batch_size]
+                ingested = []
+                results = executor.map(read_archive_file, [file[0] for file in batch])
+                for (path, size, mtime, account_id, region, day), (count, matched, error, (parseSeconds, matchSeconds)) in zip(batch, results):
+                    clock.lap('fetch')
+                    file_labels = {'source': 'archive', 'account': account_id, 'region': region}
+                    db.metrics.add('archive_files', **file_labels)
+                    db.metrics.add('archive_bytes', size, **file_labels)
+                    db.metrics.observe('parse', parseSeconds, **labels)
+                    db.metrics.observe('match', matchSeconds, **labels)
+                    if error:
+                        print(f"\033[91m[!] Could not read {path}: {error}. It will be retried next run.\033[0m")
+                        failedFiles += 1
+                        continue
+
+                    # Every chunk is written with a single account and region.
+                    if account_info is None or (account_info['account_id'], account_info['region']) != (account_id, region):
+                        if account_info is not None:
+                            flush_rules()
+                        account_info = {'account_id': account_id, 'profile_name': None, 'region': region}
+
+                    for envelope, positions in matched:
+                        event = LazyCloudTrailEvent(envelope)
+                        for position in positions:
+                            rule = rules[position]
+                            rule['buffer'].append(event)
+                            if len(rule['buffer']) >= chunk_size:
+                                flush_aws_rule(db, rule, account_info, table_name)
+                    recordCount += count
+                    ingested.append((path, size, mtime, count))
+                    clock.lap('write')
+
+                # A file is only marked ingested once everything it matched is in the database.
+                flush_rules()
+                db.run(save_archive_manifest, ingested)
+                clock.lap('write')
+        isSuccessful = True
+    except InterruptedError:
+        print(f"\033[93m[*] Shutdown requested. The remaining files of CloudTrail archive {root} will be ingested next run.\033[0m")
+    except Exception as e:
+        print(f"\033[91m[!] Error ingesting CloudTrail archive {root}: {e}. The remaining files will be ingested next run.\033[0m")
+    finally:
+        for rule in rules:
+            if account_info is not None:
+                flush_aws_rule(db, rule, account_info, table_name)
+            db.run(finish_execution_history, rule['execution_id'], datetime.now(), rule['resultCount'], isSuccessful)
+        clock.lap('write')
+        clock.stop()
+        record_rule_metrics(db.metrics, rules, recordCount, labels)
+
+    if not isSuccessful:
+        return
+
+    print(f"\033[96m[*] Read \033[94m{recordCount}\033[96m events from \033[94m{len(files) - failedFiles}\033[96m {'file' if len(files) - failedFiles == 1 else 'files'}\033[0m")
+    for rule in rules:
+        eventCount = rule['eventCount']
+        print(f"\033[96m[*] Evaluated AWS lookup attribute: \033[94m{rule['attr']}\033[0m for CloudTrail archive \033[94m{root}\033[0m")
+
+        if rule['compiled_expression'] and rule['resultCount'] == 0:
+            print(f"\033[93m[*] No events matched the JMESPath filter: {rule['jmes_filter']}\033[0m")
+        if eventCount > 0:
+            print(f"\033[92m[+]\033[96m Successfully wrote \033[92m{eventCount}\033[96m {'event' if eventCount == 1 else 'events'} into \033[92m{table_name}\033[96m table for above attribute.\033[0m")
+        else:
+            print("\033[96m[*] \033[92m0\033[96m events found for above attribute & time range.\033[0m")
+
+
+def get_archive_jobs(config, db):
+    jobs = []
+    for source in config['dataSources']:
+        if source['source'] == 'AWS CloudTrail Archive':
+            if not source.get('path'):
+                print("\033[93m[!] No path defined for AWS CloudTrail Archive. Skipping...\033[0m")
+                continue
+            jobs.append((f"Archive {source['path']}", partial(process_archive_source, source, db), get_poll_interval(source)))
+    return jobs
@@ -1,52 +1,540 @@
-from datetime import datetime, timedelta
+from datetime import datetime
 import boto3
 import json
 import jmespath
-import fnmatch
-import re
+import threading
+import time
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
 from jmespath.exceptions import LexerError, JMESPathError
-from botocore.exceptions import ProfileNotFound
-from cloudtail_modules.database_utils import set_up_aws_tables, add_execution_history, write_events, get_last_successful_execution_history, add_lookup_attribute, add_event_lookup_mapping, add_rule_match
-
-def get_cloudtrail_events(client, lookup_attributes, startTime, endTime):
-    paginator = client.get_paginator('lookup_events')
-    page_iterator = paginator.paginate(
-        LookupAttributes=lookup_attributes,
-        StartTime=startTime,
-        EndTime=endTime,
-        MaxResults=50,
-    )
-    for page in page_iterator:
+from botocore.config import Config
+from botocore.exceptions import ProfileNotFound, ClientError, ReadTimeoutError, ConnectionError as BotoConnectionError
+from cloudtail_modules.database_utils import DEFAULT_CHUNK_SIZE, datetime_handler, SerializedWriter, set_up_aws_tables, start_execution_history, finish_execution_history, write_rule_chunk, save_pagination_checkpoint, get_pagination_checkpoint, clear_pagination_checkpoint
+from cloudtail_modules.query_planner import DEFAULT_LAG, get_lag, get_rule_window, plan_queries, shard_rules, in_rule_window, to_local_naive
+from cloudtail_modules.rule_engine import RuleIndex, compile_key_path, is_pattern
+from cloudtail_modules.scheduler import run_jobs, get_max_workers, get_poll_interval, shutdown
+from cloudtail_modules.rate_limiter import DEFAULT_REQUESTS_PER_SECOND, DEFAULT_MAX_RETRIES, get_rate_limiter, backoff_delay
+from cloudtail_modules.run_metrics import NULL_METRICS, record_rule_metrics
+
+_cloudtrail_clients = {}
+_cloudtrail_clients_lock = threading.Lock()
+
+# Error codes CloudTrail returns when LookupEvents exceeds its request quota.
+THROTTLING_ERROR_CODES = ('ThrottlingException', 'Throttling', 'TooManyRequestsException', 'RequestLimitExceeded')
+
+
+class PaginationInterrupted(Exception):
+    """Raised when a fetch stops before its last page (retries exhausted, or shutdown); carries the token to resume from."""
+
+    def __init__(self, next_token, reason):
+        super().__init__(reason)
+        self.next_token = next_token
+
+
+def get_response_size(response):
+    return int(response.get('ResponseMetadata', {}).get('HTTPHeaders', {}).get('content-length') or 0)
+
+
+def lookup_events_page(client, request, limiter, max_retries, metrics=NULL_METRICS, labels=None):
+    labels = labels or {}
+    for attempt in range(max_retries + 1):
+        if attempt:
+            metrics.add('retries', **labels)
+        if limiter:
+            limiter.acquire()
+        try:
+            metrics.add('api_calls', **labels)
+            response = client.lookup_events(**request)
+            if limiter:
+                limiter.on_success()
+            metrics.add('pages', **labels)
+            metrics.add('response_bytes', get_response_size(response), **labels)
+            return response
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') not in THROTTLING_ERROR_CODES:
+                raise
+            metrics.add('throttles', **labels)
+            if limiter:
+                limiter.on_throttle()
+            error = e
+        except (BotoConnectionError, ReadTimeoutError) as e:
+            error = e
+
+        if attempt < max_retries:
+            time.sleep(backoff_delay(attempt))
+
+    raise PaginationInterrupted(request.get('NextToken'), f"LookupEvents still failing after retries: {error}")
+
+
+def get_cloudtrail_events(client, lookup_attributes, startTime, endTime, limiter=None, next_token=None, max_retries=DEFAULT_MAX_RETRIES,
+                          metrics=NULL_METRICS, labels=None):
+    """
+    Page through LookupEvents, pacing every call through `limiter` and retrying throttles with
+    backoff. `next_token` resumes a previously interrupted fetch of the same window. Calls, pages,
+    bytes, throttles and retries are counted in `metrics` under `labels`.
+    """
+    request = {
+        'LookupAttributes': lookup_attributes,
+        'StartTime': startTime,
+        'EndTime': endTime,
+        'MaxResults': 50,
+    }
+    while True:
+        if shutdown.is_set():
+            raise PaginationInterrupted(next_token, "Shutdown requested")
+        if next_token:
+            request['NextToken'] = next_token
+        page = lookup_events_page(client, request, limiter, max_retries, metrics, labels)
         for event in page['Events']:
             yield event
 
+        next_token = page.get('NextToken')
+        if not next_token:
+            return
+
+
+# LookupEvents attributes that live in a nested list on the event envelope rather than at the top level.
+RESOURCE_LOOKUP_ATTRIBUTES = ('ResourceType', 'ResourceName')
+
+
+def get_lookup_attribute_value(event, key_path):
+    """Resolve a LookupEvents attribute on the raw event envelope, so it can be evaluated client-side."""
+    attribute_key = key_path[0]
+    if attribute_key in RESOURCE_LOOKUP_ATTRIBUTES:
+        return tuple(resource.get(attribute_key) for resource in event.get('Resources', []))
+    return event.get(attribute_key)
+
+
+# Envelope fields merged into the CloudTrailEvent payload when an event is stored.
+ENVELOPE_FIELDS = ('EventId', 'EventTime', 'EventName', 'EventSource')
+
+
+def parse_cloudtrail_event(event):
+    if 'CloudTrailEvent' not in event:
+        return event
 
-def fuzzy_match(value, pattern):
-    if '*' not in pattern and not re.search(r'[.^$+?{}[\]|()]', pattern):
-        return value == pattern
-    
-    if '*' in pattern:
-        return fnmatch.fnmatch(value, pattern)
-    
     try:
-        return re.match(pattern, value) is not None
-    except re.error:
-        print(f"\033[91m[!] Invalid regex pattern: {pattern}\033[0m")
-        return False
-
-def get_nested_event_value(event, attribute_key):
-
-    keys = attribute_key.split(".")
-    value = event
-    for key in keys:
-        if isinstance(value, dict):
-            value = value.get(key, "")
+        event_data = json.loads(event['CloudTrailEvent'])
+    except json.JSONDecodeError:
+        print(f"\033[91m[!] Failed to decode CloudTrailEvent JSON for event {event['EventId']}\033[0m")
+        return None
+
+    event_data.update({field: event[field] for field in ENVELOPE_FIELDS})
+    return event_data
+
+
+class LazyCloudTrailEvent:
+    """
+    A LookupEvents result whose CloudTrailEvent JSON is only parsed when a rule needs its nested fields
+    (wildcard/regex attributes or a JMESPath filter). Exact attribute rules match on the envelope, and
+    the event is stored as the raw JSON with the envelope fields spliced in instead of re-serialized.
+    A payload that was never parsed is validated before it is stored, so malformed JSON is still dropped.
+    """
+
+    __slots__ = ('envelope', '_data', '_parsed', '_valid')
+
+    def __init__(self, envelope):
+        self.envelope = envelope
+        self._data = None
+        self._parsed = False
+        self._valid = None
+
+    def __getitem__(self, key):
+        return self.envelope[key]
+
+    def get(self, key, default=None):
+        return self.envelope.get(key, default)
+
+    @property
+    def data(self):
+        """The parsed event merged with the envelope fields, or None if its JSON is invalid."""
+        if not self._parsed:
+            self._data = parse_cloudtrail_event(self.envelope)
+            self._parsed = True
+        return self._data
+
+    def is_valid(self):
+        """Whether the raw JSON can be stored; only decoded (and not kept) if no rule parsed it."""
+        if self._parsed:
+            return self._data is not None
+        if self._valid is None:
+            raw = self.envelope.get('CloudTrailEvent')
+            try:
+                if raw is not None:
+                    json.loads(raw)
+                self._valid = True
+            except json.JSONDecodeError:
+                print(f"\033[91m[!] Failed to decode CloudTrailEvent JSON for event {self.envelope['EventId']}\033[0m")
+                self._valid = False
+        return self._valid
+
+    def to_json(self):
+        raw = self.envelope.get('CloudTrailEvent')
+        if raw is None:
+            return json.dumps(self.envelope, default=datetime_handler)
+
+        body = raw.strip()[:-1].rstrip()
+        fields = json.dumps({field: self.envelope[field] for field in ENVELOPE_FIELDS}, default=datetime_handler)
+        return f"{body}{', ' if body != '{' else ''}{fields[1:]}"
+
+
+def is_json_object(raw):
+    raw = raw.strip()
+    return raw.startswith('{') and raw.endswith('}')
+
+
+def build_aws_rules(cursor, con, lookup_attributes_list, scope=None, lag=DEFAULT_LAG):
+    rules = []
+    seen = set()
+    now = datetime.now()
+
+    for attr in lookup_attributes_list:
+        attribute_key = attr.get('AttributeKey')
+        attribute_value = attr.get('AttributeValue')
+        rule_name = attr.get('RuleName', 'Unknown Rule')
+        jmes_path_expression = attr.get('jmes_filter', None)
+
+        if jmes_path_expression:
+            try:
+                compiled_expression = jmespath.compile(jmes_path_expression)
+            except (LexerError, JMESPathError) as e:
+                print(f"\033[91m[!] Invalid JMESPath expression: {jmes_path_expression}. Skipping this query.")
+                continue  
         else:
-            return "" 
-    return value
+            compiled_expression = None
+
+        if not ((attribute_key and attribute_value) or jmes_path_expression):
+            print(f"\033[91m[!] Either 'attributeKey'/'attributeValue' or 'jmes_filter' must be defined. Skipping this query.\033[0m")
+            continue
+
+        if (rule_name, attribute_key, attribute_value) in seen:
+            print(f"\033[93m[!] Duplicate lookup attribute {attr} for rule '{rule_name}'. Skipping...\033[0m")
+            continue
+        seen.add((rule_name, attribute_key, attribute_value))
+
+        apply_fuzzy_matching = is_pattern(attribute_value) if attribute_value else False
+
+        server_filter = None
+        if not apply_fuzzy_matching and attribute_key and attribute_value:
+            server_filter = (attribute_key, attribute_value)
+
+        startTime, endTime = get_rule_window(cursor, attribute_key, attribute_value, now, scope, lag)
+
+        rules.append({
+            'attr': attr,
+            'rule_name': rule_name,
+            'attribute_key': attribute_key,
+            'attribute_value': attribute_value,
+            'jmes_filter': jmes_path_expression,
+            'compiled_expression': compiled_expression,
+            'apply_fuzzy_matching': apply_fuzzy_matching,
+            'server_filter': server_filter,
+            'startTime': startTime,
+            'endTime': endTime,
+        })
+
+    return rules
+
+
+def stream_cloudtrail_events(client, lookup_attributes, startTime, endTime, limiter=None, next_token=None, max_retries=DEFAULT_MAX_RETRIES,
+                             metrics=NULL_METRICS, labels=None):
+    """Yield events page by page, unparsed, so no stage holds (or decodes) more than it needs."""
+    for event in get_cloudtrail_events(client, lookup_attributes, startTime, endTime, limiter, next_token, max_retries, metrics, labels):
+        if 'CloudTrailEvent' in event and not is_json_object(event['CloudTrailEvent']):
+            print(f"\033[91m[!] Failed to decode CloudTrailEvent JSON for event {event['EventId']}\033[0m")
+            continue
+        yield LazyCloudTrailEvent(event)
+
+
+def build_aws_rule_indexes(rules):
+    """
+    Compile a query's rules into two indexes: exact LookupEvents attributes evaluated on the raw
+    envelope, and wildcard/regex or condition-free (jmes_filter only) rules evaluated on the parsed event.
+    """
+    envelope_index = RuleIndex(get_lookup_attribute_value)
+    parsed_index = RuleIndex()
+
+    for rule in rules:
+        if rule['server_filter']:
+            envelope_index.add(rule, (rule['attribute_key'],), rule['attribute_value'])
+        elif rule['apply_fuzzy_matching']:
+            parsed_index.add(rule, compile_key_path(rule['attribute_key']), rule['attribute_value'])
+        else:
+            parsed_index.add(rule)
+
+    return envelope_index, parsed_index
+
+
+def flush_aws_rule(db, rule, account_info, table_name):
+    """Apply the rule's JMESPath filter to its buffered candidates and write the survivors as one chunk."""
+    candidates, rule['buffer'] = rule['buffer'], []
+    if candidates and rule['compiled_expression']:
+        parsed = {id(event.data): event for event in candidates if event.data is not None}
+        results = rule['compiled_expression'].search([event.data for event in parsed.values()]) or []
+        # Filters return the parsed dicts themselves; map them back so the raw JSON is stored.
+        candidates = [parsed.get(id(result), result) for result in results]
+    candidates = [event for event in candidates if not isinstance(event, LazyCloudTrailEvent) or event.is_valid()]
+    if not candidates:
+        return
+
+    event_ids = [event['EventId'] for event in candidates]
+    rule['eventCount'] += db.run(write_rule_chunk, rule['rule_name'], rule['attribute_key'], rule['attribute_value'], rule['execution_id'], candidates, event_ids, table_name, account_info, db.seen_events)
+    rule['resultCount'] += len(candidates)
+
+
+def get_query_key(lookup_attributes):
+    return json.dumps(lookup_attributes, sort_keys=True)
+
+
+def get_metric_labels(account_info):
+    return {'source': 'cloudtrail', 'account': account_info['account_id'], 'region': account_info['region']}
+
+
+def get_rule_keys(rules):
+    return {(rule['rule_name'], rule['attribute_key'], rule['attribute_value']) for rule in rules}
+
+
+def apply_pagination_checkpoint(cursor, con, query, scope):
+    """
+    Pin a query to the window and NextToken of an interrupted earlier fetch so it resumes instead of restarting.
+    The pages before the NextToken were only seen by the rules in that fetch, so a query with any other rule
+    discards the checkpoint and fetches the window from the start.
+    """
+    checkpoint = get_pagination_checkpoint(cursor, scope, query['query_key'], query['startTime'])
+    if not checkpoint:
+        return
+
+    endTime, next_token, rule_keys = checkpoint
+    checkpointed_rules = {tuple(key) for key in json.loads(rule_keys)} if rule_keys else set()
+    if not get_rule_keys(query['rules']) <= checkpointed_rules:
+        print(f"\033[93m[!] The rules of an interrupted fetch changed since its pagination checkpoint. The window will be fetched from the start.\033[0m")
+        clear_pagination_checkpoint(cursor, con, scope, query['query_key'], query['startTime'])
+        return
+
+    query['endTime'] = endTime
+    query['next_token'] = next_token
+    for rule in query['rules']:
+        rule['endTime'] = max(rule['startTime'], min(rule['endTime'], endTime))
+
+
+def run_aws_query(db, client, query, lookup_attributes, account_info, scope, table_name, chunk_size, limiter=None, max_retries=DEFAULT_MAX_RETRIES):
+    execStartTime = datetime.now()
+    for rule in query['rules']:
+        rule['execution_id'] = db.run(start_execution_history, rule['attribute_key'], rule['attribute_value'], rule['startTime'], rule['endTime'], execStartTime, rule['rule_name'], scope, bool(query.get('next_token')))
+        rule['buffer'] = []
+        rule['resultCount'] = 0
+        rule['eventCount'] = 0
+
+    # Each event's wall time is split into fetch (paging, rate limiting), parse, match and write (JMESPath
+    # filter, serialization and the SQLite transaction); with metrics disabled the clock does nothing.
+    labels = get_metric_labels(account_info)
+    clock = db.metrics.clock(**labels)
+    eventCount = 0
+    isSuccessful = False
+    try:
+        envelope_index, parsed_index = build_aws_rule_indexes(query['rules'])
+        events = stream_cloudtrail_events(client, lookup_attributes, query['startTime'], query['endTime'], limiter, query.get('next_token'), max_retries, db.metrics, labels)
+        for event in events:
+            clock.lap('fetch')
+            eventCount += 1
+            event_data = event.data if parsed_index.conditional else None
+            clock.lap('parse')
+
+            event_time = event.get('EventTime')
+            if event_time is not None:
+                event_time = to_local_naive(event_time)
+
+            matched = envelope_index.match(event.envelope)
+            matched += parsed_index.match(event_data) if parsed_index.conditional else parsed_index.unconditional
+            clock.lap('match')
+            for rule in matched:
+                if in_rule_window(rule, event_time):
+                    rule['buffer'].append(event)
+                    if len(rule['buffer']) >= chunk_size:
+                        flush_aws_rule(db, rule, account_info, table_name)
+            clock.lap('write')
+        clock.lap('fetch')
+        isSuccessful = True
+        db.run(clear_pagination_checkpoint, scope, query['query_key'], query['startTime'])
+    except PaginationInterrupted as e:
+        if e.next_token:
+            print(f"\033[91m[!] {e}. Checkpointed the fetch; the next run resumes from the last page received.\033[0m")
+            db.run(save_pagination_checkpoint, scope, query['query_key'], query['startTime'], query['endTime'], e.next_token, json.dumps(sorted(get_rule_keys(query['rules']), key=str)))
+        else:
+            print(f"\033[91m[!] {e}. No page was received; the next run fetches this window again.\033[0m")
+    except ClientError as e:
+        if "cloudtrail:LookupEvents" in str(e):
+            print(f"\033[91m[!] Missing permission: cloudtrail:LookupEvents\033[0m")
+        elif query.get('next_token') and e.response.get('Error', {}).get('Code') == 'InvalidNextTokenException':
+            print(f"\033[93m[!] Saved pagination checkpoint is no longer valid. The window will be fetched from the start next run.\033[0m")
+            db.run(clear_pagination_checkpoint, scope, query['query_key'], query['startTime'])
+        else:
+            raise e
+    finally:
+        for rule in query['rules']:
+            flush_aws_rule(db, rule, account_info, table_name)
+            db.run(finish_execution_history, rule['execution_id'], datetime.now(), rule['resultCount'], isSuccessful)
+        clock.lap('write')
+        clock.stop()
+        record_rule_metrics(db.metrics, query['rules'], eventCount, labels)
+
+    return isSuccessful
     
 
-def process_aws_events(config, cursor, con):
+def connect_aws_account(pair, region=None):
+    """Open a dedicated boto3 Session for an account/profile pair and verify which account it resolves to."""
+    profile_name = pair['profile_name']
+    expected_account_id = pair['account_id']
+
+    try:
+        session = boto3.Session(profile_name=profile_name, region_name=region) if profile_name else boto3.Session(region_name=region)
+        client = session.client('sts')
+        response = client.get_caller_identity()
+        account_id = response['Account']
+
+        if expected_account_id and expected_account_id != account_id:
+            raise ValueError(f"Configured accountId {expected_account_id} does not match the current credentials' accountId {account_id} for profile {profile_name}")
+
+    except ProfileNotFound:
+        print(f"\033[91m[!] Profile '{profile_name}' not found. Skipping this profile.\033[0m")
+        return None, None
+    except ValueError as ve:
+        print(f"\033[91m[!] {ve}. Skipping this profile.\033[0m")
+        return None, None
+    except Exception as e:
+        print(f"\033[91m[!] An unexpected error occurred: {e}. Skipping this profile.\033[0m")
+        return None, None
+
+    return session, account_id
+
+
+def get_enabled_regions(pair):
+    """List the regions enabled for an account (opt-in regions included only once opted in)."""
+    profile_name = pair['profile_name']
+    try:
+        session = boto3.Session(profile_name=profile_name) if profile_name else boto3.Session()
+        client = session.client('ec2', region_name=session.region_name or 'us-east-1')
+        response = client.describe_regions(AllRegions=False)
+        return sorted(region['RegionName'] for region in response['Regions'])
+    except Exception as e:
+        print(f"\033[91m[!] Could not list enabled regions for profile '{profile_name or 'default'}': {e}. Using the profile's default region.\033[0m")
+        return [None]
+
+
+def get_pair_regions(pair):
+    """Resolve the 'regions' setting of an account/profile pair: a list, "all", or unset for the profile default."""
+    regions = pair.get('regions')
+    if not regions:
+        return [None]
+    if regions == 'all':
+        return get_enabled_regions(pair)
+    return list(regions)
+
+
+def get_cloudtrail_client(pair, region=None):
+    """
+    Return (account_id, CloudTrail client) for an account/profile pair and region. Clients are kept for
+    the life of the process, so repeated polls in watch mode reuse the verified session instead of
+    calling STS again; boto3 refreshes temporary credentials on its own.
+    """
+    key = (pair['profile_name'], pair['account_id'], region)
+    with _cloudtrail_clients_lock:
+        if key in _cloudtrail_clients:
+            return _cloudtrail_clients[key]
+
+    session, account_id = connect_aws_account(pair, region)
+    if session is None:
+        return None, None
+
+    # Throttling is retried by get_cloudtrail_events so the shared limiter sees it, not by botocore.
+    client = session.client('cloudtrail', config=Config(retries={'mode': 'standard', 'max_attempts': 1}))
+    with _cloudtrail_clients_lock:
+        _cloudtrail_clients[key] = (account_id, client)
+    return account_id, client
+
+
+def process_aws_account(source, pair, db, region=None):
+    profile_name = pair['profile_name']
+    expected_account_id = pair['account_id']
+
+    connectStartTime = time.perf_counter()
+    account_id, client = get_cloudtrail_client(pair, region)
+    if client is None:
+        return
+    # STS verification and client setup; near zero once the client is cached in watch mode.
+    db.metrics.observe('connect', time.perf_counter() - connectStartTime, source='cloudtrail', account=account_id, region=client.meta.region_name)
+
+    table_name = "cloudtrail_events"
+    db.run(set_up_aws_tables, table_name)
+
+    region_name = client.meta.region_name
+    requests_per_second = source.get('requests_per_second', DEFAULT_REQUESTS_PER_SECOND)
+    max_retries = source.get('max_retries', DEFAULT_MAX_RETRIES)
+    limiter = get_rate_limiter((account_id, region_name), requests_per_second)
+
+    lookup_attributes_list = source.get('lookup_Attributes', [])
+
+    if not lookup_attributes_list:
+        print(f"\033[93m[!] No lookup attributes defined for profile {profile_name} with accountId {expected_account_id}. Skipping...\033[0m")
+        return
+
+    # Explicitly configured regions resume independently; the profile's default region keeps the account-wide scope.
+    scope = f"{account_id}/{region}" if region else account_id
+    account_info = {'account_id': account_id, 'profile_name': profile_name, 'region': region_name}
+    chunk_size = source.get('chunk_size', DEFAULT_CHUNK_SIZE)
+    lag = get_lag(source)
+    rules = db.run(build_aws_rules, lookup_attributes_list, scope, lag)
+
+    backfill_shards = source.get('backfill_shards')
+    if backfill_shards:
+        rules = db.run(shard_rules, rules, backfill_shards, scope, lag=lag)
+
+    queries = plan_queries(rules)
+    if backfill_shards and queries:
+        print(f"\n\033[96m[*] Backfilling \033[94m{len(queries)}\033[96m {'shard' if len(queries) == 1 else 'shards'} for account \033[94m{account_id}\033[96m in region \033[94m{region_name}\033[96m, up to \033[94m{backfill_shards}\033[96m at a time.\033[0m")
+
+    # Shards share the account's rate limiter, so running them side by side stays within the LookupEvents quota.
+    run_query = partial(process_aws_query, db, client, account_info, scope, table_name, chunk_size, limiter, max_retries)
+    with ThreadPoolExecutor(max_workers=backfill_shards or 1) as executor:
+        list(executor.map(run_query, queries))
+
+
+def process_aws_query(db, client, account_info, scope, table_name, chunk_size, limiter, max_retries, query):
+    profile_name = account_info['profile_name']
+    account_id = account_info['account_id']
+    region_name = account_info['region']
+
+    lookup_attributes = []
+    if query['server_filter']:
+        attribute_key, attribute_value = query['server_filter']
+        lookup_attributes = [{'AttributeKey': attribute_key, 'AttributeValue': attribute_value}]
+
+    query['query_key'] = get_query_key(lookup_attributes)
+    db.run(apply_pagination_checkpoint, query, scope)
+    if query.get('next_token'):
+        print(f"\n\033[93m[*] Resuming an interrupted fetch from its pagination checkpoint.\033[0m")
+
+    print(f"\n\033[96m[*] Querying AWS events for \033[94m{len(query['rules'])}\033[96m {'rule' if len(query['rules']) == 1 else 'rules'} with lookup attributes: \033[94m{lookup_attributes or 'none (shared scan)'}\033[0m with profile: \033[94m{profile_name or 'default'}\033[0m in region \033[94m{region_name}\033[0m")
+    print(f"\033[96m[*] Start Time :: \033[93m{query['startTime'].isoformat()}\033[0m")
+    print(f"\033[96m[*] End Time   :: \033[93m{query['endTime'].isoformat()}\033[0m")
+
+    if not run_aws_query(db, client, query, lookup_attributes, account_info, scope, table_name, chunk_size, limiter, max_retries):
+        return
+
+    for rule in query['rules']:
+        eventCount = rule['eventCount']
+        print(f"\033[96m[*] Evaluated AWS lookup attribute: \033[94m{rule['attr']}\033[0m for account \033[94m{account_id}\033[0m in region \033[94m{region_name}\033[0m")
+
+        if rule['compiled_expression'] and rule['resultCount'] == 0:
+            print(f"\033[93m[*] No events matched the JMESPath filter: {rule['jmes_filter']}\033[0m")
+        if eventCount > 0:
+            print(f"\033[92m[+]\033[96m Successfully wrote \033[92m{eventCount}\033[96m {'event' if eventCount == 1 else 'events'} into \033[92m{table_name}\033[96m table for above attribute.\033[0m")
+        else:
+            print(f"\033[96m[*] \033[92m0\033[96m events found for above attribute & time range.\033[0m")
+
+
+def get_aws_jobs(config, db):
+    jobs = []
     for source in config['dataSources']:
         if source['source'] == 'AWS CloudTrail':
             account_profile_pairs = source.get('account_profile_pairs', [])
@@ -56,140 +544,14 @@ def process_aws_events(config, cursor, con):
                 account_profile_pairs = [{"account_id": None, "profile_name": None}]
 
             for pair in account_profile_pairs:
-                profile_name = pair['profile_name']
-                expected_account_id = pair['account_id']
-                
-                try:
-                    session = boto3.Session(profile_name=profile_name) if profile_name else boto3.Session()
-                    client = session.client('sts')
-                    response = client.get_caller_identity()
-                    account_id = response['Account']
-
-                    if expected_account_id and expected_account_id != account_id:
-                        raise ValueError(f"Configured accountId {expected_account_id} does not match the current credentials' accountId {account_id} for profile {profile_name}")
-
-                except ProfileNotFound:
-                    print(f"\033[91m[!] Profile '{profile_name}' not found. Skipping this profile.\033[0m")
-                    continue
-                except ValueError as ve:
-                    print(f"\033[91m[!] {ve}. Skipping this profile.\033[0m")
-                    continue
-                except Exception as e:
-                    print(f"\033[91m[!] An unexpected error occurred: {e}. Skipping this profile.\033[0m")
-                    continue
-
-                table_name = "cloudtrail_events"
-                set_up_aws_tables(cursor, con, table_name)
-
-                client = session.client('cloudtrail')
-
-                lookup_attributes_list = source.get('lookup_Attributes', [])
-
-                if not lookup_attributes_list:
-                    print(f"\033[93m[!] No lookup attributes defined for profile {profile_name} with accountId {expected_account_id}. Skipping...\033[0m")
-                    continue
-
-                for attr in lookup_attributes_list:
-                    print(f"\n\033[96m[*] Querying AWS lookup attribute: \033[94m{attr}\033[0m with profile: \033[94m{profile_name or 'default'}\033[0m")
-
-                    attribute_key = attr.get('AttributeKey')
-                    attribute_value = attr.get('AttributeValue')
-                    rule_name = attr.get('RuleName', 'Unknown Rule')
-                    jmes_path_expression = attr.get('jmes_filter', None)
-
-                    if jmes_path_expression:
-                        try:
-                            compiled_expression = jmespath.compile(jmes_path_expression)
-                        except (LexerError, JMESPathError) as e:
-                            print(f"\033[91m[!] Invalid JMESPath expression: {jmes_path_expression}. Skipping this query.")
-                            continue  
-                    else:
-                        compiled_expression = None
-
-                    if not ((attribute_key and attribute_value) or jmes_path_expression):
-                        print(f"\033[91m[!] Either 'attributeKey'/'attributeValue' or 'jmes_filter' must be defined. Skipping this query.\033[0m")
-                        continue
-
-                    apply_fuzzy_matching = '*' in attribute_value or re.search(r'[.^$+?{}[\]|()]', attribute_value) if attribute_value else False
-
-                    lookup_attributes = []
-                    if not apply_fuzzy_matching and attribute_key and attribute_value:
-                        lookup_attributes = [{'AttributeKey': attribute_key, 'AttributeValue': attribute_value}]
-
-                    startTime = get_last_successful_execution_history(cursor, attribute_key, attribute_value)
-                    endTime = datetime.now() - timedelta(minutes=30)
-
-                    if endTime <= startTime:
-                        endTime = startTime + timedelta(minutes=1)
-
-                    endTime = min(startTime + timedelta(days=30), endTime)
-
-                    print(f"\033[96m[*] Start Time :: \033[93m{startTime.isoformat()}\033[0m")
-                    print(f"\033[96m[*] End Time   :: \033[93m{endTime.isoformat()}\033[0m")
-
-                    execStartTime = datetime.now()
-
-                    try:
-                        if lookup_attributes:
-                            events = list(get_cloudtrail_events(client, lookup_attributes, startTime, endTime))
-                        else:
-                            events = list(get_cloudtrail_events(client, [], startTime, endTime))
-                    except client.exceptions.ClientError as e:
-                        if "cloudtrail:LookupEvents" in str(e):
-                            print(f"\033[91m[!] Missing permission: cloudtrail:LookupEvents\033[0m")
-                            continue  
-                        else:
-                            raise e
-
-                    parsed_events = []
-                    for event in events:
-                        if 'CloudTrailEvent' in event:
-                            try:
-                                event_data = json.loads(event['CloudTrailEvent'])
-                                
-                                event_data.update({
-                                    'EventId': event['EventId'],
-                                    'EventTime': event['EventTime'],
-                                    'EventName': event['EventName'],
-                                    'EventSource': event['EventSource'],
-                                })
-                                
-                                parsed_events.append(event_data)
-                            except json.JSONDecodeError:
-                                print(f"\033[91m[!] Failed to decode CloudTrailEvent JSON for event {event['EventId']}\033[0m")
-                                continue
-                        else:
-                            parsed_events.append(event)  
-
-                    if compiled_expression:
-                        filtered_events = compiled_expression.search(parsed_events)
-                        if not filtered_events:
-                            print(f"\033[93m[*] No events matched the JMESPath filter: {jmes_path_expression}\033[0m")
-                            continue  
-                    else:
-                        filtered_events = parsed_events
-
-                    matched_events = []
-                    if apply_fuzzy_matching:
-                        for event in filtered_events:
-                            event_value = get_nested_event_value(event, attribute_key)
-                            if fuzzy_match(event_value, attribute_value):
-                                matched_events.append(event)
-                    else:
-                        matched_events = filtered_events
-
-                    execution_id = add_execution_history(cursor, con, attribute_key, attribute_value, startTime, endTime, execStartTime, datetime.now(), len(matched_events), True, rule_name)
-                    account_info = {'account_id': account_id, 'profile_name': profile_name}
-                    eventCount = write_events(cursor, con, matched_events, execution_id, table_name, 'EventID', account_info)
-
-                    attribute_id = add_lookup_attribute(cursor, con, attribute_key, attribute_value)
-                    for event in matched_events:
-                        add_event_lookup_mapping(cursor, con, event['EventId'], attribute_id, table_name)
-                        add_rule_match(cursor, con, rule_name, event['EventId'], execution_id, table_name)
-
-                    if eventCount > 0:
-                        print(f"\033[92m[+]\033[96m Successfully wrote \033[92m{eventCount}\033[96m {'event' if eventCount == 1 else 'events'} into \033[92m{table_name}\033[96m table for above attribute.\033[0m")
-                    else:
-                        print(f"\033[96m[*] \033[92m0\033[96m events found for above attribute & time range.\033[0m")
+                for region in get_pair_regions(pair):
+                    label = f"AWS {pair['account_id'] or 'default'} ({pair['profile_name'] or 'default'})"
+                    if region:
+                        label += f" {region}"
+                    jobs.append((label, partial(process_aws_account, source, pair, db, region), get_poll_interval(source)))
+    return jobs
 
 
+def process_aws_events(config, cursor, con):
+    db = SerializedWriter(con, cursor)
+    run_jobs(get_aws_jobs(config, db), get_max_workers(config))
@@ -1,11 +1,16 @@
-import fnmatch
-import re
-from datetime import datetime, timedelta
+import threading
+from datetime import datetime
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
 from azure.mgmt.monitor.v2015_04_01.models import LocalizableString
 from azure.identity import DefaultAzureCredential
 from azure.mgmt.monitor import MonitorManagementClient
 from azure.core.exceptions import ClientAuthenticationError, ResourceNotFoundError, HttpResponseError
-from cloudtail_modules.database_utils import set_up_azure_tables, add_execution_history, write_events, get_last_successful_execution_history, add_lookup_attribute, add_event_lookup_mapping, add_rule_match
+from cloudtail_modules.database_utils import DEFAULT_CHUNK_SIZE, SerializedWriter, set_up_azure_tables, start_execution_history, finish_execution_history, write_rule_chunk
+from cloudtail_modules.query_planner import DEFAULT_LAG, get_lag, get_rule_window, plan_queries, shard_rules, in_rule_window, to_local_naive
+from cloudtail_modules.rule_engine import RuleIndex, is_pattern
+from cloudtail_modules.scheduler import run_jobs, get_max_workers, get_poll_interval, shutdown
+from cloudtail_modules.run_metrics import NULL_METRICS, record_rule_metrics
 
 
 def custom_json_handler(obj):
@@ -24,37 +29,261 @@ def to_snake_case(camel_case_str):
 
 
 
-def get_azure_events(monitor_client, start_time: datetime, end_time: datetime):
-    filter_str = f"eventTimestamp ge '{start_time.isoformat()}' and eventTimestamp le '{end_time.isoformat()}'"    
-    try:
-        logs = monitor_client.activity_logs.list(filter=filter_str)
-        for log in logs:
+_monitor_clients = {}
+_monitor_clients_lock = threading.Lock()
+
+
+# Rule keys (as they appear on EventData) that the Activity Log $filter can evaluate server-side, mapped to
+# the filter field name. The API accepts at most one of these next to the eventTimestamp range.
+PUSHDOWN_FILTER_FIELDS = {
+    'resourceGroupName': 'resourceGroupName',
+    'resourceProviderName': 'resourceProvider',
+    'resourceId': 'resourceUri',
+    'correlationId': 'correlationId',
+}
+
+# Fields every stored event needs, added to a data source's "select" projection.
+REQUIRED_SELECT_FIELDS = ['eventDataId', 'operationName', 'eventTimestamp']
+
+
+def get_pushdown_filter(attribute_key, attribute_value, apply_fuzzy_matching):
+    if apply_fuzzy_matching or attribute_key not in PUSHDOWN_FILTER_FIELDS:
+        return None
+    return (PUSHDOWN_FILTER_FIELDS[attribute_key], attribute_value)
+
+
+def get_select_projection(source):
+    """Build the $select argument for a data source, or None to fetch every field."""
+    select_fields = source.get('select')
+    if not select_fields:
+        return None
+
+    fields = list(REQUIRED_SELECT_FIELDS)
+    for field in select_fields + [attr.get('AttributeKey') for attr in source.get('lookup_Attributes', [])]:
+        if field and field not in fields:
+            fields.append(field)
+    return ','.join(fields)
+
+
+def build_azure_filter(start_time: datetime, end_time: datetime, server_filter=None):
+    filter_str = f"eventTimestamp ge '{start_time.isoformat()}' and eventTimestamp le '{end_time.isoformat()}'"
+    if server_filter:
+        field, value = server_filter
+        escaped_value = value.replace("'", "''")
+        filter_str += f" and {field} eq '{escaped_value}'"
+    return filter_str
+
+
+def record_azure_response(metrics, labels, pipeline_response):
+    """raw_response_hook counting every HTTP response of a listing, retried attempts included."""
+    http_response = pipeline_response.http_response
+    metrics.add('api_calls', **labels)
+    metrics.add('response_bytes', int(http_response.headers.get('Content-Length') or 0), **labels)
+    if http_response.status_code == 429:
+        metrics.add('throttles', **labels)
+
+
+def get_azure_events(monitor_client, start_time: datetime, end_time: datetime, server_filter=None, select=None, metrics=NULL_METRICS, labels=None):
+    filter_str = build_azure_filter(start_time, end_time, server_filter)
+    labels = labels or {}
+    hooks = {'raw_response_hook': partial(record_azure_response, metrics, labels)} if metrics.enabled else {}
+    # Listing errors propagate so the caller leaves the window unsuccessful and it is fetched again next run.
+    logs = monitor_client.activity_logs.list(filter=filter_str, select=select, **hooks)
+    # Pages are only counted with metrics enabled; otherwise the pager is iterated as a whole.
+    for page in (logs.by_page() if metrics.enabled else [logs]):
+        metrics.add('pages', **labels)
+        for log in page:
             yield log
+
+
+def get_azure_event_value(event, key_path):
+    event_data = event.__dict__
+    if key_path[0] not in event_data:
+        return None
+
+    event_attribute_value = event_data[key_path[0]]
+    if isinstance(event_attribute_value, LocalizableString):
+        event_attribute_value = event_attribute_value.value
+    elif isinstance(event_attribute_value, dict) and 'value' in event_attribute_value:
+        event_attribute_value = event_attribute_value['value']
+    return event_attribute_value
+
+
+def build_azure_rules(cursor, con, lookup_attributes_list, scope=None, lag=DEFAULT_LAG):
+    rules = []
+    seen = set()
+    now = datetime.now()
+
+    for attr in lookup_attributes_list:
+        attribute_key = attr.get('AttributeKey')
+        attribute_value = attr.get('AttributeValue')
+        rule_name = attr.get('RuleName', 'Unknown Rule')
+
+        if not attribute_key or not attribute_value:
+            print(f"\033[91m[!] AttributeKey & AttributeValue are not defined in config file, so skipping this query.\033[0m")
+            continue
+
+        if (rule_name, attribute_key, attribute_value) in seen:
+            print(f"\033[93m[!] Duplicate lookup attribute {attr} for rule '{rule_name}'. Skipping...\033[0m")
+            continue
+        seen.add((rule_name, attribute_key, attribute_value))
+
+        apply_fuzzy_matching = is_pattern(attribute_value)
+        startTime, endTime = get_rule_window(cursor, attribute_key, attribute_value, now, scope, lag)
+
+        rules.append({
+            'attr': attr,
+            'rule_name': rule_name,
+            'attribute_key': attribute_key,
+            'attribute_value': attribute_value,
+            'snake_case_attribute_key': to_snake_case(attribute_key),
+            'apply_fuzzy_matching': apply_fuzzy_matching,
+            'server_filter': get_pushdown_filter(attribute_key, attribute_value, apply_fuzzy_matching),
+            'startTime': startTime,
+            'endTime': endTime,
+        })
+
+    return rules
+
+
+def build_azure_rule_index(rules):
+    rule_index = RuleIndex(get_azure_event_value)
+    for rule in rules:
+        rule_index.add(rule, (rule['snake_case_attribute_key'],), rule['attribute_value'])
+    return rule_index
+
+
+def flush_azure_rule(db, rule, subscription_id, table_name):
+    events, rule['buffer'] = rule['buffer'], []
+    if not events:
+        return
+
+    event_ids = [event.event_data_id for event in events]
+    account_info = {'subscription_id': subscription_id}
+    rule['eventCount'] += db.run(write_rule_chunk, rule['rule_name'], rule['attribute_key'], rule['attribute_value'], rule['execution_id'], events, event_ids, table_name, account_info, db.seen_events)
+    rule['resultCount'] += len(events)
+
+
+def get_monitor_client(credential, subscription_id):
+    """Clients are kept per credential and subscription, so repeated polls in watch mode reuse their tokens and connections."""
+    key = (credential, subscription_id)
+    with _monitor_clients_lock:
+        if key not in _monitor_clients:
+            _monitor_clients[key] = MonitorManagementClient(credential, subscription_id)
+        return _monitor_clients[key]
+
+
+def process_azure_subscription(source, subscription_id, credential, db):
+    table_name = "azure_events"
+    chunk_size = source.get('chunk_size', DEFAULT_CHUNK_SIZE)
+    select = get_select_projection(source)
+
+    try:
+        monitor_client = get_monitor_client(credential, subscription_id)
+    except ClientAuthenticationError:
+        print(f"\033[91m[!] Authentication failed for subscription_id '{subscription_id}'. Skipping.\033[0m")
+        return
+    except ResourceNotFoundError:
+        print(f"\033[91m[!] The subscription '{subscription_id}' could not be found. Skipping.\033[0m")
+        return
+    except HttpResponseError as hre:
+        if "InvalidSubscriptionId" in str(hre):
+            print(f"\033[91m[!] The subscription identifier '{subscription_id}' is malformed or invalid. Skipping.\033[0m")
+        else:
+            print(f"\033[91m[!] An unexpected HTTP error occurred: {hre.message}. Skipping.\033[0m")
+        return
+    except Exception as e:
+        print(f"\033[91m[!] An unexpected error occurred: {e}. Skipping.\033[0m")
+        return
+
+    lag = get_lag(source)
+    rules = db.run(build_azure_rules, source['lookup_Attributes'], subscription_id, lag)
+
+    backfill_shards = source.get('backfill_shards')
+    if backfill_shards:
+        rules = db.run(shard_rules, rules, backfill_shards, subscription_id, lag=lag)
+
+    queries = plan_queries(rules)
+    if backfill_shards and queries:
+        print(f"\n\033[96m[*] Backfilling \033[94m{len(queries)}\033[96m {'shard' if len(queries) == 1 else 'shards'} for subscription \033[94m{subscription_id}\033[96m, up to \033[94m{backfill_shards}\033[96m at a time.\033[0m")
+
+    run_query = partial(process_azure_query, db, monitor_client, subscription_id, table_name, chunk_size, select)
+    with ThreadPoolExecutor(max_workers=backfill_shards or 1) as executor:
+        list(executor.map(run_query, queries))
+
+
+def process_azure_query(db, monitor_client, subscription_id, table_name, chunk_size, select, query):
+    server_filter = f"{query['server_filter'][0]} eq '{query['server_filter'][1]}'" if query['server_filter'] else 'none (shared scan)'
+    print(f"\n\033[96m[*] Querying Azure activity log for \033[94m{len(query['rules'])}\033[96m {'rule' if len(query['rules']) == 1 else 'rules'} with server-side filter: \033[94m{server_filter}\033[0m for subscription \033[94m{subscription_id}\033[0m")
+    print(f"\033[96m[*] Start Time :: \033[93m{query['startTime'].isoformat()}\033[0m")
+    print(f"\033[96m[*] End Time   :: \033[93m{query['endTime'].isoformat()}\033[0m")
+
+    execStartTime = datetime.now()
+    for rule in query['rules']:
+        rule['execution_id'] = db.run(start_execution_history, rule['attribute_key'], rule['attribute_value'], rule['startTime'], rule['endTime'], execStartTime, rule['rule_name'], subscription_id)
+        rule['buffer'] = []
+        rule['resultCount'] = 0
+        rule['eventCount'] = 0
+
+    # Events arrive deserialized, so their parsing is part of the fetch stage.
+    labels = {'source': 'azure', 'account': subscription_id}
+    clock = db.metrics.clock(**labels)
+    eventCount = 0
+    isSuccessful = False
+    try:
+        rule_index = build_azure_rule_index(query['rules'])
+        for event in get_azure_events(monitor_client, query['startTime'], query['endTime'], query['server_filter'], select, db.metrics, labels):
+            clock.lap('fetch')
+            eventCount += 1
+            if shutdown.is_set():
+                raise InterruptedError("shutdown requested")
+            event_time = getattr(event, 'event_timestamp', None)
+            if event_time is not None:
+                event_time = to_local_naive(event_time)
+
+            matched = rule_index.match(event)
+            clock.lap('match')
+            for rule in matched:
+                if in_rule_window(rule, event_time):
+                    rule['buffer'].append(event)
+                    if len(rule['buffer']) >= chunk_size:
+                        flush_azure_rule(db, rule, subscription_id, table_name)
+            clock.lap('write')
+        clock.lap('fetch')
+        isSuccessful = True
+    except InterruptedError:
+        print(f"\033[93m[*] Shutdown requested. This window will be fetched again next run.\033[0m")
     except HttpResponseError as hre:
-        print(f"\033[91m[!] Error retrieving Azure events: {hre.message}. Skipping.\033[0m")
+        print(f"\033[91m[!] Error retrieving Azure events: {hre.message}. Skipping this lookup.\033[0m")
     except Exception as e:
-        print(f"\033[91m[!] Unexpected error retrieving Azure events: {e}. Skipping.\033[0m")
+        print(f"\033[91m[!] Error retrieving events: {e}. Skipping this lookup.\033[0m")
+    finally:
+        for rule in query['rules']:
+            flush_azure_rule(db, rule, subscription_id, table_name)
+            db.run(finish_execution_history, rule['execution_id'], datetime.now(), rule['resultCount'], isSuccessful)
+        clock.lap('write')
+        clock.stop()
+        record_rule_metrics(db.metrics, query['rules'], eventCount, labels)
 
+    if not isSuccessful:
+        return
 
-def fuzzy_match(value, pattern):
-    if '*' not in pattern and not re.search(r'[.^$+?{}[\]|()]', pattern):
-        return value == pattern
-    
-    if '*' in pattern:
-        return fnmatch.fnmatch(value, pattern)
-    
-    try:
-        return re.match(pattern, value) is not None
-    except re.error:
-        print(f"\033[91m[!] Invalid regex pattern: {pattern}\033[0m")
-        return False
+    for rule in query['rules']:
+        eventCount = rule['eventCount']
+        print(f"\033[96m[*] Evaluated Azure lookup attribute \033[94m{rule['attr']}\033[0m for subscription \033[94m{subscription_id}\033[0m")
 
+        if eventCount > 0:
+            print(f"\033[92m[+]\033[96m Successfully wrote \033[92m{eventCount}\033[96m {'event' if eventCount == 1 else 'events'} into \033[92m{table_name}\033[96m table for above attribute.\033[0m")
 
+        else:
+            print(f"\033[96m[*] \033[92m0\033[96m events found for above attribute & time range.\033[0m")
 
-def process_azure_events(config, cursor, con):
+
+def get_azure_jobs(config, db):
     table_name = "azure_events"
-    set_up_azure_tables(cursor, con, table_name)
+    db.run(set_up_azure_tables, table_name)
 
+    jobs = []
     for source in config['dataSources']:
         if source['source'] == 'Azure Activity Log':
             subscription_ids = source.get('subscription_ids', [])
@@ -66,90 +295,10 @@ def process_azure_events(config, cursor, con):
             credential = DefaultAzureCredential()
 
             for subscription_id in subscription_ids:
-                try:
-                    monitor_client = MonitorManagementClient(credential, subscription_id)
-                except ClientAuthenticationError:
-                    print(f"\033[91m[!] Authentication failed for subscription_id '{subscription_id}'. Skipping.\033[0m")
-                    continue
-                except ResourceNotFoundError:
-                    print(f"\033[91m[!] The subscription '{subscription_id}' could not be found. Skipping.\033[0m")
-                    continue
-                except HttpResponseError as hre:
-                    if "InvalidSubscriptionId" in str(hre):
-                        print(f"\033[91m[!] The subscription identifier '{subscription_id}' is malformed or invalid. Skipping.\033[0m")
-                    else:
-                        print(f"\033[91m[!] An unexpected HTTP error occurred: {hre.message}. Skipping.\033[0m")
-                    continue
-                except Exception as e:
-                    print(f"\033[91m[!] An unexpected error occurred: {e}. Skipping.\033[0m")
-                    continue
-
-                for attr in source['lookup_Attributes']:
-                    print(f"\n\033[96m[*] Querying Azure lookup attribute \033[94m{attr}\033[0m for subscription \033[94m{subscription_id}\033[0m")
-
-                    attribute_key = attr.get('AttributeKey')
-                    attribute_value = attr.get('AttributeValue')
-                    rule_name = attr.get('RuleName', 'Unknown Rule')
-
-                    if not attribute_key or not attribute_value:
-                        print(f"\033[91m[!] AttributeKey & AttributeValue are not defined in config file, so skipping this query.\033[0m")
-                        continue
-
-                    apply_fuzzy_matching = '*' in attribute_value or re.search(r'[.^$+?{}[\]|()]', attribute_value)
-
-                    startTime = get_last_successful_execution_history(cursor, attribute_key, attribute_value)
-                    endTime = datetime.now() - timedelta(minutes=30)
-
-                    if endTime <= startTime:
-                        endTime = startTime + timedelta(minutes=1)
-
-                    endTime = min(startTime + timedelta(days=30), endTime)
-
-                    print(f"\033[96m[*] Start Time :: \033[93m{startTime.isoformat()}\033[0m")
-                    print(f"\033[96m[*] End Time   :: \033[93m{endTime.isoformat()}\033[0m")
-
-                    execStartTime = datetime.now()
-                    try:
-                        events = list(get_azure_events(monitor_client, startTime, endTime))
-                    except Exception as e:
-                        print(f"\033[91m[!] Error retrieving events: {e}. Skipping this lookup.\033[0m")
-                        continue
-
-                    snake_case_attribute_key = to_snake_case(attribute_key)
-
-                    filtered_events = []
-                    for event in events:
-                        event_data = event.__dict__
-
-                        if snake_case_attribute_key in event_data:
-                            event_attribute_value = event_data[snake_case_attribute_key]
-                            if isinstance(event_attribute_value, LocalizableString):
-                                event_attribute_value = event_attribute_value.value
-                            elif isinstance(event_attribute_value, dict) and 'value' in event_attribute_value:
-                                event_attribute_value = event_attribute_value['value']
-                        else:
-                            continue
-
-                        if apply_fuzzy_matching:
-                            if fuzzy_match(event_attribute_value, attribute_value):
-                                filtered_events.append(event)
-                        else:
-                            if event_attribute_value == attribute_value:
-                                filtered_events.append(event)
-
-                    execution_id = add_execution_history(cursor, con, attribute_key, attribute_value, startTime, endTime, execStartTime, datetime.now(), len(filtered_events), True, rule_name)
-
-                    account_info = {'subscription_id': subscription_id}
-                    eventCount = write_events(cursor, con, filtered_events, execution_id, table_name, 'eventDataId', account_info)
-
-                    attribute_id = add_lookup_attribute(cursor, con, attribute_key, attribute_value)
-                    for event in filtered_events:
-                        add_event_lookup_mapping(cursor, con, event.event_data_id, attribute_id, table_name)
-                        add_rule_match(cursor, con, rule_name, event.event_data_id, execution_id, table_name)
-
-                    if eventCount > 0:
-                        print(f"\033[92m[+]\033[96m Successfully wrote \033[92m{eventCount}\033[96m {'event' if eventCount == 1 else 'events'} into \033[92m{table_name}\033[96m table for above attribute.\033[0m")
-
-                    else:
-                        print(f"\033[96m[*] \033[92m0\033[96m events found for above attribute & time range.\033[0m")
+                jobs.append((f"Azure {subscription_id}", partial(process_azure_subscription, source, subscription_id, credential, db), get_poll_interval(source)))
+    return jobs
+
 
+def process_azure_events(config, cursor, con):
+    db = SerializedWriter(con, cursor)
+    run_jobs(get_azure_jobs(config, db), get_max_workers(config))
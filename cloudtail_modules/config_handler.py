@@ -1,6 +1,8 @@
 import json
 import os
 import sys
+from cloudtail_modules.database_utils import STORAGE_PROFILES, DEFAULT_STORAGE_PROFILE
+from cloudtail_modules.payload_codec import PAYLOAD_CODECS
 
 def read_config(file_path):
     if not os.path.exists(file_path):
@@ -29,3 +31,72 @@ def validate_basic_config(config):
         if 'lookup_Attributes' not in source or not isinstance(source['lookup_Attributes'], list):
             print(f"\033[91m[!] Invalid config: 'lookup_Attributes' missing or not a list in dataSource at index {idx} ('{source.get('source', 'Unknown')}').\033[0m")
             sys.exit(1)
+
+    max_workers = config.get('max_workers', 1)
+    if not isinstance(max_workers, int) or isinstance(max_workers, bool) or max_workers < 1:
+        print("\033[91m[!] Invalid config: 'max_workers' must be a positive integer.\033[0m")
+        sys.exit(1)
+
+    for idx, source in enumerate(config['dataSources']):
+        backfill_shards = source.get('backfill_shards', 1)
+        if not isinstance(backfill_shards, int) or isinstance(backfill_shards, bool) or backfill_shards < 1:
+            print(f"\033[91m[!] Invalid config: 'backfill_shards' must be a positive integer in dataSource at index {idx}.\033[0m")
+            sys.exit(1)
+
+        select = source.get('select', [])
+        if not isinstance(select, list) or not all(isinstance(field, str) for field in select):
+            print(f"\033[91m[!] Invalid config: 'select' must be a list of field names in dataSource at index {idx}.\033[0m")
+            sys.exit(1)
+
+        requests_per_second = source.get('requests_per_second', 1)
+        if not isinstance(requests_per_second, (int, float)) or isinstance(requests_per_second, bool) or requests_per_second <= 0:
+            print(f"\033[91m[!] Invalid config: 'requests_per_second' must be a positive number in dataSource at index {idx}.\033[0m")
+            sys.exit(1)
+
+        max_retries = source.get('max_retries', 0)
+        if not isinstance(max_retries, int) or isinstance(max_retries, bool) or max_retries < 0:
+            print(f"\033[91m[!] Invalid config: 'max_retries' must be a non-negative integer in dataSource at index {idx}.\033[0m")
+            sys.exit(1)
+
+        chunk_size = source.get('chunk_size', 1)
+        if not isinstance(chunk_size, int) or isinstance(chunk_size, bool) or chunk_size < 1:
+            print(f"\033[91m[!] Invalid config: 'chunk_size' must be a positive integer in dataSource at index {idx}.\033[0m")
+            sys.exit(1)
+
+        processes = source.get('processes', 1)
+        if not isinstance(processes, int) or isinstance(processes, bool) or processes < 1:
+            print(f"\033[91m[!] Invalid config: 'processes' must be a positive integer in dataSource at index {idx}.\033[0m")
+            sys.exit(1)
+
+        poll_interval = source.get('poll_interval', 1)
+        if not isinstance(poll_interval, (int, float)) or isinstance(poll_interval, bool) or poll_interval <= 0:
+            print(f"\033[91m[!] Invalid config: 'poll_interval' must be a positive number of seconds in dataSource at index {idx}.\033[0m")
+            sys.exit(1)
+
+        lag = source.get('lag', 0)
+        if not isinstance(lag, (int, float)) or isinstance(lag, bool) or lag < 0:
+            print(f"\033[91m[!] Invalid config: 'lag' must be a non-negative number of seconds in dataSource at index {idx}.\033[0m")
+            sys.exit(1)
+
+    storage = config.get('storage', {})
+    if not isinstance(storage, dict) or storage.get('profile', DEFAULT_STORAGE_PROFILE) not in STORAGE_PROFILES:
+        print(f"\033[91m[!] Invalid config: 'storage' must be an object whose 'profile' is one of {', '.join(STORAGE_PROFILES)}.\033[0m")
+        sys.exit(1)
+    unknown_settings = set(storage) - {'profile'} - set(STORAGE_PROFILES[DEFAULT_STORAGE_PROFILE])
+    if unknown_settings:
+        print(f"\033[91m[!] Invalid config: unknown 'storage' settings: {', '.join(sorted(unknown_settings))}.\033[0m")
+        sys.exit(1)
+    if storage.get('payload_codec', 'none') not in PAYLOAD_CODECS:
+        print(f"\033[91m[!] Invalid config: 'payload_codec' must be one of {', '.join(PAYLOAD_CODECS)}.\033[0m")
+        sys.exit(1)
+    if not isinstance(storage.get('search_index', False), bool):
+        print("\033[91m[!] Invalid config: 'search_index' must be true or false.\033[0m")
+        sys.exit(1)
+
+    metrics = config.get('metrics', {})
+    if not isinstance(metrics, dict) or set(metrics) - {'enabled', 'textfile', 'report'}:
+        print("\033[91m[!] Invalid config: 'metrics' must be an object with only 'enabled', 'textfile' and 'report' settings.\033[0m")
+        sys.exit(1)
+    if not isinstance(metrics.get('enabled', True), bool) or not all(isinstance(metrics.get(key, ''), str) for key in ('textfile', 'report')):
+        print("\033[91m[!] Invalid config: 'metrics.enabled' must be true or false, and 'metrics.textfile' and 'metrics.report' must be file paths.\033[0m")
+        sys.exit(1)
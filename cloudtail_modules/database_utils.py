@@ -1,8 +1,15 @@
+import hashlib
 import sqlite3
+import sys
 from datetime import datetime, timedelta
-from azure.mgmt.monitor.v2015_04_01.models import LocalizableString
 import json
+import threading
+import time
 import uuid
+from cloudtail_modules.azure_encoder import encode_azure_event
+from cloudtail_modules.run_metrics import NULL_METRICS
+from cloudtail_modules.seen_events import SeenEventIndex, DEFAULT_CAPACITY as DEFAULT_SEEN_EVENTS_CAPACITY
+from cloudtail_modules.payload_codec import PayloadEncoder, decode_event_data, register_dictionary, train_dictionary, get_dictionary_id
 
 
 
@@ -14,12 +21,223 @@ def convert_datetime(s):
     return datetime.strptime(s.decode('ascii'), "%Y-%m-%d %H:%M:%S.%f")
 
 
+DEFAULT_CHUNK_SIZE = 500
+COMPACTION_SAMPLE_SIZE = 2000
+COMPACTION_BATCH_SIZE = 1000
+# Event IDs per primary-key lookup, well below SQLite's host parameter limit.
+STORED_ID_BATCH_SIZE = 500
+
 sqlite3.register_adapter(datetime, adapt_datetime)
 sqlite3.register_converter("timestamp", convert_datetime)
 
-def connect_to_db(db_name):
-    con = sqlite3.connect(db_name, detect_types=sqlite3.PARSE_DECLTYPES)
-    return con, con.cursor()
+# Connection settings applied by connect_to_db. 'wal' lets exports and ad-hoc queries read while an
+# ingest is writing; 'compat' keeps SQLite's own defaults (rollback journal, synchronous=FULL).
+STORAGE_PROFILES = {
+    'wal': {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'cache_size': -65536,
+        'mmap_size': 268435456,
+        'temp_store': 'MEMORY',
+        'wal_checkpoint_interval': 30,
+        'payload_codec': 'none',
+        'search_index': False,
+    },
+    'compat': {
+        'journal_mode': 'DELETE',
+        'synchronous': 'FULL',
+        'cache_size': -2000,
+        'mmap_size': 0,
+        'temp_store': 'DEFAULT',
+        'wal_checkpoint_interval': None,
+        'payload_codec': 'none',
+        'search_index': False,
+    },
+}
+DEFAULT_STORAGE_PROFILE = 'wal'
+
+# The 'storage' config section applied by connect_to_db, set once per run by configure_storage.
+_storage_config = None
+
+
+def get_storage_settings(storage=None):
+    """Resolve the 'storage' config section: a named profile plus any individual settings overriding it."""
+    storage = storage or _storage_config or {}
+    settings = dict(STORAGE_PROFILES[storage.get('profile', DEFAULT_STORAGE_PROFILE)])
+    settings.update((key, value) for key, value in storage.items() if key in settings)
+    return settings
+
+
+def apply_storage_settings(con, settings):
+    con.execute(f"PRAGMA journal_mode = {settings['journal_mode']}")
+    con.execute(f"PRAGMA synchronous = {settings['synchronous']}")
+    con.execute(f"PRAGMA cache_size = {int(settings['cache_size'])}")
+    con.execute(f"PRAGMA mmap_size = {int(settings['mmap_size'])}")
+    con.execute(f"PRAGMA temp_store = {settings['temp_store']}")
+
+
+def configure_storage(storage):
+    global _storage_config
+    _storage_config = storage
+
+
+def connect_to_db(db_name, storage=None):
+    con = sqlite3.connect(db_name, detect_types=sqlite3.PARSE_DECLTYPES | sqlite3.PARSE_COLNAMES, check_same_thread=False)
+    apply_storage_settings(con, get_storage_settings(storage or _storage_config))
+    # event_data(EventData) returns the JSON text of a payload however it is stored, for ad-hoc queries.
+    con.create_function('event_data', 1, decode_event_data, deterministic=True)
+    cursor = con.cursor()
+    load_payload_dictionaries(cursor)
+    return con, cursor
+
+
+def finish_storage(cursor, con):
+    """End of a run: refresh the planner statistics SQLite considers stale and fold the WAL back into the database."""
+    cursor.execute("PRAGMA optimize")
+    if cursor.execute("PRAGMA journal_mode").fetchone()[0] == 'wal':
+        cursor.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+
+class SerializedWriter:
+    """
+    Funnels every call against one SQLite connection through a single lock so worker threads can share it.
+    With a `checkpoint_interval` (seconds) the WAL is checkpointed between calls at most that often, so
+    it does not keep growing while readers hold old snapshots during a long ingest.
+    """
+
+    def __init__(self, con, cursor, checkpoint_interval=None):
+        self.con = con
+        self.cursor = cursor
+        self.checkpoint_interval = checkpoint_interval
+        # Optional SeenEventIndex of the connection's events table, passed along with every chunk written.
+        self.seen_events = None
+        # RunMetrics of the jobs writing through this connection; NULL_METRICS records nothing.
+        self.metrics = NULL_METRICS
+        self._last_checkpoint = time.monotonic()
+        self._lock = threading.Lock()
+
+    def run(self, func, *args, **kwargs):
+        with self._lock:
+            result = func(self.cursor, self.con, *args, **kwargs)
+            if self.checkpoint_interval and time.monotonic() - self._last_checkpoint >= self.checkpoint_interval and not self.con.in_transaction:
+                self.cursor.execute("PRAGMA wal_checkpoint(PASSIVE)")
+                self._last_checkpoint = time.monotonic()
+            return result
+
+
+def migrate_execution_history_scope(cursor, event_table_name):
+    """Rebuild execution_history from before per-account scoping so the Scope column joins its unique key."""
+    columns = [row[1] for row in cursor.execute("PRAGMA table_info(execution_history)")]
+    if 'Scope' in columns:
+        return
+
+    cursor.execute("""
+        CREATE TABLE execution_history_new(
+            ExecutionID INTEGER PRIMARY KEY AUTOINCREMENT,
+            RuleName TEXT,
+            AttributeKey TEXT,
+            AttributeValue TEXT,
+            startTime TIMESTAMP,
+            endTime TIMESTAMP,
+            execStartTime TIMESTAMP,
+            execEndTime TIMESTAMP,
+            resultCount INTEGER,
+            isSuccessful BOOLEAN,
+            Scope TEXT,
+            UNIQUE(RuleName, AttributeKey, AttributeValue, startTime, Scope)
+        );
+    """)
+    cursor.execute("""
+        INSERT INTO execution_history_new (ExecutionID, RuleName, AttributeKey, AttributeValue, startTime, endTime, execStartTime, execEndTime, resultCount, isSuccessful)
+        SELECT ExecutionID, RuleName, AttributeKey, AttributeValue, startTime, endTime, execStartTime, execEndTime, resultCount, isSuccessful FROM execution_history
+    """)
+    cursor.execute("DROP TABLE execution_history")
+    cursor.execute("ALTER TABLE execution_history_new RENAME TO execution_history")
+
+
+
+
+def add_missing_columns(cursor, table_name, columns):
+    existing_columns = [row[1] for row in cursor.execute(f"PRAGMA table_info({table_name})")]
+    for column_name, column_type in columns.items():
+        if column_name not in existing_columns:
+            cursor.execute(f"ALTER TABLE {table_name} ADD COLUMN {column_name} {column_type}")
+
+
+def add_region_column(cursor, event_table_name):
+    if event_table_name == 'cloudtrail_events':
+        add_missing_columns(cursor, event_table_name, {'Region': 'TEXT'})
+
+
+def add_query_indexes(cursor, event_table_name):
+    """
+    Index the columns the hot queries filter on, and give event_lookup_attributes the unique key its
+    INSERT OR IGNORE relies on, dropping the duplicate mappings re-runs piled up without it.
+    """
+    id_column = get_event_id_column(event_table_name)
+    if event_table_name == 'azure_events':
+        time_column, name_column, account_column = 'EventTimestamp', 'OperationName', 'SubscriptionID'
+    else:
+        time_column, name_column, account_column = 'EventTime', 'EventName', 'AccountID'
+
+    # Covers get_execution_windows: equality on the lookup key, rows already in startTime order.
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_execution_history_lookup
+        ON execution_history(AttributeKey, AttributeValue, startTime, endTime, isSuccessful, Scope)
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_execution_history_execStartTime ON execution_history(execStartTime)")
+    cursor.execute(f"CREATE INDEX IF NOT EXISTS idx_{event_table_name}_{time_column} ON {event_table_name}({time_column})")
+    cursor.execute(f"CREATE INDEX IF NOT EXISTS idx_{event_table_name}_{name_column} ON {event_table_name}({name_column}, {time_column})")
+    cursor.execute(f"CREATE INDEX IF NOT EXISTS idx_{event_table_name}_{account_column} ON {event_table_name}({account_column}, {time_column})")
+    cursor.execute(f"CREATE INDEX IF NOT EXISTS idx_{event_table_name}_ExecutionID ON {event_table_name}(ExecutionID)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_rule_matches_ExecutionID ON rule_matches(ExecutionID)")
+
+    cursor.execute(f"""
+        DELETE FROM event_lookup_attributes WHERE rowid NOT IN (
+            SELECT MIN(rowid) FROM event_lookup_attributes GROUP BY {id_column}, AttributeID
+        )
+    """)
+    if cursor.rowcount > 0:
+        print(f"\033[93m[*] Removed {cursor.rowcount} duplicate rows from event_lookup_attributes.\033[0m")
+    cursor.execute(f"CREATE UNIQUE INDEX IF NOT EXISTS idx_event_lookup_attributes_unique ON event_lookup_attributes({id_column}, AttributeID)")
+
+
+def add_payload_dictionaries(cursor, event_table_name):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS payload_dictionaries(
+            DictionaryID INTEGER PRIMARY KEY,
+            Codec TEXT,
+            Data BLOB,
+            createdAt TIMESTAMP
+        );
+    """)
+
+
+def add_checkpoint_rule_keys(cursor, event_table_name):
+    """Record which rules took part in a checkpointed fetch; checkpoints saved before have none and are never resumed."""
+    if event_table_name == 'cloudtrail_events':
+        add_missing_columns(cursor, 'pagination_checkpoints', {'RuleKeys': 'TEXT'})
+
+
+# Applied in order to databases whose PRAGMA user_version is below the step's position (1-based).
+# Every step is idempotent, so databases migrated before versioning existed pass through them safely.
+SCHEMA_MIGRATIONS = [
+    migrate_execution_history_scope,
+    add_region_column,
+    add_query_indexes,
+    add_payload_dictionaries,
+    add_checkpoint_rule_keys,
+]
+
+
+def migrate_schema(cursor, con, event_table_name):
+    """Run the schema migrations this database has not had yet and record the version it is now at."""
+    version = cursor.execute("PRAGMA user_version").fetchone()[0]
+    for step_version, migration in enumerate(SCHEMA_MIGRATIONS, start=1):
+        if version < step_version:
+            migration(cursor, event_table_name)
+            cursor.execute(f"PRAGMA user_version = {step_version}")
+    con.commit()
 
 
 
@@ -37,7 +255,8 @@ def set_up_aws_tables(cursor, con, event_table_name):
             execEndTime TIMESTAMP,
             resultCount INTEGER,
             isSuccessful BOOLEAN,
-            UNIQUE(RuleName, AttributeKey, AttributeValue, startTime)
+            Scope TEXT,
+            UNIQUE(RuleName, AttributeKey, AttributeValue, startTime, Scope)
         );
     """)
     cursor.execute(f"""
@@ -49,9 +268,22 @@ def set_up_aws_tables(cursor, con, event_table_name):
             EventTime TIMESTAMP,
             EventData TEXT,
             ExecutionID INTEGER,
+            Region TEXT,
             FOREIGN KEY(ExecutionID) REFERENCES execution_history(ExecutionID)
         );
     """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS pagination_checkpoints(
+            Scope TEXT,
+            QueryKey TEXT,
+            startTime TIMESTAMP,
+            endTime TIMESTAMP,
+            NextToken TEXT,
+            updatedAt TIMESTAMP,
+            RuleKeys TEXT,
+            PRIMARY KEY(Scope, QueryKey, startTime)
+        );
+    """)
     cursor.execute("""
         CREATE TABLE IF NOT EXISTS lookup_attributes(
             AttributeID INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -79,7 +311,9 @@ def set_up_aws_tables(cursor, con, event_table_name):
             FOREIGN KEY(ExecutionID) REFERENCES execution_history(ExecutionID)
         );
     """)
-    con.commit()
+    migrate_schema(cursor, con, event_table_name)
+    if get_storage_settings()['search_index']:
+        set_up_search_index(cursor, con, event_table_name)
 
 def set_up_azure_tables(cursor, con, event_table_name):
     cursor.execute(f"""
@@ -94,7 +328,8 @@ def set_up_azure_tables(cursor, con, event_table_name):
             execEndTime TIMESTAMP,
             resultCount INTEGER,
             isSuccessful BOOLEAN,
-            UNIQUE(RuleName, AttributeKey, AttributeValue, startTime)
+            Scope TEXT,
+            UNIQUE(RuleName, AttributeKey, AttributeValue, startTime, Scope)
         );
     """)
     cursor.execute(f"""
@@ -135,7 +370,9 @@ def set_up_azure_tables(cursor, con, event_table_name):
             FOREIGN KEY(ExecutionID) REFERENCES execution_history(ExecutionID)
         );
     """)
-    con.commit()
+    migrate_schema(cursor, con, event_table_name)
+    if get_storage_settings()['search_index']:
+        set_up_search_index(cursor, con, event_table_name)
     
 
 def setup_database_connection_and_tables(db_name, event_table_name, event_type):
@@ -151,24 +388,252 @@ def setup_database_connection_and_tables(db_name, event_table_name, event_type):
 
 def add_execution_history(cursor, con, attribute_key: str, attribute_value: str, startTime: datetime, endTime: datetime,
                           execStartTime: datetime, execEndTime: datetime,
-                          resultCount: int, isSuccessful: bool, rule_name: str) -> int:
-    query = f"""INSERT INTO execution_history (RuleName, AttributeKey, AttributeValue, startTime, endTime, execStartTime, execEndTime, resultCount, isSuccessful)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)"""
-    cursor.execute(query, (rule_name, attribute_key, attribute_value, startTime, endTime, execStartTime, execEndTime, resultCount, isSuccessful))
-    con.commit()
-    return cursor.lastrowid
+                          resultCount: int, isSuccessful: bool, rule_name: str, scope: str = None, commit: bool = True) -> int:
+    query = f"""INSERT INTO execution_history (RuleName, AttributeKey, AttributeValue, startTime, endTime, execStartTime, execEndTime, resultCount, isSuccessful, Scope)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"""
+    cursor.execute(query, (rule_name, attribute_key, attribute_value, startTime, endTime, execStartTime, execEndTime, resultCount, isSuccessful, scope))
+    execution_id = cursor.lastrowid
+    if commit:
+        con.commit()
+    return execution_id
 
 
 
 
-def get_last_successful_execution_history(cursor, attribute_key: str, attribute_value: str) -> datetime:
-    query = f"SELECT endTime FROM execution_history WHERE AttributeKey = ? AND AttributeValue = ? AND isSuccessful = 1 ORDER BY endTime DESC LIMIT 1"
-    cursor.execute(query, (attribute_key, attribute_value))
+def start_execution_history(cursor, con, attribute_key: str, attribute_value: str, startTime: datetime, endTime: datetime,
+                            execStartTime: datetime, rule_name: str, scope: str = None, resume: bool = False) -> int:
+    """
+    Open an unsuccessful execution_history row for a streamed run, reusing the row a failed attempt left
+    behind. With `resume` the earlier attempt's resultCount is kept, since its chunks are not fetched again.
+    """
+    cursor.execute("""
+        SELECT ExecutionID FROM execution_history
+        WHERE RuleName = ? AND AttributeKey IS ? AND AttributeValue IS ? AND startTime = ? AND Scope IS ?
+    """, (rule_name, attribute_key, attribute_value, startTime, scope))
     row = cursor.fetchone()
+
     if row:
-        return row[0]
+        cursor.execute("""
+            UPDATE execution_history SET endTime = ?, execStartTime = ?, execEndTime = NULL, isSuccessful = 0,
+                resultCount = CASE WHEN ? THEN resultCount ELSE 0 END
+            WHERE ExecutionID = ?
+        """, (endTime, execStartTime, resume, row[0]))
+        execution_id = row[0]
     else:
-        return datetime.now() - timedelta(days=90) + timedelta(days=1)
+        execution_id = add_execution_history(cursor, con, attribute_key, attribute_value, startTime, endTime, execStartTime, None, 0, False, rule_name, scope, commit=False)
+
+    con.commit()
+    return execution_id
+
+
+
+
+def finish_execution_history(cursor, con, execution_id: int, execEndTime: datetime, resultCount: int, isSuccessful: bool):
+    """Close a row opened by start_execution_history, adding this attempt's matches to its resultCount."""
+    cursor.execute("""
+        UPDATE execution_history SET execEndTime = ?, resultCount = resultCount + ?, isSuccessful = ?
+        WHERE ExecutionID = ?
+    """, (execEndTime, resultCount, isSuccessful, execution_id))
+    con.commit()
+
+
+
+
+def get_execution_windows(cursor, attribute_key: str, attribute_value: str, since: datetime, scope: str = None) -> list[tuple]:
+    """
+    Return (startTime, endTime, isSuccessful) for every run of a lookup attribute in `scope` that ends after
+    `since`, oldest first. Successful rows written before per-account scoping have no Scope and count for every scope.
+    """
+    cursor.execute("""
+        SELECT startTime, endTime, isSuccessful FROM execution_history
+        WHERE AttributeKey = ? AND AttributeValue = ? AND endTime >= ? AND (Scope = ? OR (Scope IS NULL AND isSuccessful = 1))
+        ORDER BY startTime, endTime
+    """, (attribute_key, attribute_value, since, scope))
+    return cursor.fetchall()
+
+
+def get_last_successful_execution_history(cursor, attribute_key: str, attribute_value: str, now: datetime = None, scope: str = None) -> datetime:
+    """
+    Return where the next run of a lookup attribute should start: the end of the history covered without
+    gaps by successful runs, counted from its earliest run. A failed backfill shard therefore holds the
+    resume point back even when later shards succeeded, and an interrupted first run is retried from the
+    start it used, so its already-written chunks and pagination checkpoint still line up.
+    """
+    now = now or datetime.now()
+    rows = get_execution_windows(cursor, attribute_key, attribute_value, now - timedelta(days=90), scope)
+    if not rows:
+        return now - timedelta(days=90) + timedelta(days=1)
+
+    covered_until = rows[0][0]
+    for startTime, endTime, isSuccessful in rows:
+        if not isSuccessful:
+            continue
+        if startTime > covered_until:
+            break
+        covered_until = max(covered_until, endTime)
+    return covered_until
+
+
+def save_pagination_checkpoint(cursor, con, scope: str, query_key: str, startTime: datetime, endTime: datetime, next_token: str, rule_keys: str):
+    cursor.execute("""
+        INSERT OR REPLACE INTO pagination_checkpoints (Scope, QueryKey, startTime, endTime, NextToken, updatedAt, RuleKeys)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    """, (scope, query_key, startTime, endTime, next_token, datetime.now(), rule_keys))
+    con.commit()
+
+
+
+
+def get_pagination_checkpoint(cursor, scope: str, query_key: str, startTime: datetime):
+    """Return the (endTime, NextToken, RuleKeys) an interrupted fetch stopped at, or None."""
+    cursor.execute("""
+        SELECT endTime, NextToken, RuleKeys FROM pagination_checkpoints
+        WHERE Scope = ? AND QueryKey = ? AND startTime = ?
+    """, (scope, query_key, startTime))
+    return cursor.fetchone()
+
+
+
+
+def clear_pagination_checkpoint(cursor, con, scope: str, query_key: str, startTime: datetime):
+    cursor.execute("""
+        DELETE FROM pagination_checkpoints WHERE Scope = ? AND QueryKey = ? AND startTime = ?
+    """, (scope, query_key, startTime))
+    con.commit()
+
+
+
+
+def set_up_export_tables(cursor, con):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS export_watermarks(
+            Target TEXT PRIMARY KEY,
+            LastRowID INTEGER,
+            ExportedBytes INTEGER,
+            updatedAt TIMESTAMP
+        );
+    """)
+    con.commit()
+
+
+def get_export_watermark(cursor, target: str):
+    """Return the (LastRowID, ExportedBytes) already written to an export target, or (0, 0)."""
+    cursor.execute("SELECT LastRowID, ExportedBytes FROM export_watermarks WHERE Target = ?", (target,))
+    return cursor.fetchone() or (0, 0)
+
+
+def save_export_watermark(cursor, con, target: str, last_rowid: int, exported_bytes: int):
+    cursor.execute("""
+        INSERT OR REPLACE INTO export_watermarks (Target, LastRowID, ExportedBytes, updatedAt)
+        VALUES (?, ?, ?, ?)
+    """, (target, last_rowid, exported_bytes, datetime.now()))
+    con.commit()
+
+
+
+
+def set_up_archive_tables(cursor, con):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS archive_manifest(
+            Path TEXT PRIMARY KEY,
+            Size INTEGER,
+            MTime REAL,
+            EventCount INTEGER,
+            IngestedAt TIMESTAMP
+        );
+    """)
+    con.commit()
+
+
+def get_archive_manifest(cursor, con) -> dict:
+    """Return {Path: (Size, MTime)} for every CloudTrail log file already ingested."""
+    cursor.execute("SELECT Path, Size, MTime FROM archive_manifest")
+    return {path: (size, mtime) for path, size, mtime in cursor.fetchall()}
+
+
+def save_archive_manifest(cursor, con, entries: list[tuple]):
+    """Record (Path, Size, MTime, EventCount) for files whose matched events have all been written."""
+    ingestedAt = datetime.now()
+    cursor.executemany("""
+        INSERT OR REPLACE INTO archive_manifest (Path, Size, MTime, EventCount, IngestedAt)
+        VALUES (?, ?, ?, ?, ?)
+    """, [entry + (ingestedAt,) for entry in entries])
+    con.commit()
+
+
+def get_search_index_name(event_table_name: str) -> str:
+    return f"{event_table_name}_search"
+
+
+def has_search_index(cursor, event_table_name: str) -> bool:
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (get_search_index_name(event_table_name),))
+    return cursor.fetchone() is not None
+
+
+def set_up_search_index(cursor, con, event_table_name: str) -> bool:
+    """
+    Create the FTS5 full-text index over an events table's EventData, filled from the events already
+    stored. It is an external-content index: the text lives only in the events table, read through a
+    view that decodes compressed payloads. Returns False if the index already existed.
+    """
+    if has_search_index(cursor, event_table_name):
+        return False
+
+    index_name = get_search_index_name(event_table_name)
+    cursor.execute(f"""
+        CREATE VIEW IF NOT EXISTS {index_name}_source AS
+        SELECT rowid AS EventRowID, event_data(EventData) AS EventData FROM {event_table_name}
+    """)
+    cursor.execute(f"CREATE VIRTUAL TABLE {index_name} USING fts5(EventData, content='{index_name}_source', content_rowid='EventRowID')")
+    cursor.execute(f"INSERT INTO {index_name}({index_name}) VALUES ('rebuild')")
+    con.commit()
+    return True
+
+
+def rebuild_search_index(cursor, con, event_table_name: str) -> int:
+    """Create the search index if needed, re-index every stored event and merge the index into one segment. Returns the events indexed."""
+    index_name = get_search_index_name(event_table_name)
+    if not set_up_search_index(cursor, con, event_table_name):
+        cursor.execute(f"INSERT INTO {index_name}({index_name}) VALUES ('rebuild')")
+    cursor.execute(f"INSERT INTO {index_name}({index_name}) VALUES ('optimize')")
+    con.commit()
+    return cursor.execute(f"SELECT COUNT(*) FROM {event_table_name}").fetchone()[0]
+
+
+def index_new_events(cursor, event_table_name: str, after_rowid: int):
+    """Add the events stored after `after_rowid` to the search index (decoded, so compressed payloads are searchable)."""
+    index_name = get_search_index_name(event_table_name)
+    cursor.execute(f"""
+        INSERT INTO {index_name}(rowid, EventData)
+        SELECT rowid, event_data(EventData) FROM {event_table_name} WHERE rowid > ?
+    """, (after_rowid,))
+
+
+def set_up_metrics_tables(cursor, con):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS run_metrics(
+            RunID TEXT,
+            StartedAt TIMESTAMP,
+            FinishedAt TIMESTAMP,
+            Kind TEXT,
+            Name TEXT,
+            Labels TEXT,
+            Value REAL,
+            Count INTEGER
+        );
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_run_metrics_started ON run_metrics (StartedAt)")
+    con.commit()
+
+
+def save_run_metrics(cursor, con, run_id: str, startedAt: datetime, finishedAt: datetime, rows: list[tuple]):
+    """Store a run's (Kind, Name, Labels, Value, Count) metric rows next to its execution_history."""
+    set_up_metrics_tables(cursor, con)
+    cursor.executemany("""
+        INSERT INTO run_metrics (RunID, StartedAt, FinishedAt, Kind, Name, Labels, Value, Count)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    """, [(run_id, startedAt, finishedAt) + row for row in rows])
+    con.commit()
 
 
 
@@ -190,42 +655,152 @@ def add_lookup_attribute(cursor, con, attribute_key: str, attribute_value: str)
 
 
 
+def get_event_id_column(event_table_name: str) -> str:
+    table_id_column_map = {
+        'cloudtrail_events': 'EventID',
+        'azure_events': 'eventDataId'
+    }
+
+    try:
+        return table_id_column_map[event_table_name]
+    except KeyError:
+        raise ValueError(f"Unknown event table name: {event_table_name}. Expected 'cloudtrail_events' or 'azure_events'.")
+
+
+
+
 def add_event_lookup_mapping(cursor, con, event_id: str, attribute_id: int, event_table_name: str):
-    if event_table_name == 'cloudtrail_events':
-        id_column = 'EventID'
-    elif event_table_name == 'azure_events':
-        id_column = 'eventDataId'
-    else:
-        raise ValueError("Unknown event table name")
-    
-    cursor.execute(f"""
+    add_event_lookup_mappings(cursor, con, [event_id], attribute_id, event_table_name)
+
+
+
+
+def add_event_lookup_mappings(cursor, con, event_ids: list[str], attribute_id: int, event_table_name: str, commit: bool = True) -> int:
+    id_column = get_event_id_column(event_table_name)
+    if not event_ids:
+        return 0
+
+    cursor.executemany(f"""
         INSERT OR IGNORE INTO event_lookup_attributes ({id_column}, AttributeID)
         VALUES (?, ?)
-    """, (event_id, attribute_id))
-    con.commit()
+    """, [(event_id, attribute_id) for event_id in event_ids])
+
+    insertedCount = cursor.rowcount
+    if commit:
+        con.commit()
+    return insertedCount
 
 
 
 
 def add_rule_match(cursor, con, rule_name: str, event_id: str, execution_id: int, event_table_name: str):
-    table_id_column_map = {
-        'cloudtrail_events': 'EventID',
-        'azure_events': 'eventDataId'
-    }
+    add_rule_matches(cursor, con, rule_name, [event_id], execution_id, event_table_name)
 
-    try:
-        id_column = table_id_column_map[event_table_name]
-    except KeyError:
-        raise ValueError(f"Unknown event table name: {event_table_name}. Expected 'cloudtrail_events' or 'azure_events'.")
 
-    cursor.execute(f"""
+
+
+def add_rule_matches(cursor, con, rule_name: str, event_ids: list[str], execution_id: int, event_table_name: str, commit: bool = True) -> int:
+    id_column = get_event_id_column(event_table_name)
+    if not event_ids:
+        return 0
+
+    cursor.executemany(f"""
         INSERT OR IGNORE INTO rule_matches (RuleName, {id_column}, ExecutionID)
         VALUES (?, ?, ?)
-    """, (rule_name, event_id, execution_id))
-    
-    con.commit()
+    """, [(rule_name, event_id, execution_id) for event_id in event_ids])
+
+    insertedCount = cursor.rowcount
+    if commit:
+        con.commit()
+    return insertedCount
+
+
+
+
+def write_rule_chunk(cursor, con, rule_name: str, attribute_key: str, attribute_value: str, execution_id: int, events: list, event_ids: list[str],
+                     event_table_name: str, account_info: dict, seen_events: SeenEventIndex = None) -> int:
+    """
+    Store one chunk of a rule's matches (events, lookup mappings, rule matches) in a single transaction.
+    With a `seen_events` index, events already in the table are not serialized or inserted again; their
+    lookup mappings and rule matches are still recorded.
+    """
+    try:
+        id_column = get_event_id_column(event_table_name)
+        if seen_events is not None:
+            candidates = seen_events.maybe_stored(event_ids)
+            stored = get_stored_event_ids(cursor, event_table_name, id_column, candidates)
+            seen_events.record(len(event_ids), len(candidates), len(stored))
+            if stored:
+                events = [event for event, event_id in zip(events, event_ids) if event_id not in stored]
+
+        eventCount = write_events(cursor, con, events, execution_id, event_table_name, id_column, account_info, commit=False)
+        attribute_id = add_lookup_attribute(cursor, con, attribute_key, attribute_value)
+        add_event_lookup_mappings(cursor, con, event_ids, attribute_id, event_table_name, commit=False)
+        add_rule_matches(cursor, con, rule_name, event_ids, execution_id, event_table_name, commit=False)
+        con.commit()
+    except Exception:
+        con.rollback()
+        raise
+
+    if seen_events is not None:
+        seen_events.update(event_ids)
+    return eventCount
+
+
+def get_stored_event_ids(cursor, event_table_name: str, id_column: str, event_ids: list[str]) -> set:
+    stored = set()
+    for i in range(0, len(event_ids), STORED_ID_BATCH_SIZE):
+        batch = event_ids[i:i + STORED_ID_BATCH_SIZE]
+        cursor.execute(f"SELECT {id_column} FROM {event_table_name} WHERE {id_column} IN ({', '.join('?' * len(batch))})", batch)
+        stored.update(row[0] for row in cursor.fetchall())
+    return stored
+
+
+def get_event_ids_since(cursor, event_table_name: str, since: datetime) -> list[str]:
+    id_column = get_event_id_column(event_table_name)
+    time_column = 'EventTimestamp' if event_table_name == 'azure_events' else 'EventTime'
+    cursor.execute(f"SELECT {id_column} FROM {event_table_name} WHERE {time_column} >= ?", (since,))
+    return [row[0] for row in cursor.fetchall()]
+
+
+def get_seen_events_capacity(stored: int) -> int:
+    # Room for as many new events as are already stored keeps the false positive rate near its target.
+    return max(DEFAULT_SEEN_EVENTS_CAPACITY, 2 * stored)
+
+
+def load_seen_events(cursor, con, event_table_name: str, since: datetime) -> SeenEventIndex:
+    """Build the seen-ID index of an events table from the events stored since `since`."""
+    event_ids = get_event_ids_since(cursor, event_table_name, since)
+    seen_events = SeenEventIndex(get_seen_events_capacity(len(event_ids)))
+    seen_events.update(event_ids)
+    seen_events.preloaded = len(event_ids)
+    return seen_events
 
 
+def reload_seen_events(cursor, con, event_table_name: str, since: datetime, seen_events: SeenEventIndex) -> bool:
+    """
+    Rebuild a seen-ID index that outgrew its capacity in place, resized for the events stored since
+    `since`, so long watches keep its false positive rate near target. Returns False if it still had room.
+    """
+    if not seen_events.is_full():
+        return False
+
+    event_ids = get_event_ids_since(cursor, event_table_name, since)
+    seen_events.reset(get_seen_events_capacity(len(event_ids)))
+    seen_events.update(event_ids)
+    seen_events.rebuilds += 1
+    return True
+
+
+
+
+def is_localizable_string(value):
+    """
+    True for an Azure LocalizableString. The Azure SDK is not imported for this check: until a provider
+    has loaded its models no value can be one, so exports and AWS-only runs never pay for the import.
+    """
+    models = sys.modules.get('azure.mgmt.monitor.v2015_04_01.models')
+    return models is not None and isinstance(value, models.LocalizableString)
 
 
 def datetime_handler(x):
@@ -233,7 +808,7 @@ def datetime_handler(x):
         return x.isoformat()
     elif isinstance(x, timedelta):
         return str(x)
-    elif isinstance(x, LocalizableString):
+    elif is_localizable_string(x):
         return x.value  
     elif isinstance(x, dict):
         return {k: datetime_handler(v) for k, v in x.items()}  
@@ -249,91 +824,228 @@ def datetime_handler(x):
     
     
 
-def write_events(cursor, con, events: list[dict], execution_id: int, event_table_name: str, id_column: str, account_info: dict = None) -> int:
-    eventCount = 0
+def encode_event_data(payload: str, encoder: PayloadEncoder = None):
+    return encoder.encode(payload) if encoder else payload
+
+
+def build_event_row(event, execution_id: int, event_table_name: str, account_info: dict, encoder: PayloadEncoder = None) -> tuple:
+    if event_table_name == 'azure_events' and hasattr(event, '__dict__'):
+        event = event.__dict__
+
+    if not isinstance(event, dict) and not hasattr(event, 'to_json'):
+        print(f"\033[91m[!] Warning: Expected dict, but got {type(event).__name__}. Skipping this event.")
+        return None
+
+    if event_table_name == 'azure_events':
+        id_value = event.get('event_data_id')
+
+        if not id_value:
+            id_value = event.get('id', str(uuid.uuid4()))  
+
+        name_value = event.get('operation_name') or event.get('operationName')
+        if is_localizable_string(name_value):
+            name_value = name_value.value
+        elif isinstance(name_value, dict):
+            name_value = name_value.get('value')
+
+        time_value = event.get('event_timestamp')
+
+        if name_value is None:
+            print(f"Warning: operation_name is missing in event {id_value}")
+
+        if time_value is None:
+            print(f"Warning: event_timestamp is missing in event {id_value}")
+
+        return (
+            id_value, 
+            account_info.get('subscription_id'),
+            name_value,
+            time_value,
+            encode_event_data(encode_azure_event(event), encoder),
+            execution_id
+        )
+
+    elif event_table_name == 'cloudtrail_events':
+        id_value = event.get('EventId')
+
+        if not id_value:
+            raise ValueError(f"Event ID not found for cloudtrail_events")
+
+        return (
+            id_value,
+            account_info.get('account_id'),
+            account_info.get('profile_name'),
+            event.get('EventName'),
+            event.get('EventTime'),
+            # Lazily parsed CloudTrail events serialize themselves from the raw JSON.
+            encode_event_data(event.to_json() if hasattr(event, 'to_json') else json.dumps(event, default=datetime_handler), encoder),
+            execution_id,
+            account_info.get('region')
+        )
+
+    else:
+        raise ValueError("Unknown event table name")
+
+
+def load_payload_dictionaries(cursor):
+    """Make the compression dictionaries stored in this database available for decoding EventData."""
+    try:
+        cursor.execute("SELECT DictionaryID, Codec, Data FROM payload_dictionaries")
+    except sqlite3.OperationalError:
+        return
+    for dictionary_id, codec, data in cursor.fetchall():
+        register_dictionary(dictionary_id, codec, data)
+
+
+def add_payload_dictionary(cursor, con, codec: str, data: bytes) -> int:
+    dictionary_id = get_dictionary_id(data)
+    cursor.execute("""
+        INSERT OR REPLACE INTO payload_dictionaries (DictionaryID, Codec, Data, createdAt) VALUES (?, ?, ?, ?)
+    """, (dictionary_id, codec, data, datetime.now()))
+    con.commit()
+    register_dictionary(dictionary_id, codec, data)
+    return dictionary_id
+
+
+def get_payload_encoder(cursor):
+    """Return the encoder for new EventData (the configured codec with its newest dictionary), or None for plain TEXT."""
+    codec = get_storage_settings()['payload_codec']
+    if codec == 'none':
+        return None
+
+    cursor.execute("SELECT DictionaryID, Data FROM payload_dictionaries WHERE Codec = ? ORDER BY createdAt DESC LIMIT 1", (codec,))
+    row = cursor.fetchone()
+    if row:
+        return PayloadEncoder(codec, row[0], row[1])
+    return PayloadEncoder(codec)
+
+
+def get_database_size(cursor) -> int:
+    page_count = cursor.execute("PRAGMA page_count").fetchone()[0]
+    page_size = cursor.execute("PRAGMA page_size").fetchone()[0]
+    return page_count * page_size
+
+
+def compact_event_data(cursor, con, event_table_name: str, codec: str, sample_size: int = COMPACTION_SAMPLE_SIZE, batch_size: int = COMPACTION_BATCH_SIZE):
+    """
+    Rewrite every stored EventData with `codec` ('none' turns payloads back into plain TEXT). A fresh
+    compression dictionary is trained from a random sample of the table first, and the database is
+    vacuumed afterwards so the freed pages are returned to the file system.
+    """
+    sizeBefore = get_database_size(cursor)
+
+    encoder = None
+    if codec != 'none':
+        cursor.execute(f"SELECT EventData FROM {event_table_name} ORDER BY random() LIMIT ?", (sample_size,))
+        samples = [decode_event_data(row[0]) for row in cursor.fetchall() if row[0]]
+        encoder = PayloadEncoder(codec)
+        try:
+            dictionary = train_dictionary(codec, samples) if samples else None
+        except Exception as e:
+            print(f"\033[93m[!] Could not train a {codec} dictionary ({e}). Compressing without one.\033[0m")
+            dictionary = None
+        if dictionary:
+            encoder = PayloadEncoder(codec, add_payload_dictionary(cursor, con, codec, dictionary), dictionary)
+
+    rewritten = 0
+    last_rowid = 0
+    while True:
+        cursor.execute(f"SELECT rowid, EventData FROM {event_table_name} WHERE rowid > ? ORDER BY rowid LIMIT ?", (last_rowid, batch_size))
+        rows = cursor.fetchall()
+        if not rows:
+            break
+
+        updates = []
+        for rowid, event_data in rows:
+            if event_data is None:
+                continue
+            text = decode_event_data(event_data)
+            updates.append((encoder.encode(text) if encoder else text, rowid))
+        cursor.executemany(f"UPDATE {event_table_name} SET EventData = ? WHERE rowid = ?", updates)
+        con.commit()
+
+        rewritten += len(updates)
+        last_rowid = rows[-1][0]
+
+    # VACUUM may renumber the rowids of tables without an INTEGER PRIMARY KEY, and both the search index
+    # and the export watermarks refer to them, so they are only trusted if every event kept its rowid.
+    fingerprint = get_rowid_fingerprint(cursor, event_table_name)
+    cursor.execute("VACUUM")
+    if get_rowid_fingerprint(cursor, event_table_name) != fingerprint:
+        if has_search_index(cursor, event_table_name):
+            rebuild_search_index(cursor, con, event_table_name)
+        if reset_export_watermarks(cursor, con):
+            print(f"\033[93m[!] VACUUM renumbered the rows of {event_table_name}; export watermarks were reset. The next NDJSON export rewrites its files from the start; remove existing Parquet datasets before exporting again.\033[0m")
+    return rewritten, sizeBefore, get_database_size(cursor)
+
+
+def get_rowid_fingerprint(cursor, event_table_name: str) -> bytes:
+    """Digest of every (rowid, event ID) pair of an events table, streamed in rowid order."""
+    id_column = get_event_id_column(event_table_name)
+    digest = hashlib.blake2b(digest_size=16)
+    cursor.execute(f"SELECT rowid, {id_column} FROM {event_table_name} ORDER BY rowid")
+    while True:
+        rows = cursor.fetchmany(COMPACTION_BATCH_SIZE)
+        if not rows:
+            break
+        digest.update(repr(rows).encode())
+    return digest.digest()
+
+
+def reset_export_watermarks(cursor, con) -> bool:
+    """Forget every export watermark, so the next exports start from the first row. Returns False if there were none."""
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'export_watermarks'")
+    if cursor.fetchone() is None:
+        return False
+    cursor.execute("DELETE FROM export_watermarks")
+    deleted = cursor.rowcount
+    con.commit()
+    return deleted > 0
+
+
+def write_events(cursor, con, events: list[dict], execution_id: int, event_table_name: str, id_column: str, account_info: dict = None, commit: bool = True) -> int:
+    """Insert events with a single executemany and return how many were new to the table."""
+    rows = []
     failed_events = []  
+    encoder = get_payload_encoder(cursor)
 
     for event in events:
         try:
-            if event_table_name == 'azure_events' and hasattr(event, '__dict__'):
-                event = event.__dict__
-
-            if not isinstance(event, dict):
-                print(f"\033[91m[!] Warning: Expected dict, but got {type(event).__name__}. Skipping this event.")
-                continue  
-
-            if event_table_name == 'azure_events':
-                id_value = event.get('event_data_id')
-
-                if not id_value:
-                    id_value = event.get('id', str(uuid.uuid4()))  
-
-                name_value = event.get('operation_name') or event.get('operationName')
-                if isinstance(name_value, LocalizableString):
-                    name_value = name_value.value
-                elif isinstance(name_value, dict):
-                    name_value = name_value.get('value')
-
-                time_value = event.get('event_timestamp')
-
-                if name_value is None:
-                    print(f"Warning: operation_name is missing in event {id_value}")
-
-                if time_value is None:
-                    print(f"Warning: event_timestamp is missing in event {id_value}")
-
-                name_column = 'operationName'
-                time_column = 'eventTimestamp'
-                subscription_id = account_info.get('subscription_id')
-
-                cursor.execute(f"""
-                    INSERT OR IGNORE INTO {event_table_name} (
-                        {id_column}, SubscriptionID, {name_column}, {time_column}, EventData, ExecutionID)
-                    VALUES (?, ?, ?, ?, ?, ?)
-                """, (
-                    id_value, 
-                    subscription_id,
-                    name_value,
-                    time_value,
-                    json.dumps(event, default=datetime_handler),
-                    execution_id
-                ))
-
-            elif event_table_name == 'cloudtrail_events':
-                id_value = event.get('EventId')
-                name_value = event.get('EventName')
-                time_value = event.get('EventTime')
-                account_id = account_info.get('account_id')
-                profile_name = account_info.get('profile_name')
-
-                if not id_value:
-                    raise ValueError(f"Event ID not found for cloudtrail_events")
-
-                cursor.execute(f"""
-                    INSERT OR IGNORE INTO {event_table_name} (
-                        {id_column}, AccountID, ProfileName, EventName, EventTime, EventData, ExecutionID)
-                    VALUES (?, ?, ?, ?, ?, ?, ?)
-                """, (
-                    id_value,
-                    account_id,
-                    profile_name,
-                    name_value,
-                    time_value,
-                    json.dumps(event, default=datetime_handler),
-                    execution_id
-                ))
-
-            else:
-                raise ValueError("Unknown event table name")
-
-            if cursor.rowcount > 0:
-                eventCount += 1
-
+            row = build_event_row(event, execution_id, event_table_name, account_info, encoder)
+            if row is not None:
+                rows.append(row)
         except Exception as e:
-            print(f"\033[91m[!] Error writing event {event.get(id_column, 'unknown_id')}: {e}")
+            event_id = event.get(id_column, 'unknown_id') if isinstance(event, dict) else getattr(event, 'event_data_id', 'unknown_id')
+            print(f"\033[91m[!] Error writing event {event_id}: {e}")
             failed_events.append(event)  
 
-    con.commit()
+    if event_table_name == 'azure_events':
+        query = f"""
+            INSERT OR IGNORE INTO {event_table_name} (
+                {id_column}, SubscriptionID, operationName, eventTimestamp, EventData, ExecutionID)
+            VALUES (?, ?, ?, ?, ?, ?)
+        """
+    else:
+        query = f"""
+            INSERT OR IGNORE INTO {event_table_name} (
+                {id_column}, AccountID, ProfileName, EventName, EventTime, EventData, ExecutionID, Region)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        """
+
+    eventCount = 0
+    if rows:
+        # Events are only ever inserted, and each new one gets a rowid past the current maximum, so the
+        # rows to index are exactly those above it.
+        search_index = has_search_index(cursor, event_table_name)
+        if search_index:
+            last_rowid = cursor.execute(f"SELECT MAX(rowid) FROM {event_table_name}").fetchone()[0] or 0
+        cursor.executemany(query, rows)
+        eventCount = cursor.rowcount
+        if search_index and eventCount > 0:
+            index_new_events(cursor, event_table_name, last_rowid)
+
+    if commit:
+        con.commit()
 
     if failed_events:
         print(f"\033[91m[!] {len(failed_events)} events failed to write. See logs for more details.")
@@ -1,10 +1,99 @@
-from cloudtail_modules.database_utils import set_up_aws_tables, set_up_azure_tables
-from cloudtail_modules.aws_processor import process_aws_events
-from cloudtail_modules.azure_processor import process_azure_events
+from datetime import datetime
+from functools import partial
+from cloudtail_modules.database_utils import SerializedWriter, set_up_aws_tables, set_up_azure_tables, get_storage_settings, finish_storage, load_seen_events, reload_seen_events, save_run_metrics
+from cloudtail_modules.query_planner import BACKFILL_SPAN
+from cloudtail_modules.scheduler import run_jobs, watch_jobs, get_max_workers, print_job_summary
+from cloudtail_modules.run_metrics import create_metrics, export_metrics
 
-def process_all_events(config, aws_cursor, aws_con, azure_cursor, azure_con):
+def open_writers(config, aws_cursor, aws_con, azure_cursor, azure_con):
     set_up_aws_tables(aws_cursor, aws_con, 'cloudtrail_events')
     set_up_azure_tables(azure_cursor, azure_con, 'azure_events')
 
-    process_aws_events(config, aws_cursor, aws_con)
-    process_azure_events(config, azure_cursor, azure_con)
+    checkpoint_interval = get_storage_settings(config.get('storage'))['wal_checkpoint_interval']
+    aws_db = SerializedWriter(aws_con, aws_cursor, checkpoint_interval)
+    azure_db = SerializedWriter(azure_con, azure_cursor, checkpoint_interval)
+
+    # No run fetches further back than the backfill span; anything the index misses is still dropped by
+    # INSERT OR IGNORE.
+    since = datetime.now() - BACKFILL_SPAN
+    aws_db.seen_events = aws_db.run(load_seen_events, 'cloudtrail_events', since)
+    azure_db.seen_events = azure_db.run(load_seen_events, 'azure_events', since)
+
+    aws_db.metrics = create_metrics(config)
+    azure_db.metrics = create_metrics(config)
+    return aws_db, azure_db
+
+
+def refresh_seen_events(aws_db, azure_db):
+    """Rebuild a seen-event index once a watch has added more IDs than it was sized for."""
+    since = datetime.now() - BACKFILL_SPAN
+    aws_db.run(reload_seen_events, 'cloudtrail_events', since, aws_db.seen_events)
+    azure_db.run(reload_seen_events, 'azure_events', since, azure_db.seen_events)
+
+
+def get_jobs(config, aws_db, azure_db):
+    """Provider modules, and the cloud SDKs they import, are only loaded when a data source uses them."""
+    sources = {source['source'] for source in config['dataSources']}
+    jobs = []
+    if 'AWS CloudTrail' in sources:
+        from cloudtail_modules.aws_processor import get_aws_jobs
+        jobs += get_aws_jobs(config, aws_db)
+    if 'AWS CloudTrail Archive' in sources:
+        from cloudtail_modules.archive_processor import get_archive_jobs
+        jobs += get_archive_jobs(config, aws_db)
+    if 'Azure Activity Log' in sources:
+        from cloudtail_modules.azure_processor import get_azure_jobs
+        jobs += get_azure_jobs(config, azure_db)
+    return jobs
+
+
+def get_metric_runs(aws_db, azure_db):
+    return [('aws', aws_db.metrics), ('azure', azure_db.metrics)]
+
+
+def close_writers(config, aws_db, azure_db):
+    for label, db in (('AWS', aws_db), ('Azure', azure_db)):
+        if db.seen_events.checked:
+            print(f"\033[96m[*] Seen-event cache ({label}): {db.seen_events.summary()}\033[0m")
+
+    # Each database keeps the metrics of the jobs that wrote to it, next to their execution_history rows.
+    for label, db in (('AWS', aws_db), ('Azure', azure_db)):
+        if db.metrics.enabled and not db.metrics.is_empty():
+            print(f"\033[96m[*] Stage times ({label}): {db.metrics.summary()}\033[0m")
+            db.run(save_run_metrics, db.metrics.run_id, db.metrics.startedAt, datetime.now(), db.metrics.rows())
+    export_metrics(config, get_metric_runs(aws_db, azure_db))
+
+    aws_db.run(finish_storage)
+    azure_db.run(finish_storage)
+
+
+def process_all_events(config, aws_cursor, aws_con, azure_cursor, azure_con):
+    aws_db, azure_db = open_writers(config, aws_cursor, aws_con, azure_cursor, azure_con)
+
+    jobs = get_jobs(config, aws_db, azure_db)
+    run_jobs(jobs, get_max_workers(config))
+
+    close_writers(config, aws_db, azure_db)
+
+
+def watch_all_events(config, aws_cursor, aws_con, azure_cursor, azure_con):
+    """
+    Poll every source until SIGTERM/SIGINT. Jobs, clients, credentials and database connections are set up
+    once and reused by every poll; each poll resumes from the execution history of its rules.
+    """
+    aws_db, azure_db = open_writers(config, aws_cursor, aws_con, azure_cursor, azure_con)
+
+    jobs = get_jobs(config, aws_db, azure_db)
+    print(f"\033[96m[*] Watching {len(jobs)} {'source' if len(jobs) == 1 else 'sources'}. Send SIGTERM or press Ctrl+C to stop.\033[0m")
+    watchStartTime = datetime.now()
+    # The textfile and report are rewritten after every poll, with counters accumulated since the watch started.
+    export_watch_metrics = partial(export_metrics, config, get_metric_runs(aws_db, azure_db))
+
+    def on_poll():
+        refresh_seen_events(aws_db, azure_db)
+        export_watch_metrics()
+
+    results = watch_jobs(jobs, get_max_workers(config), on_poll)
+    print_job_summary(results, (datetime.now() - watchStartTime).total_seconds())
+
+    close_writers(config, aws_db, azure_db)
@@ -0,0 +1,63 @@
+from cloudtail_modules.database_utils import get_event_id_column, get_search_index_name
+from cloudtail_modules.export_results import decode_event_rows
+
+SEARCH_PAGE_SIZE = 50
+SEARCH_FETCH_SIZE = 200
+
+# (account column, event time column) of each events table, for the search filters.
+SEARCH_FILTER_COLUMNS = {
+    'cloudtrail_events': ('AccountID', 'EventTime'),
+    'azure_events': ('SubscriptionID', 'EventTimestamp'),
+}
+
+
+def build_match_expression(text):
+    """
+    Turn search text into an FTS5 query: every whitespace-separated term is quoted as a phrase, so
+    ARNs, IPs and key IDs need no escaping, and all terms must match. A trailing * searches by prefix.
+    """
+    phrases = []
+    for term in text.split():
+        prefix = term.endswith('*') and len(term) > 1
+        term = term.rstrip('*') if prefix else term
+        phrases.append('"' + term.replace('"', '""') + '"' + ('*' if prefix else ''))
+    return ' AND '.join(phrases)
+
+
+def search_events(cursor, event_table_name, text, startTime=None, endTime=None, account=None, rule=None, before_rowid=None,
+                  limit=SEARCH_PAGE_SIZE, batch_size=SEARCH_FETCH_SIZE):
+    """
+    Yield batches of events whose EventData matches `text`, newest stored first, each row led by its
+    rowid. Pass the last rowid of a page as `before_rowid` to get the next one. Rows are fetched
+    `batch_size` at a time, so a large page is never held in memory at once.
+    """
+    index_name = get_search_index_name(event_table_name)
+    id_column = get_event_id_column(event_table_name)
+    account_column, time_column = SEARCH_FILTER_COLUMNS[event_table_name]
+
+    query = f"""
+        SELECT e.rowid, e.* FROM {index_name}
+        JOIN {event_table_name} e ON e.rowid = {index_name}.rowid
+        WHERE {index_name} MATCH ?
+    """
+    params = [build_match_expression(text)]
+
+    if before_rowid:
+        query += f" AND {index_name}.rowid < ?"
+        params.append(before_rowid)
+    if startTime and endTime:
+        query += f" AND e.{time_column} >= ? AND e.{time_column} < ?"
+        params += [startTime, endTime]
+    if account:
+        query += f" AND e.{account_column} = ?"
+        params.append(account)
+    if rule:
+        query += f" AND EXISTS (SELECT 1 FROM rule_matches r WHERE r.RuleName = ? AND r.{id_column} = e.{id_column})"
+        params.append(rule)
+
+    cursor.execute(query + f" ORDER BY {index_name}.rowid DESC LIMIT ?", params + [limit])
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            return
+        yield decode_event_rows(cursor, rows)
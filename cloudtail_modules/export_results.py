@@ -1,19 +1,37 @@
 import os
 import json
 from datetime import datetime
-from cloudtail_modules.database_utils import connect_to_db
+from cloudtail_modules.database_utils import connect_to_db, set_up_export_tables, get_export_watermark, save_export_watermark
+from cloudtail_modules.payload_codec import decode_event_data
+
+EXPORT_BATCH_SIZE = 1000
+EXPORT_BUFFER_SIZE = 1024 * 1024
+
+# Rows buffered across all date partitions before they are written out as Parquet row groups.
+PARQUET_ROW_GROUP_SIZE = 10000
+PARQUET_TIMESTAMP_COLUMNS = ('EventTime', 'EventTimestamp')
+PARQUET_INTEGER_COLUMNS = ('ExecutionID',)
+PARQUET_DEFAULT_PARTITION = '__HIVE_DEFAULT_PARTITION__'
+
+# The event tables carry no run timestamps; events are matched to the execution_history run that stored them.
+EXECUTION_TIME_RANGE_FILTER = "ExecutionID IN (SELECT ExecutionID FROM execution_history WHERE execStartTime >= ? AND execEndTime <= ?)"
 
 def fetch_events(cursor, event_table, execStartTime=None, execEndTime=None):
     query = f"SELECT * FROM {event_table}"
     params = []
     
     if execStartTime and execEndTime:
-        query += " WHERE execStartTime >= ? AND execEndTime <= ?"
+        query += f" WHERE {EXECUTION_TIME_RANGE_FILTER}"
         params.append(execStartTime)
         params.append(execEndTime)
 
     cursor.execute(query, params)
-    return cursor.fetchall()
+    return decode_event_rows(cursor, cursor.fetchall())
+
+def decode_event_rows(cursor, rows):
+    """Turn compressed EventData payloads back into JSON text so every export sees the same rows."""
+    index = [column[0] for column in cursor.description].index('EventData')
+    return [row[:index] + (decode_event_data(row[index]),) + row[index + 1:] for row in rows]
 
 def append_or_write_json(file_path, events):
     if os.path.exists(file_path):
@@ -47,11 +65,171 @@ def export_events_to_json(db_path, event_table, source_name, output_dir, execSta
 
     append_or_write_json(file_path, events)
 
-def export_all_events(db_paths, output_dir):
-    export_events_to_json(db_paths['aws'], 'cloudtrail_events', 'AWS_CloudTrail', output_dir)
-    export_events_to_json(db_paths['azure'], 'azure_events', 'Azure_Activity_Log', output_dir)
+def iter_event_batches(cursor, event_table, after_rowid=0, execStartTime=None, execEndTime=None, batch_size=EXPORT_BATCH_SIZE):
+    """Yield the rows stored after `after_rowid` in insertion order, `batch_size` at a time, each led by its rowid."""
+    query = f"SELECT rowid, * FROM {event_table} WHERE rowid > ?"
+    params = [after_rowid]
+
+    if execStartTime and execEndTime:
+        query += f" AND {EXECUTION_TIME_RANGE_FILTER}"
+        params.append(execStartTime)
+        params.append(execEndTime)
+
+    cursor.execute(query + " ORDER BY rowid", params)
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            return
+        yield decode_event_rows(cursor, rows)
+
+def encode_ndjson_line(columns, row):
+    record = dict(zip(columns, row))
+    event_data = record.pop('EventData', None)
+    line = json.dumps(record, default=str)
+    if event_data:
+        # EventData is stored as serialized JSON already, so it is spliced in instead of parsed and re-encoded.
+        line = f'{line[:-1]}, "EventData": {event_data}}}'
+    return line + "\n"
+
+def export_events_to_ndjson(db_path, event_table, source_name, output_dir, execStartTime=None, execEndTime=None):
+    """
+    Append the events not exported yet to one NDJSON file per source (and time range). The last rowid
+    written is kept per target file in export_watermarks, so the file is never read back, and bytes left
+    behind by an interrupted export are truncated before appending.
+    """
+    con, cursor = connect_to_db(db_path)
+    set_up_export_tables(cursor, con)
+
+    file_name = f"{source_name}.ndjson"
+    if execStartTime and execEndTime:
+        file_name = f"{source_name}_{execStartTime.strftime('%Y-%m-%d')}_{execEndTime.strftime('%Y-%m-%d')}.ndjson"
+    file_path = os.path.join(output_dir, file_name)
+    target = os.path.abspath(file_path)
+
+    last_rowid, exported_bytes = get_export_watermark(cursor, target)
+    file_size = os.path.getsize(file_path) if os.path.exists(file_path) else 0
+    if file_size < exported_bytes:
+        print(f"\033[93m[*] {file_path} is smaller than after the last export (rotated?). Appending new events only.\033[0m")
+
+    new_events = 0
+    with open(file_path, 'a', encoding='utf-8', newline='', buffering=EXPORT_BUFFER_SIZE) as f:
+        f.truncate(min(file_size, exported_bytes))
+        read_cursor = con.cursor()
+        for rows in iter_event_batches(read_cursor, event_table, last_rowid, execStartTime, execEndTime):
+            columns = [column[0] for column in read_cursor.description[1:]]
+            f.writelines(encode_ndjson_line(columns, row[1:]) for row in rows)
+            last_rowid = rows[-1][0]
+            new_events += len(rows)
+
+    save_export_watermark(cursor, con, target, last_rowid, os.path.getsize(file_path))
+
+    if new_events:
+        print(f"\033[92m[+]\033[96m Successfully wrote \033[92m{new_events} \033[96m new events to \033[93m{file_path}")
+    else:
+        print(f"\033[92m[+]\033[96m No new events to write in \033[93m{file_path}")
+
+def import_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise ImportError("Parquet export requires pyarrow. Install it with 'pip install pyarrow'.")
+    return pyarrow, pyarrow.parquet
+
+def get_parquet_schema(pa, columns):
+    fields = []
+    for column in columns:
+        if column in PARQUET_TIMESTAMP_COLUMNS:
+            fields.append(pa.field(column, pa.timestamp('us')))
+        elif column in PARQUET_INTEGER_COLUMNS:
+            fields.append(pa.field(column, pa.int64()))
+        else:
+            fields.append(pa.field(column, pa.string()))
+    return pa.schema(fields)
+
+def export_events_to_parquet(db_path, event_table, source_name, output_dir, execStartTime=None, execEndTime=None):
+    """
+    Write the events not exported yet as a Hive-partitioned Parquet dataset (source=<name>/date=<event date>).
+    The table's indexed columns become typed columns and the raw EventData payload is kept as a string
+    column. Rows are read in batches and written as row groups of at most PARQUET_ROW_GROUP_SIZE rows.
+    Each export adds one part file per date, named after the starting watermark, so rerunning an
+    interrupted export overwrites its partial files instead of duplicating them.
+    """
+    pa, pq = import_pyarrow()
+    con, cursor = connect_to_db(db_path)
+    set_up_export_tables(cursor, con)
+
+    dataset_dir = output_dir
+    if execStartTime and execEndTime:
+        dataset_dir = os.path.join(output_dir, f"range={execStartTime.strftime('%Y-%m-%d')}_{execEndTime.strftime('%Y-%m-%d')}")
+    dataset_dir = os.path.join(dataset_dir, f"source={source_name}")
+    target = os.path.abspath(dataset_dir)
+
+    last_rowid, _ = get_export_watermark(cursor, target)
+    part_name = f"part-{last_rowid + 1:012d}.parquet"
+
+    writers = {}
+    partitions = {}
+    buffered = 0
+    new_events = 0
+    schema = None
+
+    def flush_partitions():
+        for date, rows in partitions.items():
+            if date not in writers:
+                partition_dir = os.path.join(dataset_dir, f"date={date}")
+                os.makedirs(partition_dir, exist_ok=True)
+                writers[date] = pq.ParquetWriter(os.path.join(partition_dir, part_name), schema, compression='zstd')
+            writers[date].write_table(pa.Table.from_pylist(rows, schema=schema))
+        partitions.clear()
+
+    try:
+        read_cursor = con.cursor()
+        for rows in iter_event_batches(read_cursor, event_table, last_rowid, execStartTime, execEndTime):
+            columns = [column[0] for column in read_cursor.description[1:]]
+            if schema is None:
+                schema = get_parquet_schema(pa, columns)
+                time_column = next(column for column in columns if column in PARQUET_TIMESTAMP_COLUMNS)
+
+            for row in rows:
+                record = dict(zip(columns, row[1:]))
+                event_time = record[time_column]
+                date = event_time.strftime('%Y-%m-%d') if isinstance(event_time, datetime) else PARQUET_DEFAULT_PARTITION
+                partitions.setdefault(date, []).append(record)
+
+            buffered += len(rows)
+            if buffered >= PARQUET_ROW_GROUP_SIZE:
+                flush_partitions()
+                buffered = 0
+
+            last_rowid = rows[-1][0]
+            new_events += len(rows)
+
+        flush_partitions()
+    finally:
+        for writer in writers.values():
+            writer.close()
+
+    save_export_watermark(cursor, con, target, last_rowid, 0)
+
+    if new_events:
+        print(f"\033[92m[+]\033[96m Successfully wrote \033[92m{new_events} \033[96m new events to \033[93m{len(writers)}\033[96m date partitions under \033[93m{dataset_dir}")
+    else:
+        print(f"\033[92m[+]\033[96m No new events to write in \033[93m{dataset_dir}")
+
+EXPORTERS = {
+    'json': export_events_to_json,
+    'ndjson': export_events_to_ndjson,
+    'parquet': export_events_to_parquet,
+}
+
+def export_all_events(db_paths, output_dir, export_format='json'):
+    export_events = EXPORTERS[export_format]
+    export_events(db_paths['aws'], 'cloudtrail_events', 'AWS_CloudTrail', output_dir)
+    export_events(db_paths['azure'], 'azure_events', 'Azure_Activity_Log', output_dir)
 
-def export_events_by_time_range(db_paths, output_dir, execStartTime, execEndTime):
-    export_events_to_json(db_paths['aws'], 'cloudtrail_events', 'AWS_CloudTrail', output_dir, execStartTime, execEndTime)
-    export_events_to_json(db_paths['azure'], 'azure_events', 'Azure_Activity_Log', output_dir, execStartTime, execEndTime)
+def export_events_by_time_range(db_paths, output_dir, execStartTime, execEndTime, export_format='json'):
+    export_events = EXPORTERS[export_format]
+    export_events(db_paths['aws'], 'cloudtrail_events', 'AWS_CloudTrail', output_dir, execStartTime, execEndTime)
+    export_events(db_paths['azure'], 'azure_events', 'Azure_Activity_Log', output_dir, execStartTime, execEndTime)
 
@@ -0,0 +1,113 @@
+import struct
+import zlib
+
+# EventData is plain JSON TEXT unless a payload codec is configured. Encoded payloads are stored as a BLOB:
+# one codec marker byte, the 4-byte ID of the compression dictionary (0 for none), then the compressed JSON.
+PAYLOAD_CODECS = ('none', 'zlib', 'zstd')
+CODEC_MARKERS = {'zlib': 1, 'zstd': 2}
+CODEC_NAMES = {marker: codec for codec, marker in CODEC_MARKERS.items()}
+PAYLOAD_HEADER = struct.Struct('>BI')
+
+ZLIB_LEVEL = 6
+ZLIB_DICTIONARY_SIZE = 32 * 1024
+ZSTD_LEVEL = 3
+ZSTD_DICTIONARY_SIZE = 112 * 1024
+
+# Dictionaries are identified by a checksum of their content, so IDs from different databases never clash here.
+_dictionaries = {}
+_decoders = {}
+
+
+def import_zstandard():
+    try:
+        import zstandard
+    except ImportError:
+        raise ImportError("The zstd payload codec requires zstandard. Install it with 'pip install zstandard'.")
+    return zstandard
+
+
+def register_dictionary(dictionary_id, codec, data):
+    _dictionaries[dictionary_id] = (codec, data)
+
+
+def get_dictionary_id(data):
+    return zlib.crc32(data) or 1
+
+
+def train_dictionary(codec, samples):
+    """
+    Build a compression dictionary from sample payloads. zstd trains one from the samples; for zlib,
+    whose preset dictionary is simply text the compressor may refer back to, the most recent samples
+    are concatenated up to the 32 KiB window.
+    """
+    encoded = [sample.encode('utf-8') for sample in samples]
+    if codec == 'zstd':
+        return import_zstandard().train_dictionary(ZSTD_DICTIONARY_SIZE, encoded).as_bytes()
+
+    dictionary = b''
+    for sample in reversed(encoded):
+        if len(dictionary) + len(sample) > ZLIB_DICTIONARY_SIZE:
+            break
+        dictionary = sample + dictionary
+    return dictionary
+
+
+class PayloadEncoder:
+    """Compresses EventData JSON with one codec and (optionally) one dictionary."""
+
+    def __init__(self, codec, dictionary_id=0, dictionary=None):
+        self.codec = codec
+        self.header = PAYLOAD_HEADER.pack(CODEC_MARKERS[codec], dictionary_id)
+        if codec == 'zstd':
+            zstandard = import_zstandard()
+            dict_data = zstandard.ZstdCompressionDict(dictionary) if dictionary else None
+            self._zstd = zstandard.ZstdCompressor(level=ZSTD_LEVEL, dict_data=dict_data)
+        else:
+            # Priming the dictionary is the expensive part, so every payload starts from a copy of this object.
+            self._zlib = zlib.compressobj(ZLIB_LEVEL, zlib.DEFLATED, -15, zdict=dictionary) if dictionary else zlib.compressobj(ZLIB_LEVEL, zlib.DEFLATED, -15)
+
+    def encode(self, text):
+        data = text.encode('utf-8')
+        if self.codec == 'zstd':
+            return self.header + self._zstd.compress(data)
+        compressor = self._zlib.copy()
+        return self.header + compressor.compress(data) + compressor.flush()
+
+
+def get_decoder(codec, dictionary_id):
+    """Build (once per codec and dictionary) a function that decompresses a payload body to bytes."""
+    key = (codec, dictionary_id)
+    if key in _decoders:
+        return _decoders[key]
+
+    dictionary = None
+    if dictionary_id:
+        if dictionary_id not in _dictionaries:
+            raise ValueError(f"EventData compression dictionary {dictionary_id} is not loaded")
+        dictionary = _dictionaries[dictionary_id][1]
+
+    if codec == 'zstd':
+        zstandard = import_zstandard()
+        dict_data = zstandard.ZstdCompressionDict(dictionary) if dictionary else None
+        decoder = zstandard.ZstdDecompressor(dict_data=dict_data).decompress
+    else:
+        primed = zlib.decompressobj(-15, zdict=dictionary) if dictionary else zlib.decompressobj(-15)
+
+        def decoder(body):
+            decompressor = primed.copy()
+            return decompressor.decompress(body) + decompressor.flush()
+
+    _decoders[key] = decoder
+    return decoder
+
+
+def decode_event_data(value):
+    """Return the JSON text of a stored EventData value, whichever way it was encoded."""
+    if not isinstance(value, bytes):
+        return value
+
+    marker, dictionary_id = PAYLOAD_HEADER.unpack_from(value)
+    codec = CODEC_NAMES.get(marker)
+    if codec is None:
+        raise ValueError(f"Unknown EventData codec marker {marker}")
+    return get_decoder(codec, dictionary_id)(value[PAYLOAD_HEADER.size:]).decode('utf-8')
@@ -0,0 +1,163 @@
+import math
+from datetime import datetime, timedelta
+from cloudtail_modules.database_utils import get_last_successful_execution_history, get_execution_windows
+
+# Backfill shards are cut on a fixed grid so every rule, and every later run, splits history at the same points.
+SHARD_GRID_ORIGIN = datetime(1970, 1, 1)
+BACKFILL_SPAN = timedelta(days=89)
+MIN_SHARD_LENGTH = timedelta(hours=1)
+# Windows end this far behind now, leaving the provider time to deliver recent events.
+DEFAULT_LAG = timedelta(minutes=30)
+
+
+def get_lag(source):
+    """The configured lag of a data source ("lag", in seconds)."""
+    return timedelta(seconds=source['lag']) if 'lag' in source else DEFAULT_LAG
+
+
+def get_rule_window(cursor, attribute_key, attribute_value, now=None, scope=None, lag=DEFAULT_LAG):
+    """Return the (startTime, endTime) a rule still has to cover, capped at 30 days per run."""
+    now = now or datetime.now()
+    startTime = get_last_successful_execution_history(cursor, attribute_key, attribute_value, now, scope)
+    endTime = now - lag
+
+    if endTime <= startTime:
+        endTime = startTime + timedelta(minutes=1)
+
+    endTime = min(startTime + timedelta(days=30), endTime)
+    return startTime, endTime
+
+
+def merge_windows(windows):
+    merged = []
+    for start, end in sorted(windows):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def subtract_windows(start, end, covered):
+    """Return the parts of [start, end] not covered by the merged, sorted `covered` windows."""
+    missing = []
+    for covered_start, covered_end in covered:
+        if covered_end <= start:
+            continue
+        if covered_start >= end:
+            break
+        if covered_start > start:
+            missing.append((start, covered_start))
+        start = max(start, covered_end)
+    if start < end:
+        missing.append((start, end))
+    return missing
+
+
+def get_shard_length(shards):
+    """Length of a backfill shard: the full lookback split into `shards` parts, rounded up to whole hours."""
+    hours = math.ceil(BACKFILL_SPAN / MIN_SHARD_LENGTH / shards)
+    return max(MIN_SHARD_LENGTH, timedelta(hours=hours))
+
+
+def split_on_grid(start, end, shard_length):
+    windows = []
+    while start < end:
+        boundary = SHARD_GRID_ORIGIN + ((start - SHARD_GRID_ORIGIN) // shard_length + 1) * shard_length
+        windows.append((start, min(boundary, end)))
+        start = windows[-1][1]
+    return windows
+
+
+def get_rule_shards(cursor, attribute_key, attribute_value, now, shard_length, scope=None, lag=DEFAULT_LAG):
+    """
+    Return the (startTime, endTime) shards a rule still has to fetch to cover its whole history up to
+    the lag. Windows already fetched successfully are skipped, a shard that failed before is
+    retried with its original bounds (reusing its execution_history row and pagination checkpoint), and
+    the remaining gaps are cut on the shard grid.
+    """
+    rows = get_execution_windows(cursor, attribute_key, attribute_value, now - timedelta(days=90), scope)
+    origin = rows[0][0] if rows else now - timedelta(days=90) + timedelta(days=1)
+    endTime = now - lag
+    covered = merge_windows([(start, end) for start, end, isSuccessful in rows if isSuccessful])
+    failed = [(start, end) for start, end, isSuccessful in rows if not isSuccessful]
+
+    shards = []
+    for start, end in subtract_windows(origin, endTime, covered):
+        for failed_start, failed_end in failed:
+            if failed_start < start or failed_end > end:
+                continue
+            shards.extend(split_on_grid(start, failed_start, shard_length))
+            shards.append((failed_start, failed_end))
+            start = failed_end
+        shards.extend(split_on_grid(start, end, shard_length))
+    return shards
+
+
+def shard_rules(cursor, con, rules, shards, scope=None, now=None, lag=DEFAULT_LAG):
+    """
+    Backfill mode: replace every rule by one copy per shard of history it is still missing, so the
+    planner turns each shard into its own fetch and execution_history row instead of capping the run at 30 days.
+    """
+    now = now or datetime.now()
+    shard_length = get_shard_length(shards)
+    sharded = []
+    for rule in rules:
+        for startTime, endTime in get_rule_shards(cursor, rule['attribute_key'], rule['attribute_value'], now, shard_length, scope, lag):
+            sharded.append(dict(rule, startTime=startTime, endTime=endTime))
+    return sharded
+
+
+def group_rules_by_window(rules):
+    """Merge rules whose [startTime, endTime] windows overlap into shared fetch windows."""
+    groups = []
+    for rule in sorted(rules, key=lambda r: r['startTime']):
+        if groups and rule['startTime'] < groups[-1]['endTime']:
+            groups[-1]['rules'].append(rule)
+            groups[-1]['endTime'] = max(groups[-1]['endTime'], rule['endTime'])
+        else:
+            groups.append({'startTime': rule['startTime'], 'endTime': rule['endTime'], 'rules': [rule]})
+    return groups
+
+
+def plan_queries(rules):
+    """
+    Build the fetches needed to serve every rule.
+
+    Rules without a 'server_filter' share one unfiltered fetch per overlapping time window. A rule
+    with a server-side filter rides along on an unfiltered fetch that already covers its window,
+    otherwise rules with the same filter are grouped into their own filtered fetch.
+    """
+    scan_queries = [dict(group, server_filter=None) for group in group_rules_by_window([r for r in rules if not r['server_filter']])]
+
+    pending = {}
+    for rule in rules:
+        if not rule['server_filter']:
+            continue
+        covering = next((q for q in scan_queries if q['startTime'] <= rule['startTime'] and rule['endTime'] <= q['endTime']), None)
+        if covering:
+            covering['rules'].append(rule)
+        else:
+            pending.setdefault(rule['server_filter'], []).append(rule)
+
+    filtered_queries = []
+    for server_filter, filter_rules in pending.items():
+        for group in group_rules_by_window(filter_rules):
+            filtered_queries.append(dict(group, server_filter=server_filter))
+
+    return scan_queries + filtered_queries
+
+
+def to_local_naive(event_time):
+    if isinstance(event_time, str):
+        event_time = datetime.fromisoformat(event_time.replace('Z', '+00:00'))
+    if event_time.tzinfo is not None:
+        event_time = event_time.astimezone().replace(tzinfo=None)
+    return event_time
+
+
+def in_rule_window(rule, event_time):
+    """Check whether an event timestamp falls inside the window planned for a rule."""
+    if event_time is None:
+        return True
+    return rule['startTime'] <= to_local_naive(event_time) <= rule['endTime']
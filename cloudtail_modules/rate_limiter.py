@@ -0,0 +1,66 @@
+import random
+import threading
+import time
+
+# CloudTrail LookupEvents is throttled at roughly 2 requests per second per account and region.
+DEFAULT_REQUESTS_PER_SECOND = 2
+DEFAULT_MAX_RETRIES = 8
+MIN_REQUESTS_PER_SECOND = 0.1
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket: `acquire` blocks until a request may be sent. The refill rate adapts to
+    the API: it is halved on every throttle and grows back by a tenth of the configured rate per
+    successful call (AIMD), so all callers sharing the bucket slow down together.
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.max_rate = float(rate)
+        self.rate = self.max_rate
+        self.capacity = float(capacity or max(1, rate))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                self._refill()
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def on_throttle(self):
+        with self._lock:
+            self._refill()
+            self.rate = max(MIN_REQUESTS_PER_SECOND, self.rate / 2)
+            self.tokens = min(self.tokens, 0)
+
+    def on_success(self):
+        with self._lock:
+            if self.rate < self.max_rate:
+                self.rate = min(self.max_rate, self.rate + self.max_rate / 10)
+
+
+def backoff_delay(attempt, base=0.5, cap=30):
+    """Exponential backoff with full jitter for the given (zero-based) retry attempt."""
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+def get_rate_limiter(key, rate=DEFAULT_REQUESTS_PER_SECOND):
+    """Return the limiter shared by every caller using the same key, e.g. (account_id, region)."""
+    with _limiters_lock:
+        if key not in _limiters:
+            _limiters[key] = TokenBucket(rate)
+        return _limiters[key]
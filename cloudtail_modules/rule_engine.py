@@ -0,0 +1,103 @@
+import fnmatch
+import re
+from functools import lru_cache
+
+PATTERN_METACHARACTERS = re.compile(r'[.^$+?{}[\]|()]')
+
+
+def is_pattern(attribute_value):
+    """True when a rule value needs wildcard or regex matching instead of plain equality."""
+    return '*' in attribute_value or PATTERN_METACHARACTERS.search(attribute_value) is not None
+
+
+def compile_key_path(attribute_key):
+    return tuple(attribute_key.split("."))
+
+
+def get_nested_value(event, key_path):
+    value = event
+    for key in key_path:
+        if isinstance(value, dict):
+            value = value.get(key, "")
+        else:
+            return ""
+    return value
+
+
+def never_matches(value):
+    return False
+
+
+@lru_cache(maxsize=None)
+def compile_pattern(pattern):
+    """
+    Compile a rule value into a predicate once: plain equality, a translated glob when the value contains
+    '*', otherwise a regex anchored at the start of the value (re.match semantics).
+    """
+    if not is_pattern(pattern):
+        return lambda value: value == pattern
+
+    try:
+        if '*' in pattern:
+            regex = re.compile(fnmatch.translate(pattern))
+        else:
+            regex = re.compile(pattern)
+    except re.error:
+        print(f"\033[91m[!] Invalid regex pattern: {pattern}\033[0m")
+        return never_matches
+
+    return lambda value: isinstance(value, str) and regex.match(value) is not None
+
+
+def fuzzy_match(value, pattern):
+    return compile_pattern(pattern)(value)
+
+
+class RuleIndex:
+    """
+    Evaluates many lookup rules against one event at a time. Exact values on the same key collapse into
+    a single dict lookup, wildcard/regex values are compiled once, and rules without an attribute
+    condition match every event.
+
+    `value_getter(event, key_path)` resolves a key path on an event. It may return a tuple when a key
+    has several values on one event (any of them can match an exact rule).
+    """
+
+    def __init__(self, value_getter=get_nested_value):
+        self.value_getter = value_getter
+        self.exact = {}
+        self.patterns = []
+        self.unconditional = []
+
+    def add(self, rule, key_path=None, attribute_value=None):
+        if not (key_path and attribute_value):
+            self.unconditional.append(rule)
+        elif is_pattern(attribute_value):
+            self.patterns.append((key_path, compile_pattern(attribute_value), rule))
+        else:
+            self.exact.setdefault(key_path, {}).setdefault(attribute_value, []).append(rule)
+
+    @property
+    def conditional(self):
+        """False when every rule matches unconditionally, so events need not be inspected at all."""
+        return bool(self.exact or self.patterns)
+
+    def match(self, event):
+        matched = list(self.unconditional)
+
+        for key_path, rules_by_value in self.exact.items():
+            value = self.value_getter(event, key_path)
+            candidates = set(value) if isinstance(value, tuple) else (value,)
+            for candidate in candidates:
+                try:
+                    rules = rules_by_value.get(candidate)
+                except TypeError:
+                    continue
+                if rules:
+                    matched.extend(rules)
+
+        for key_path, matcher, rule in self.patterns:
+            if matcher(self.value_getter(event, key_path)):
+                matched.append(rule)
+
+        return matched
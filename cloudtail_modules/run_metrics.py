@@ -0,0 +1,244 @@
+import json
+import os
+import threading
+import time
+import uuid
+from datetime import datetime
+
+# Prefix of every metric name in the Prometheus textfile.
+PROMETHEUS_PREFIX = 'cloudtail'
+
+COUNTER_HELP = {
+    'api_calls': "Cloud API requests sent, retries included.",
+    'pages': "Result pages received.",
+    'response_bytes': "Bytes of API responses received, as reported by Content-Length.",
+    'throttles': "Requests rejected by the API's rate limit.",
+    'retries': "Requests sent again after a throttle or transient error.",
+    'events_fetched': "Events received from the source.",
+    'rule_matches': "Events a rule matched within its time window.",
+    'events_stored': "Events a rule added to the events table (duplicates excluded).",
+    'archive_files': "CloudTrail log files read from an archive.",
+    'archive_bytes': "Bytes of CloudTrail log files read from an archive.",
+}
+
+
+def label_key(labels):
+    return tuple(sorted((name, str(value)) for name, value in labels.items() if value is not None))
+
+
+class StageClock:
+    """
+    Splits one loop's wall time into stages without a lock per event: `lap(stage)` charges the time since
+    the previous lap to `stage`, and `stop` adds the totals to the run's metrics.
+    """
+
+    __slots__ = ('metrics', 'labels', 'seconds', 'last')
+
+    def __init__(self, metrics, labels):
+        self.metrics = metrics
+        self.labels = labels
+        self.seconds = {}
+        self.last = time.perf_counter()
+
+    def lap(self, stage):
+        now = time.perf_counter()
+        self.seconds[stage] = self.seconds.get(stage, 0.0) + now - self.last
+        self.last = now
+
+    def stop(self):
+        for stage, seconds in self.seconds.items():
+            self.metrics.observe(stage, seconds, **self.labels)
+        self.seconds = {}
+
+
+class RunMetrics:
+    """
+    Counters and stage timings of one run, keyed by name and labels (source, account, region, rule).
+    Safe to update from every job thread; stage times are seconds of wall time summed over calls.
+    """
+
+    enabled = True
+
+    def __init__(self):
+        self.run_id = uuid.uuid4().hex
+        self.startedAt = datetime.now()
+        self.counters = {}
+        self.stages = {}
+        self._started = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def add(self, name, value=1, **labels):
+        key = (name, label_key(labels))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, stage, seconds, **labels):
+        key = (stage, label_key(labels))
+        with self._lock:
+            count, total = self.stages.get(key, (0, 0.0))
+            self.stages[key] = (count + 1, total + seconds)
+
+    def clock(self, **labels):
+        return StageClock(self, labels)
+
+    def elapsed(self):
+        return time.perf_counter() - self._started
+
+    def is_empty(self):
+        return not self.counters and not self.stages
+
+    def stage_totals(self):
+        """{stage: seconds} summed over every label set."""
+        totals = {}
+        with self._lock:
+            for (stage, _), (_, seconds) in self.stages.items():
+                totals[stage] = totals.get(stage, 0.0) + seconds
+        return totals
+
+    def summary(self):
+        totals = self.stage_totals()
+        return ', '.join(f"{stage} {seconds:.2f}s" for stage, seconds in sorted(totals.items(), key=lambda item: item[1], reverse=True))
+
+    def rows(self):
+        """(Kind, Name, Labels JSON, Value, Count) for every counter and stage, as stored in run_metrics."""
+        with self._lock:
+            counters = sorted(self.counters.items())
+            stages = sorted(self.stages.items())
+        rows = [('counter', name, json.dumps(dict(labels)), value, None) for (name, labels), value in counters]
+        rows += [('stage', name, json.dumps(dict(labels)), seconds, count) for (name, labels), (count, seconds) in stages]
+        return rows
+
+
+class NullStageClock:
+    __slots__ = ()
+
+    def lap(self, stage):
+        pass
+
+    def stop(self):
+        pass
+
+
+class NullMetrics:
+    """Stands in for RunMetrics when metrics are disabled: every call returns at once and nothing is kept."""
+
+    enabled = False
+    _clock = NullStageClock()
+
+    def add(self, name, value=1, **labels):
+        pass
+
+    def observe(self, stage, seconds, **labels):
+        pass
+
+    def clock(self, **labels):
+        return self._clock
+
+
+NULL_METRICS = NullMetrics()
+
+
+def record_rule_metrics(metrics, rules, eventCount, labels):
+    """Count a query's fetched events and, per rule, its matches and the events it added to the table."""
+    metrics.add('events_fetched', eventCount, **labels)
+    for rule in rules:
+        metrics.add('rule_matches', rule['resultCount'], rule=rule['rule_name'], **labels)
+        metrics.add('events_stored', rule['eventCount'], rule=rule['rule_name'], **labels)
+
+
+def get_metrics_config(config):
+    return config.get('metrics') or {}
+
+
+def create_metrics(config):
+    """A RunMetrics if the config has an enabled "metrics" section, NULL_METRICS otherwise."""
+    metrics_config = get_metrics_config(config)
+    if not metrics_config or not metrics_config.get('enabled', True):
+        return NULL_METRICS
+    return RunMetrics()
+
+
+def escape_label_value(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{escape_label_value(value)}"' for name, value in labels) + '}'
+
+
+def format_prometheus(runs):
+    """
+    Render the metrics of one or more (database, RunMetrics) pairs in the Prometheus text exposition
+    format. Counters become <prefix>_<name>_total, stage timings <prefix>_stage_seconds_total and
+    <prefix>_stage_calls_total.
+    """
+    counters = {}
+    stages = []
+    for database, metrics in runs:
+        with metrics._lock:
+            for (name, labels), value in metrics.counters.items():
+                counters.setdefault(name, []).append((labels + (('database', database),), value))
+            for (stage, labels), (count, seconds) in metrics.stages.items():
+                stages.append((tuple(sorted(labels + (('database', database), ('stage', stage)))), count, seconds))
+
+    lines = []
+    for name in sorted(counters):
+        metric = f"{PROMETHEUS_PREFIX}_{name}_total"
+        lines.append(f"# HELP {metric} {COUNTER_HELP.get(name, name)}")
+        lines.append(f"# TYPE {metric} counter")
+        lines += [f"{metric}{format_labels(sorted(labels))} {value}" for labels, value in sorted(counters[name])]
+
+    if stages:
+        for metric, help_text, column in ((f"{PROMETHEUS_PREFIX}_stage_seconds_total", "Wall time spent in each pipeline stage.", 2),
+                                          (f"{PROMETHEUS_PREFIX}_stage_calls_total", "Timed sections recorded for each pipeline stage.", 1)):
+            lines.append(f"# HELP {metric} {help_text}")
+            lines.append(f"# TYPE {metric} counter")
+            lines += [f"{metric}{format_labels(stage[0])} {round(stage[column], 6)}" for stage in sorted(stages)]
+
+    lines.append(f"# HELP {PROMETHEUS_PREFIX}_last_run_timestamp_seconds When the metrics were last written.")
+    lines.append(f"# TYPE {PROMETHEUS_PREFIX}_last_run_timestamp_seconds gauge")
+    lines.append(f"{PROMETHEUS_PREFIX}_last_run_timestamp_seconds {time.time():.3f}")
+    return '\n'.join(lines) + '\n'
+
+
+def build_run_report(runs):
+    """The JSON run report: per database, every counter and stage with its labels, plus the run's duration."""
+    report = {'generatedAt': datetime.now().isoformat(), 'databases': {}}
+    for database, metrics in runs:
+        rows = metrics.rows()
+        report['databases'][database] = {
+            'runId': metrics.run_id,
+            'startedAt': metrics.startedAt.isoformat(),
+            'durationSeconds': round(metrics.elapsed(), 3),
+            'counters': [{'name': name, 'labels': json.loads(labels), 'value': value} for kind, name, labels, value, _ in rows if kind == 'counter'],
+            'stages': [{'stage': name, 'labels': json.loads(labels), 'seconds': round(seconds, 6), 'calls': count} for kind, name, labels, seconds, count in rows if kind == 'stage'],
+        }
+    return report
+
+
+def write_atomically(path, text):
+    """Write to a temporary file next to `path` and rename it over, so scrapers never read a partial file."""
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(temp_path, 'w') as file:
+        file.write(text)
+    os.replace(temp_path, path)
+
+
+def export_metrics(config, runs):
+    """Write the Prometheus textfile and the JSON run report configured under "metrics", if any."""
+    metrics_config = get_metrics_config(config)
+    runs = [(database, metrics) for database, metrics in runs if metrics.enabled and not metrics.is_empty()]
+    if not runs:
+        return
+
+    try:
+        if metrics_config.get('textfile'):
+            write_atomically(metrics_config['textfile'], format_prometheus(runs))
+        if metrics_config.get('report'):
+            write_atomically(metrics_config['report'], json.dumps(build_run_report(runs), indent=2))
+    except OSError as e:
+        print(f"\033[91m[!] Could not write run metrics: {e}\033[0m")
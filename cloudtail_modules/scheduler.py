@@ -0,0 +1,109 @@
+import random
+import signal
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+DEFAULT_MAX_WORKERS = 4
+DEFAULT_POLL_INTERVAL = 300  # seconds between polls of one account/region or subscription in watch mode
+POLL_JITTER = 0.1  # each wait is drawn from interval * (1 +/- POLL_JITTER) so sources do not poll in lockstep
+
+# Set on SIGTERM/SIGINT in watch mode. Fetch loops check it between pages so in-flight lookups stop promptly.
+shutdown = threading.Event()
+
+
+def get_max_workers(config):
+    return config.get('max_workers', DEFAULT_MAX_WORKERS)
+
+
+def get_poll_interval(source):
+    return source.get('poll_interval', DEFAULT_POLL_INTERVAL)
+
+
+def run_timed_job(label, func):
+    jobStartTime = time.perf_counter()
+    try:
+        func()
+        status = 'ok'
+    except Exception as e:
+        print(f"\033[91m[!] Job '{label}' failed: {e}\033[0m")
+        status = 'failed'
+    return label, status, time.perf_counter() - jobStartTime
+
+
+def print_job_summary(results, elapsed):
+    if not results:
+        return
+
+    width = max(len(label) for label, _, _ in results)
+    print(f"\n\033[96m[*] Job timing summary ({len(results)} {'job' if len(results) == 1 else 'jobs'}, {elapsed:.2f}s wall clock):\033[0m")
+    for label, status, duration in sorted(results, key=lambda r: r[2], reverse=True):
+        colour = '\033[92m' if status == 'ok' else '\033[91m'
+        print(f"    \033[94m{label.ljust(width)}\033[0m  {duration:8.2f}s  {colour}{status}\033[0m")
+
+
+def run_jobs(jobs, max_workers=DEFAULT_MAX_WORKERS):
+    """Run (label, callable[, poll interval]) jobs on a bounded thread pool and print how long each one took."""
+    runStartTime = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(run_timed_job, label, func) for label, func, *_ in jobs]
+        results = [future.result() for future in futures]
+    print_job_summary(results, time.perf_counter() - runStartTime)
+    return results
+
+
+def request_shutdown(signum, frame):
+    print(f"\n\033[93m[!] Received {signal.Signals(signum).name}. Finishing in-flight lookups and shutting down...\033[0m")
+    shutdown.set()
+
+
+def next_poll_delay(interval):
+    return interval * random.uniform(1 - POLL_JITTER, 1 + POLL_JITTER)
+
+
+def watch_job(label, func, interval, slots, results, on_poll=None):
+    """
+    Poll one job every `interval` seconds (with jitter) until shutdown; `slots` bounds how many polls run at
+    once. `on_poll`, if given, is called after every poll.
+    """
+    delay = random.uniform(0, interval * POLL_JITTER)
+    while not shutdown.wait(delay):
+        with slots:
+            if shutdown.is_set():
+                break
+            result = run_timed_job(label, func)
+        results.append(result)
+        if on_poll:
+            on_poll()
+        delay = next_poll_delay(interval)
+        colour = '\033[92m' if result[1] == 'ok' else '\033[91m'
+        print(f"\033[96m[*] Poll of \033[94m{label}\033[96m finished in {result[2]:.2f}s ({colour}{result[1]}\033[96m). Next poll in {delay:.0f}s.\033[0m")
+
+
+def watch_jobs(jobs, max_workers=DEFAULT_MAX_WORKERS, on_poll=None):
+    """
+    Run (label, callable, poll interval) jobs repeatedly until SIGTERM/SIGINT, at most `max_workers` at a
+    time. Each job resumes from its own execution history, so a poll only fetches what arrived since the
+    last one. Returns the results of every poll once all in-flight polls have finished.
+    """
+    shutdown.clear()
+    handlers = {}
+    if threading.current_thread() is threading.main_thread():
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            handlers[signum] = signal.signal(signum, request_shutdown)
+
+    slots = threading.BoundedSemaphore(max_workers)
+    results = []
+    threads = [threading.Thread(target=watch_job, args=(label, func, interval, slots, results, on_poll), name=label, daemon=True)
+               for label, func, interval in jobs]
+    try:
+        for thread in threads:
+            thread.start()
+        # Joining with a timeout keeps the main thread responsive to signals.
+        for thread in threads:
+            while thread.is_alive():
+                thread.join(1)
+    finally:
+        for signum, handler in handlers.items():
+            signal.signal(signum, handler)
+    return results
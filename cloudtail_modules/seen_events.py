@@ -0,0 +1,75 @@
+import hashlib
+import math
+
+DEFAULT_CAPACITY = 100000
+DEFAULT_ERROR_RATE = 0.001
+
+
+class BloomFilter:
+    """Fixed-size Bloom filter over strings, sized for `capacity` items at roughly `error_rate` false positives."""
+
+    def __init__(self, capacity=DEFAULT_CAPACITY, error_rate=DEFAULT_ERROR_RATE):
+        capacity = max(1, capacity)
+        self.size = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hash_count = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, item):
+        # Double hashing: the k positions are derived from two 64-bit halves of one digest.
+        digest = hashlib.blake2b(item.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hash_count)]
+
+    def add(self, item):
+        for position in self._positions(item):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, item):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(item))
+
+
+class SeenEventIndex:
+    """
+    Event IDs already stored in one events table. A Bloom filter answers "maybe stored" in memory;
+    the table's primary key confirms it, so a false positive only costs one lookup and the event is
+    still written. Adds happen under the database writer's lock, lookups do not need it (a missed
+    bit only means the INSERT OR IGNORE drops the duplicate as before).
+    """
+
+    def __init__(self, capacity=DEFAULT_CAPACITY, error_rate=DEFAULT_ERROR_RATE):
+        self.error_rate = error_rate
+        self.reset(capacity)
+        self.preloaded = 0
+        self.rebuilds = 0
+        self.checked = 0
+        self.duplicates = 0
+        self.false_positives = 0
+
+    def reset(self, capacity):
+        """Start over with an empty filter sized for `capacity` IDs; the lookup statistics are kept."""
+        self.capacity = capacity
+        self.bloom = BloomFilter(capacity, self.error_rate)
+        self.added = 0
+
+    def is_full(self):
+        """True once more IDs were added than the filter was sized for, so false positives exceed the target."""
+        return self.added > self.capacity
+
+    def update(self, event_ids):
+        for event_id in event_ids:
+            if event_id:
+                self.bloom.add(event_id)
+                self.added += 1
+
+    def maybe_stored(self, event_ids):
+        return [event_id for event_id in event_ids if event_id and event_id in self.bloom]
+
+    def record(self, checked, candidates, duplicates):
+        self.checked += checked
+        self.duplicates += duplicates
+        self.false_positives += candidates - duplicates
+
+    def summary(self):
+        hit_rate = self.duplicates / self.checked if self.checked else 0.0
+        return f"{self.duplicates}/{self.checked} matched events already stored ({hit_rate:.1%}), {self.false_positives} Bloom false positives, {self.preloaded} IDs preloaded, {self.rebuilds} rebuilds"